@@ -1,18 +1,36 @@
-import firebase_admin
-from firebase_admin import credentials, firestore
+"""Admin post tools for the admin_posts collection.
+
+Usable as a library or from the command line:
+
+    python admin_post_creator.py list --limit 50 --fields title,category
+    python admin_post_creator.py count
+    python admin_post_creator.py seed --count 100000
+    python admin_post_creator.py delete --all --yes
+    python admin_post_creator.py create-user-post USER_ID --title ... --content ...
+
+Listing pages through the collection with query cursors and reads only the
+requested fields. Creates and deletes go through a Firestore BulkWriter,
+which batches writes, runs batches in parallel up to ``max_ops_per_second``
+and retries failed writes. Progress is reported on stderr.
+
+Run without arguments for the old interactive menu.
+"""
+import argparse
 import datetime
+import os
 import random
+import sys
+import time
 
-# Initialize Firebase Admin SDK
-# You'll need to download your service account key from Firebase Console
-# cred = credentials.Certificate('path/to/your/serviceAccountKey.json')
-# firebase_admin.initialize_app(cred)
-
-# For testing, you can use the default credentials if you're running this locally
-# firebase_admin.initialize_app()
+import firebase_admin
+from firebase_admin import credentials, firestore
+from google.cloud.firestore_v1.bulk_writer import BulkWriterOptions, SendMode
+from google.cloud.firestore_v1.field_path import FieldPath
 
-# Initialize Firestore
-db = firestore.client()
+COLLECTION = 'admin_posts'
+DEFAULT_PAGE_SIZE = 500
+DEFAULT_MAX_OPS_PER_SECOND = 2000
+LIST_FIELDS = ['title', 'content', 'category', 'likes', 'createdAt']
 
 # Sample admin posts data
 sample_posts = [
@@ -27,8 +45,6 @@ sample_posts = [
         'likes': 42,
         'shares': 15,
         'isPublished': True,
-        'createdAt': datetime.datetime.now(),
-        'updatedAt': datetime.datetime.now(),
     },
     {
         'title': 'Motivational Quote',
@@ -41,8 +57,6 @@ sample_posts = [
         'likes': 38,
         'shares': 12,
         'isPublished': True,
-        'createdAt': datetime.datetime.now(),
-        'updatedAt': datetime.datetime.now(),
     },
     {
         'title': 'Life Wisdom',
@@ -55,8 +69,6 @@ sample_posts = [
         'likes': 55,
         'shares': 23,
         'isPublished': True,
-        'createdAt': datetime.datetime.now(),
-        'updatedAt': datetime.datetime.now(),
     },
     {
         'title': 'Spiritual Guidance',
@@ -69,8 +81,6 @@ sample_posts = [
         'likes': 67,
         'shares': 18,
         'isPublished': True,
-        'createdAt': datetime.datetime.now(),
-        'updatedAt': datetime.datetime.now(),
     },
     {
         'title': 'Success Mindset',
@@ -83,93 +93,214 @@ sample_posts = [
         'likes': 29,
         'shares': 8,
         'isPublished': True,
-        'createdAt': datetime.datetime.now(),
-        'updatedAt': datetime.datetime.now(),
     },
 ]
 
-def create_sample_admin_posts():
+_db = None
+
+
+def get_db(credentials_path=None):
+    """Firestore client, initializing Firebase on first use
+
+    Uses ``credentials_path`` or GOOGLE_APPLICATION_CREDENTIALS when set,
+    otherwise the default credentials.
+    """
+    global _db
+    if _db is None:
+        if not firebase_admin._apps:
+            path = credentials_path or os.getenv('GOOGLE_APPLICATION_CREDENTIALS')
+            if path:
+                firebase_admin.initialize_app(credentials.Certificate(path))
+            else:
+                firebase_admin.initialize_app()
+        _db = firestore.client()
+    return _db
+
+
+class Progress:
+    """Prints ``label: done[/total] (rate/s)`` to stderr at most every ``interval`` seconds"""
+
+    def __init__(self, label, total=None, interval=2.0, stream=sys.stderr):
+        self.label = label
+        self.total = total
+        self.interval = interval
+        self.stream = stream
+        self.done = 0
+        self.failed = 0
+        self._started = time.monotonic()
+        self._last = 0.0
+
+    def update(self, count=1, failed=0):
+        self.done += count
+        self.failed += failed
+        now = time.monotonic()
+        if now - self._last >= self.interval:
+            self._last = now
+            self._print(now)
+
+    def finish(self):
+        self._print(time.monotonic())
+        return self.done
+
+    def _print(self, now):
+        elapsed = max(now - self._started, 1e-9)
+        total = f"/{self.total}" if self.total is not None else ''
+        failed = f", {self.failed} failed" if self.failed else ''
+        print(f"{self.label}: {self.done}{total} ({self.done / elapsed:.0f}/s{failed})", file=self.stream)
+
+
+def _bulk_writer(db, max_ops_per_second):
+    return db.bulk_writer(options=BulkWriterOptions(
+        initial_ops_per_second=min(500, max_ops_per_second),
+        max_ops_per_second=max_ops_per_second,
+        mode=SendMode.parallel,
+    ))
+
+
+def iter_admin_posts(db=None, fields=None, published_only=True, page_size=DEFAULT_PAGE_SIZE, limit=None):
+    """Yield admin post snapshots newest first, one page query at a time
+
+    ``fields`` limits which fields are read (createdAt is always included
+    because the cursor needs it).
+    """
+    db = db or get_db()
+    query = db.collection(COLLECTION)
+    if published_only:
+        query = query.where('isPublished', '==', True)
+    query = query.order_by('createdAt', direction=firestore.Query.DESCENDING)
+    if fields is not None:
+        query = query.select(sorted(set(fields) | {'createdAt'}))
+
+    yielded = 0
+    cursor = None
+    while limit is None or yielded < limit:
+        size = page_size if limit is None else min(page_size, limit - yielded)
+        page_query = query.limit(size)
+        if cursor is not None:
+            page_query = page_query.start_after(cursor)
+        page = list(page_query.stream())
+        for snapshot in page:
+            yield snapshot
+        yielded += len(page)
+        if len(page) < size:
+            return
+        cursor = page[-1]
+
+
+def count_admin_posts(db=None, published_only=False):
+    """Server-side count, without reading any documents"""
+    db = db or get_db()
+    query = db.collection(COLLECTION)
+    if published_only:
+        query = query.where('isPublished', '==', True)
+    return query.count().get()[0][0].value
+
+
+def bulk_create_admin_posts(posts, db=None, max_ops_per_second=DEFAULT_MAX_OPS_PER_SECOND, progress=None):
+    """Create every post in ``posts`` (any iterable) through a BulkWriter; returns the number created"""
+    db = db or get_db()
+    collection = db.collection(COLLECTION)
+    progress = progress or Progress('created')
+    writer = _bulk_writer(db, max_ops_per_second)
+    writer.on_write_result(lambda reference, result, bulk_writer: progress.update())
+    writer.on_write_error(lambda error, bulk_writer: _retry_or_count(error, progress))
+    for post in posts:
+        writer.create(collection.document(), post)
+    writer.close()
+    return progress.finish()
+
+
+def bulk_delete_admin_posts(db=None, published_only=False, page_size=DEFAULT_PAGE_SIZE,
+                            max_ops_per_second=DEFAULT_MAX_OPS_PER_SECOND, progress=None):
+    """Delete admin posts page by page, reading document names only; returns the number deleted"""
+    db = db or get_db()
+    query = db.collection(COLLECTION)
+    if published_only:
+        query = query.where('isPublished', '==', True)
+    query = query.order_by(FieldPath.document_id()).select([FieldPath.document_id()]).limit(page_size)
+
+    progress = progress or Progress('deleted')
+    writer = _bulk_writer(db, max_ops_per_second)
+    writer.on_write_result(lambda reference, result, bulk_writer: progress.update())
+    writer.on_write_error(lambda error, bulk_writer: _retry_or_count(error, progress))
+    cursor = None
+    while True:
+        page = list((query.start_after(cursor) if cursor is not None else query).stream())
+        for snapshot in page:
+            writer.delete(snapshot.reference)
+        if len(page) < page_size:
+            break
+        cursor = page[-1]
+    writer.close()
+    return progress.finish()
+
+
+def _retry_or_count(error, progress):
+    if error.attempts < 5:
+        return True
+    progress.update(0, failed=1)
+    return False
+
+
+def generate_sample_posts(count, start=None):
+    """``count`` posts cycled from the samples, two hours apart going back from ``start``"""
+    start = start or datetime.datetime.now()
+    for i in range(count):
+        post = dict(sample_posts[i % len(sample_posts)])
+        post['createdAt'] = start - datetime.timedelta(hours=i * 2)
+        post['updatedAt'] = post['createdAt']
+        post['likes'] = random.randint(0, 100)
+        yield post
+
+
+def create_sample_admin_posts(count=None, db=None):
     """Create sample admin posts in Firestore"""
-    try:
-        # Get reference to admin_posts collection
-        admin_posts_ref = db.collection('admin_posts')
-        
-        # Add each sample post
-        for i, post_data in enumerate(sample_posts):
-            # Add some time variation to posts
-            post_data['createdAt'] = datetime.datetime.now() - datetime.timedelta(hours=i*2)
-            post_data['updatedAt'] = post_data['createdAt']
-            
-            # Add the post to Firestore
-            doc_ref = admin_posts_ref.add(post_data)
-            print(f"Created admin post {i+1}: {post_data['title']}")
-        
-        print(f"Successfully created {len(sample_posts)} admin posts!")
-        
-    except Exception as e:
-        print(f"Error creating admin posts: {e}")
-
-def create_user_post(user_id, post_data):
-    """Create a post for a specific user"""
-    try:
-        # Add user-specific data
-        post_data['createdBy'] = user_id
-        post_data['createdAt'] = datetime.datetime.now()
-        post_data['updatedAt'] = datetime.datetime.now()
-        post_data['isPublished'] = True
-        
-        # Add to admin_posts collection
-        admin_posts_ref = db.collection('admin_posts')
-        doc_ref = admin_posts_ref.add(post_data)
-        
-        print(f"Created user post: {post_data['title']}")
-        return doc_ref[1].id
-        
-    except Exception as e:
-        print(f"Error creating user post: {e}")
-        return None
-
-def get_admin_posts():
-    """Get all admin posts"""
-    try:
-        admin_posts_ref = db.collection('admin_posts')
-        posts = admin_posts_ref.where('isPublished', '==', True).order_by('createdAt', direction=firestore.Query.DESCENDING).stream()
-        
-        for post in posts:
-            print(f"Post ID: {post.id}")
-            print(f"Title: {post.get('title')}")
-            print(f"Content: {post.get('content')}")
-            print(f"Likes: {post.get('likes')}")
-            print("---")
-            
-    except Exception as e:
-        print(f"Error getting admin posts: {e}")
-
-def delete_all_admin_posts():
+    count = count or len(sample_posts)
+    return bulk_create_admin_posts(generate_sample_posts(count), db=db, progress=Progress('created', total=count))
+
+
+def create_user_post(user_id, post_data, db=None):
+    """Create a post for a specific user; returns the new document ID"""
+    db = db or get_db()
+    post_data = dict(post_data)
+    post_data['createdBy'] = user_id
+    post_data['createdAt'] = datetime.datetime.now()
+    post_data['updatedAt'] = post_data['createdAt']
+    post_data['isPublished'] = True
+
+    _, doc_ref = db.collection(COLLECTION).add(post_data)
+    print(f"Created user post: {post_data['title']}")
+    return doc_ref.id
+
+
+def get_admin_posts(limit=None, fields=LIST_FIELDS, db=None, out=sys.stdout):
+    """Print published admin posts, newest first"""
+    shown = 0
+    for post in iter_admin_posts(db=db, fields=fields, limit=limit):
+        data = post.to_dict()
+        print(f"Post ID: {post.id}", file=out)
+        for field in fields:
+            if field != 'createdAt':
+                print(f"{field.capitalize()}: {data.get(field)}", file=out)
+        print("---", file=out)
+        shown += 1
+    return shown
+
+
+def delete_all_admin_posts(db=None):
     """Delete all admin posts (use with caution!)"""
-    try:
-        admin_posts_ref = db.collection('admin_posts')
-        posts = admin_posts_ref.stream()
-        
-        deleted_count = 0
-        for post in posts:
-            post.reference.delete()
-            deleted_count += 1
-        
-        print(f"Deleted {deleted_count} admin posts")
-        
-    except Exception as e:
-        print(f"Error deleting admin posts: {e}")
+    return bulk_delete_admin_posts(db=db)
 
-if __name__ == "__main__":
+
+def interactive_menu():
     print("Admin Post Creator")
     print("1. Create sample admin posts")
     print("2. Get all admin posts")
     print("3. Delete all admin posts")
     print("4. Create user post")
-    
+
     choice = input("Enter your choice (1-4): ")
-    
+
     if choice == "1":
         create_sample_admin_posts()
     elif choice == "2":
@@ -185,19 +316,84 @@ if __name__ == "__main__":
         title = input("Enter post title: ")
         content = input("Enter post content: ")
         category = input("Enter category: ")
-        
-        post_data = {
-            'title': title,
-            'content': content,
-            'category': category,
-            'language': 'English',
-            'imageUrl': 'https://images.unsplash.com/photo-1506905925346-21bda4d32df4?w=500',
-            'adminName': 'User',
-            'adminPhotoUrl': None,
-            'likes': 0,
-            'shares': 0,
-        }
-        
-        create_user_post(user_id, post_data)
+        create_user_post(user_id, user_post_data(title, content, category))
     else:
-        print("Invalid choice") 
\ No newline at end of file
+        print("Invalid choice")
+
+
+def user_post_data(title, content, category):
+    return {
+        'title': title,
+        'content': content,
+        'category': category,
+        'language': 'English',
+        'imageUrl': 'https://images.unsplash.com/photo-1506905925346-21bda4d32df4?w=500',
+        'adminName': 'User',
+        'adminPhotoUrl': None,
+        'likes': 0,
+        'shares': 0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Admin post tools for the admin_posts collection')
+    parser.add_argument('--credentials', help='service account key (default: GOOGLE_APPLICATION_CREDENTIALS)')
+    parser.add_argument('--max-ops-per-second', type=int, default=DEFAULT_MAX_OPS_PER_SECOND)
+    parser.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE)
+    commands = parser.add_subparsers(dest='command')
+
+    list_cmd = commands.add_parser('list', help='print published posts, newest first')
+    list_cmd.add_argument('--limit', type=int)
+    list_cmd.add_argument('--fields', default=','.join(LIST_FIELDS), help='comma-separated fields to read')
+
+    count_cmd = commands.add_parser('count', help='count posts without reading them')
+    count_cmd.add_argument('--published', action='store_true')
+
+    seed_cmd = commands.add_parser('seed', help='create sample posts')
+    seed_cmd.add_argument('--count', type=int, default=len(sample_posts))
+
+    delete_cmd = commands.add_parser('delete', help='delete posts')
+    delete_cmd.add_argument('--all', action='store_true', help='required: delete every post')
+    delete_cmd.add_argument('--published', action='store_true', help='only published posts')
+    delete_cmd.add_argument('--yes', action='store_true', help='do not ask for confirmation')
+
+    user_cmd = commands.add_parser('create-user-post', help='create a post for a user')
+    user_cmd.add_argument('user_id')
+    user_cmd.add_argument('--title', required=True)
+    user_cmd.add_argument('--content', required=True)
+    user_cmd.add_argument('--category', required=True)
+
+    args = parser.parse_args(argv)
+    if args.command is None:
+        get_db(args.credentials)
+        interactive_menu()
+        return 0
+
+    db = get_db(args.credentials)
+    if args.command == 'list':
+        fields = [field for field in args.fields.split(',') if field]
+        shown = get_admin_posts(limit=args.limit, fields=fields, db=db)
+        print(f"{shown} posts", file=sys.stderr)
+    elif args.command == 'count':
+        print(count_admin_posts(db=db, published_only=args.published))
+    elif args.command == 'seed':
+        bulk_create_admin_posts(generate_sample_posts(args.count), db=db,
+                                max_ops_per_second=args.max_ops_per_second,
+                                progress=Progress('created', total=args.count))
+    elif args.command == 'delete':
+        if not args.all and not args.published:
+            parser.error('delete needs --all or --published')
+        if not args.yes:
+            scope = 'published' if args.published else 'all'
+            if input(f"Delete {scope} admin posts? (yes/no): ").lower() != 'yes':
+                print("Operation cancelled")
+                return 1
+        bulk_delete_admin_posts(db=db, published_only=args.published, page_size=args.page_size,
+                                max_ops_per_second=args.max_ops_per_second)
+    elif args.command == 'create-user-post':
+        create_user_post(args.user_id, user_post_data(args.title, args.content, args.category), db=db)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
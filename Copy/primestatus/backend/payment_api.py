@@ -1,9 +1,13 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 import razorpay
+import asyncio
 import json
 import os
 from datetime import datetime
+from firebase_admin import credentials, firestore, initialize_app
+from razorpay_async import AsyncRazorpayClient, BackgroundLoop
+from plan_catalogue import PaymentLinkCache, PlanCatalogue, PlanError, payment_notes
 
 app = Flask(__name__)
 CORS(app)
@@ -12,9 +16,33 @@ CORS(app)
 RAZORPAY_KEY_ID = os.getenv('RAZORPAY_KEY_ID', 'rzp_test_YOUR_KEY_ID')
 RAZORPAY_KEY_SECRET = os.getenv('RAZORPAY_KEY_SECRET', 'YOUR_KEY_SECRET')
 
-# Initialize Razorpay client
+# Initialize Razorpay client (signature checks only; API calls go through razorpay_api)
 client = razorpay.Client(auth=(RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET))
 
+# Pooled async client, run on one background loop so connections are reused across requests
+razorpay_loop = BackgroundLoop()
+razorpay_api = AsyncRazorpayClient(
+    RAZORPAY_KEY_ID,
+    RAZORPAY_KEY_SECRET,
+    base_url=os.getenv('RAZORPAY_BASE_URL'),
+    timeout=float(os.getenv('RAZORPAY_TIMEOUT', 10)),
+    max_retries=int(os.getenv('RAZORPAY_MAX_RETRIES', 3)),
+)
+
+# Initialize Firebase (plan catalogue)
+if os.path.exists('serviceAccountKey.json'):
+    initialize_app(credentials.Certificate('serviceAccountKey.json'))
+else:
+    initialize_app()
+db = firestore.client()
+
+# subscriptionPlans, read once and kept current by a snapshot listener
+plan_catalogue = PlanCatalogue(db)
+plan_catalogue.watch()
+
+# Unpaid links are handed out again for repeat taps on the same plan
+payment_links = PaymentLinkCache(ttl_seconds=int(os.getenv('PAYMENT_LINK_TTL_SECONDS', 1800)))
+
 @app.route('/api/payments/create-order', methods=['POST'])
 def create_payment_order():
     try:
@@ -27,6 +55,20 @@ def create_payment_order():
         notes = data.get('notes', {})
         prefill = data.get('prefill', {})
         
+        # Catalogue plans set their own price and notes; the client's amount must agree
+        plan = None
+        plan_id = data.get('plan_id') or notes.get('plan_id')
+        if plan_id:
+            user_id = data.get('user_id') or notes.get('user_id')
+            if not user_id:
+                return jsonify({'success': False, 'error': 'user_id is required with plan_id'}), 400
+            try:
+                plan = plan_catalogue.validate(plan_id, amount_paise=amount, usage_type=data.get('usage_type'))
+            except PlanError as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
+            amount = plan.amount_paise
+            notes = dict(notes, **payment_notes(plan, user_id))
+        
         # Create Razorpay order
         order_data = {
             'amount': amount,
@@ -35,26 +77,35 @@ def create_payment_order():
             'notes': notes
         }
         
-        order = client.order.create(data=order_data)
-        
-        # Create payment link
+        # Payment links don't take an order ID, so both calls can run at once
         payment_link_data = {
             'amount': amount,
             'currency': currency,
-            'order_id': order['id'],
             'prefill': prefill,
             'notes': notes,
             'callback_url': 'https://your-app.com/payment/callback',  # Replace with your callback URL
             'cancel_url': 'https://your-app.com/payment/cancel',      # Replace with your cancel URL
         }
-        
-        payment_link = client.payment_link.create(data=payment_link_data)
+        if receipt:
+            payment_link_data['reference_id'] = receipt
+        
+        if plan is None:
+            order, payment_link = razorpay_loop.run(create_order_and_link(order_data, payment_link_data))
+            order_id, reused = order['id'], False
+        else:
+            payment_link, reused = razorpay_loop.run(payment_links.get_or_create(
+                (notes['user_id'], plan.id),
+                lambda expire_by: create_order_and_link_record(order_data, dict(payment_link_data, expire_by=expire_by)),
+                razorpay_api.fetch_payment_link,
+            ))
+            order_id = payment_link['order_id']
         
         return jsonify({
             'success': True,
-            'order_id': order['id'],
+            'order_id': order_id,
             'payment_url': payment_link['short_url'],
-            'payment_link_id': payment_link['id']
+            'payment_link_id': payment_link['id'],
+            'reused': reused
         })
         
     except Exception as e:
@@ -63,6 +114,17 @@ def create_payment_order():
             'error': str(e)
         }), 400
 
+async def create_order_and_link(order_data, payment_link_data):
+    return await asyncio.gather(
+        razorpay_api.create_order(order_data),
+        razorpay_api.create_payment_link(payment_link_data),
+    )
+
+async def create_order_and_link_record(order_data, payment_link_data):
+    """Both calls for a cacheable plan checkout, with the order ID kept on the link"""
+    order, payment_link = await create_order_and_link(order_data, payment_link_data)
+    return dict(payment_link, order_id=order['id'])
+
 @app.route('/api/payments/verify', methods=['POST'])
 def verify_payment():
     try:
@@ -135,7 +197,9 @@ def payment_webhook():
 def health_check():
     return jsonify({
         'status': 'healthy',
-        'timestamp': datetime.now().isoformat()
+        'timestamp': datetime.now().isoformat(),
+        'plans': plan_catalogue.stats(),
+        'payment_links': payment_links.stats()
     })
 
 if __name__ == '__main__':
@@ -0,0 +1,187 @@
+"""
+Server-side subscription plan catalogue.
+
+Plans live in the Firestore ``subscriptionPlans`` collection (title,
+subtitle, price in INR, duration in days, usageType, isActive). The
+catalogue reads the collection once, keeps it in memory and refreshes it
+through a snapshot listener (or after ``ttl_seconds`` when listening is
+off), so validating a checkout never costs a Firestore read.
+
+Amounts, durations and usage types sent to Razorpay come from the plan,
+never from the client, and are written into the payment notes under the
+keys the webhook's update_user_subscription() reads.
+
+PaymentLinkCache hands back the still-unpaid link for a (user, plan) pair
+instead of creating (and texting) a new one on every retry tap.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+Plan = namedtuple('Plan', 'id title subtitle amount_paise duration_days usage_type is_active')
+
+
+class PlanError(ValueError):
+    """A checkout request that doesn't match the catalogue"""
+
+
+def plan_from_doc(plan_id, data):
+    return Plan(
+        id=plan_id,
+        title=data.get('title', ''),
+        subtitle=data.get('subtitle', ''),
+        amount_paise=int(round(float(data.get('price', 0)) * 100)),
+        duration_days=int(data.get('duration', 30)),
+        usage_type=data.get('usageType', 'Personal'),
+        is_active=bool(data.get('isActive', False)),
+    )
+
+
+class PlanCatalogue:
+    def __init__(self, db, collection='subscriptionPlans', ttl_seconds=300):
+        self.db = db
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+        self._plans = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        self._watch = None
+
+    def reload(self):
+        plans = {
+            doc.id: plan_from_doc(doc.id, doc.to_dict() or {})
+            for doc in self.db.collection(self.collection).stream()
+        }
+        self._replace(plans)
+        return len(plans)
+
+    def _replace(self, plans):
+        with self._lock:
+            self._plans = plans
+            self._loaded_at = time.monotonic()
+        logger.info("Plan catalogue loaded", extra={"plans": len(plans)})
+
+    def watch(self):
+        """Keep the catalogue current from a snapshot listener instead of the TTL"""
+        if self._watch is None:
+            self._watch = self.db.collection(self.collection).on_snapshot(self._on_snapshot)
+
+    def _on_snapshot(self, docs, changes, read_time):
+        self._replace({doc.id: plan_from_doc(doc.id, doc.to_dict() or {}) for doc in docs})
+
+    def stop(self):
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+
+    def _current(self):
+        with self._lock:
+            stale = self._loaded_at is None or (
+                self._watch is None and time.monotonic() - self._loaded_at > self.ttl_seconds
+            )
+        if stale:
+            self.reload()
+        with self._lock:
+            return self._plans
+
+    def get(self, plan_id):
+        return self._current().get(plan_id)
+
+    def plans(self, usage_type=None):
+        return sorted(
+            (plan for plan in self._current().values()
+             if plan.is_active and (usage_type is None or plan.usage_type == usage_type)),
+            key=lambda plan: plan.amount_paise,
+        )
+
+    def validate(self, plan_id, amount_paise=None, usage_type=None):
+        """Return the active plan for a checkout, or raise PlanError"""
+        plan = self.get(plan_id)
+        if plan is None:
+            raise PlanError(f"Unknown plan {plan_id!r}")
+        if not plan.is_active:
+            raise PlanError(f"Plan {plan_id!r} is not available")
+        if plan.amount_paise <= 0:
+            raise PlanError(f"Plan {plan_id!r} has no price")
+        if amount_paise is not None and int(amount_paise) != plan.amount_paise:
+            raise PlanError(f"Amount does not match plan {plan_id!r}")
+        if usage_type is not None and usage_type != plan.usage_type:
+            raise PlanError(f"Plan {plan_id!r} is for {plan.usage_type} users")
+        return plan
+
+    def stats(self):
+        with self._lock:
+            age = None if self._loaded_at is None else round(time.monotonic() - self._loaded_at, 1)
+            return {'plans': len(self._plans), 'age_seconds': age, 'watching': self._watch is not None}
+
+
+def payment_notes(plan, user_id):
+    """Notes read back by the webhook when the payment is captured"""
+    return {
+        'user_id': user_id,
+        'plan_id': plan.id,
+        'plan_title': plan.title,
+        'duration': str(plan.duration_days),
+        'usage_type': plan.usage_type,
+    }
+
+
+class PaymentLinkCache:
+    """Reuse a (user, plan) payment link until it expires or stops being payable
+
+    Links are created with an ``expire_by`` ``ttl_seconds`` ahead and handed
+    out again until ``reuse_margin`` seconds before that, as long as Razorpay
+    still reports them as ``created``. Concurrent requests for the same key
+    wait for the first one instead of creating their own link.
+    """
+
+    def __init__(self, ttl_seconds=1800, reuse_margin=120, max_entries=10000):
+        self.ttl_seconds = ttl_seconds
+        self.reuse_margin = reuse_margin
+        self.max_entries = max_entries
+        self._links = {}
+        self._locks = {}
+        self.reused = 0
+        self.created = 0
+
+    def expire_by(self):
+        return int(time.time() + self.ttl_seconds)
+
+    async def get_or_create(self, key, create, fetch):
+        """``create()`` makes a link (passing expire_by), ``fetch(link_id)`` re-reads one"""
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            cached = self._links.get(key)
+            if cached is not None and cached.get('expire_by', 0) - self.reuse_margin > time.time():
+                current = await fetch(cached['id'])
+                if current.get('status') == 'created':
+                    self.reused += 1
+                    # Keep anything the caller stored alongside the link
+                    return dict(cached, **current), True
+            expire_by = self.expire_by()
+            link = await create(expire_by)
+            link.setdefault('expire_by', expire_by)
+            self.created += 1
+            self._links[key] = link
+            self._prune()
+            return link, False
+
+    def _prune(self):
+        now = time.time()
+        for key in [key for key, link in self._links.items() if link.get('expire_by', 0) <= now]:
+            self._links.pop(key, None)
+            lock = self._locks.get(key)
+            if lock is not None and not lock.locked():
+                self._locks.pop(key, None)
+        while len(self._links) > self.max_entries:
+            key = next(iter(self._links))
+            self._links.pop(key)
+            self._locks.pop(key, None)
+
+    def stats(self):
+        return {'links': len(self._links), 'reused': self.reused, 'created': self.created}
@@ -0,0 +1,110 @@
+"""Micro-benchmark for the webhook ingress path.
+
+Times signature verification on its own (the previous str-based HMAC
+against the precomputed-key version) and full POST /api/payment/callback
+requests through Flask's test client for valid, badly signed and
+oversized payloads. Background workers are disabled and the queue goes
+to a temporary SQLite file, so nothing reaches Firestore.
+
+    python benchmarks/webhook_ingress.py --iterations 5000
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import sys
+import tempfile
+import time
+
+SECRET = 'benchmark_webhook_secret'
+PRIMESTATUS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def sample_payload(index):
+    return json.dumps({
+        'event': 'payment.captured',
+        'payload': {'payment': {'entity': {
+            'id': f"pay_bench{index:08d}",
+            'amount': 9900,
+            'order_id': 'order_bench',
+            'notes': {'user_id': 'bench_user', 'plan_id': 'bench_plan', 'duration': '30'},
+        }}},
+    }).encode('utf-8')
+
+
+def sign(body):
+    return hmac.new(SECRET.encode('utf-8'), body, hashlib.sha256).hexdigest()
+
+
+def legacy_verify(payload, signature):
+    """The previous implementation: decoded text, re-encoded, fresh key per call"""
+    expected = hmac.new(SECRET.encode('utf-8'), payload.encode('utf-8'), hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+def timed(fn, iterations):
+    samples = []
+    for i in range(iterations):
+        started = time.perf_counter()
+        fn(i)
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    return {
+        'mean_us': round(sum(samples) / len(samples) * 1e6, 2),
+        'p50_us': round(samples[len(samples) // 2] * 1e6, 2),
+        'p99_us': round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1e6, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=5000)
+    parser.add_argument('--oversized-bytes', type=int, default=1024 * 1024)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='webhook-bench-')
+    os.environ.update({
+        'RAZORPAY_WEBHOOK_SECRET': SECRET,
+        'WEBHOOK_QUEUE_PATH': os.path.join(tmpdir, 'queue.sqlite3'),
+        'WEBHOOK_WORKER_THREADS': '0',
+        'LOG_LEVEL': os.getenv('LOG_LEVEL', 'ERROR'),
+    })
+    sys.path.insert(0, PRIMESTATUS_DIR)
+    import webhook_server
+
+    body = sample_payload(0)
+    signature = sign(body)
+    text = body.decode('utf-8')
+    client = webhook_server.app.test_client()
+    oversized = b'{"event": "payment.captured", "pad": "' + b'x' * args.oversized_bytes + b'"}'
+
+    def post(data, signature, index):
+        return client.post('/api/payment/callback', data=data, headers={
+            'X-Razorpay-Signature': signature,
+            'X-Razorpay-Event-Id': f"evt_bench_{index}",
+            'Content-Type': 'application/json',
+        })
+
+    signed = [(b, sign(b)) for b in (sample_payload(i) for i in range(args.iterations))]
+    expected_status = {'request_valid': 200, 'request_invalid_signature': 401, 'request_oversized': 413}
+    cases = {
+        'verify_legacy': lambda i: legacy_verify(text, signature),
+        'verify_precomputed': lambda i: webhook_server.verify_webhook_signature(body, signature),
+        'request_valid': lambda i: post(signed[i][0], signed[i][1], i),
+        'request_invalid_signature': lambda i: post(body, '0' * 64, i),
+        'request_oversized': lambda i: post(oversized, signature, i),
+    }
+
+    for name, fn in cases.items():
+        if name in expected_status:
+            status = fn(0).status_code
+            if status != expected_status[name]:
+                sys.exit(f"{name}: expected HTTP {expected_status[name]}, got {status}")
+        result = timed(fn, args.iterations)
+        print(f"{name:<28} mean {result['mean_us']:9.2f} us  p50 {result['p50_us']:9.2f} us  "
+              f"p99 {result['p99_us']:9.2f} us")
+
+
+if __name__ == '__main__':
+    main()
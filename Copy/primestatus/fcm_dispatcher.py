@@ -0,0 +1,307 @@
+"""
+Push notification dispatch.
+
+Notifications are queued and sent in batches through messaging.send_each
+(at most 500 messages per call), with a bounded number of batches in
+flight. FCM tokens come from an LRU cache in front of the users
+collection; misses for a whole batch are filled with one get_all() that
+reads only the fcmToken field.
+
+When FCM rejects a token the user's document is read again. If the app
+has stored a refreshed token the cache is updated and the message is
+resent to it; otherwise the stale token is removed from the user.
+
+The sender is pluggable: FirebaseSender talks to FCM through the Admin
+SDK, HttpSender talks to anything that speaks the FCM v1 HTTP API, such as
+the local stub in fcm_stub.py.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from google.cloud.firestore_v1 import DELETE_FIELD
+
+from tiered_cache import JSON, TieredCache
+
+logger = logging.getLogger(__name__)
+
+# messaging.send_each accepts at most this many messages per call
+MAX_MESSAGES_PER_CALL = 500
+
+# FCM error codes that mean the token will never work again. INVALID_ARGUMENT
+# is not one of them: FCM also returns it for a malformed message (oversized
+# or badly keyed data), and pruning on it would delete valid tokens
+INVALID_TOKEN_ERRORS = {'UNREGISTERED', 'SENDER_ID_MISMATCH'}
+
+
+class TokenCache:
+    """user_id -> FCM token, with TTL, LRU eviction and batched misses
+
+    Backed by a memory-only TieredCache namespace; every entry is counted
+    as TOKEN_ENTRY_BYTES, so the byte budget caps it at ``max_entries``.
+    """
+
+    TOKEN_ENTRY_BYTES = 256
+
+    def __init__(self, db, max_entries=50000, ttl_seconds=3600):
+        self.db = db
+        self.cache = TieredCache(max_memory_bytes=max_entries * self.TOKEN_ENTRY_BYTES)
+        self._tokens = self.cache.namespace(
+            'fcm_tokens', ttl_seconds=ttl_seconds, serializer=JSON, sizeof=lambda token: self.TOKEN_ENTRY_BYTES,
+        )
+
+    def get_many(self, user_ids):
+        return self._tokens.get_many(user_ids, self._load_many)
+
+    def _load_many(self, user_ids):
+        refs = [self.db.collection('users').document(user_id) for user_id in user_ids]
+        return {
+            snapshot.id: (snapshot.to_dict() or {}).get('fcmToken') if snapshot.exists else None
+            for snapshot in self.db.get_all(refs, field_paths=['fcmToken'])
+        }
+
+    def refresh(self, user_id):
+        """Re-read one user's token, bypassing the cache; returns (token, snapshot)"""
+        snapshot = self.db.collection('users').document(user_id).get(field_paths=['fcmToken'])
+        token = (snapshot.to_dict() or {}).get('fcmToken') if snapshot.exists else None
+        self._tokens.set(user_id, token)
+        return token, snapshot
+
+    def invalidate(self, user_id):
+        self._tokens.delete(user_id)
+
+    def stats(self):
+        stats = self._tokens.stats()
+        return {'entries': stats['entries'], 'hits': stats['memory_hits'], 'misses': stats['misses'],
+                'evictions': stats['memory_evictions']}
+
+
+class FirebaseSender:
+    """Sends through the Admin SDK; returns (message_id, error_code) per notification"""
+
+    def __init__(self, app=None):
+        self.app = app
+
+    def __call__(self, notifications):
+        from firebase_admin import exceptions, messaging
+
+        messages = [
+            messaging.Message(
+                token=n['token'],
+                notification=messaging.Notification(title=n['title'], body=n['body']),
+                data=n['data'],
+            )
+            for n in notifications
+        ]
+        results = []
+        for response in messaging.send_each(messages, app=self.app).responses:
+            if response.success:
+                results.append((response.message_id, None))
+            elif isinstance(response.exception, messaging.UnregisteredError):
+                results.append((None, 'UNREGISTERED'))
+            elif isinstance(response.exception, messaging.SenderIdMismatchError):
+                results.append((None, 'SENDER_ID_MISMATCH'))
+            elif isinstance(response.exception, exceptions.InvalidArgumentError):
+                results.append((None, 'INVALID_ARGUMENT'))
+            else:
+                results.append((None, getattr(response.exception, 'code', None) or 'UNKNOWN'))
+        return results
+
+
+class HttpSender:
+    """Sends to an FCM v1 compatible endpoint over a keep-alive session"""
+
+    def __init__(self, base_url, project_id, timeout=10, max_workers=8):
+        self.url = f"{base_url.rstrip('/')}/v1/projects/{project_id}/messages:send"
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='fcm-http')
+
+    def _send_one(self, notification):
+        message = {
+            'token': notification['token'],
+            'notification': {'title': notification['title'], 'body': notification['body']},
+            'data': notification['data'],
+        }
+        try:
+            response = self.session.post(self.url, json={'message': message}, timeout=self.timeout)
+        except requests.RequestException:
+            return None, 'UNAVAILABLE'
+        body = response.json() if response.content else {}
+        if response.ok:
+            return body.get('name'), None
+        error = body.get('error', {})
+        for detail in error.get('details', []):
+            if detail.get('errorCode'):
+                return None, detail['errorCode']
+        return None, error.get('status', 'UNKNOWN')
+
+    def __call__(self, notifications):
+        return list(self.executor.map(self._send_one, notifications))
+
+
+class NotificationDispatcher:
+    def __init__(self, db, sender, token_cache=None, batch_size=MAX_MESSAGES_PER_CALL,
+                 max_latency=0.5, max_concurrent_batches=4):
+        self.db = db
+        self.sender = sender
+        self.tokens = token_cache or TokenCache(db)
+        self.batch_size = min(batch_size, MAX_MESSAGES_PER_CALL)
+        self.max_latency = max_latency
+        self._pending = []
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        # Bounds how many send_each calls are in flight at once
+        self._batches = threading.BoundedSemaphore(max_concurrent_batches)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent_batches, thread_name_prefix='fcm-batch')
+        self.sent = 0
+        self.failed = 0
+        self.no_token = 0
+        self.resent = 0
+        self.pruned = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='fcm-dispatcher', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+        self.flush()
+        self._executor.shutdown(wait=True)
+
+    def notify(self, user_id, title, body, data=None):
+        """Queue a notification; it goes out with the next batch"""
+        notification = {
+            'user_id': user_id,
+            'title': title,
+            'body': body,
+            # FCM data payloads only carry strings
+            'data': {key: str(value) for key, value in (data or {}).items()},
+        }
+        with self._lock:
+            if not self._pending:
+                self._oldest = time.monotonic()
+            self._pending.append(notification)
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self._wakeup.set()
+
+    def flush(self):
+        """Send everything queued so far and wait for it"""
+        with self._lock:
+            pending, self._pending, self._oldest = self._pending, [], None
+        for start in range(0, len(pending), self.batch_size):
+            self._send_batch(pending[start:start + self.batch_size])
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self._lock:
+                oldest = self._oldest
+                size = len(self._pending)
+                if size >= self.batch_size or (oldest is not None and time.monotonic() - oldest >= self.max_latency):
+                    batch, self._pending = self._pending[:self.batch_size], self._pending[self.batch_size:]
+                    self._oldest = time.monotonic() if self._pending else None
+                else:
+                    batch = None
+            if batch is None:
+                timeout = self.max_latency if oldest is None else max(0.0, oldest + self.max_latency - time.monotonic())
+                self._wakeup.wait(timeout)
+                self._wakeup.clear()
+                continue
+            self._batches.acquire()
+            self._executor.submit(self._send_batch_and_release, batch)
+
+    def _send_batch_and_release(self, batch):
+        try:
+            self._send_batch(batch)
+        except Exception:
+            logger.exception("Notification batch failed", extra={"notifications": len(batch)})
+        finally:
+            self._batches.release()
+
+    def _send_batch(self, batch):
+        tokens = self.tokens.get_many([n['user_id'] for n in batch])
+        ready = []
+        for notification in batch:
+            token = tokens.get(notification['user_id'])
+            if token:
+                ready.append(dict(notification, token=token))
+            else:
+                self.no_token += 1
+                logger.warning("No FCM token for user", extra={"user_id": notification['user_id']})
+        if not ready:
+            return
+
+        rejected = []
+        for notification, (message_id, error) in zip(ready, self.sender(ready)):
+            if error is None:
+                self.sent += 1
+            elif error in INVALID_TOKEN_ERRORS:
+                rejected.append(notification)
+            else:
+                self.failed += 1
+                logger.warning("FCM send failed", extra={"user_id": notification['user_id'], "error": error})
+        if rejected:
+            self._handle_rejected(rejected)
+        logger.info("Notification batch sent", extra={"notifications": len(ready), "rejected": len(rejected)})
+
+    def _handle_rejected(self, rejected):
+        """Resend to refreshed tokens, prune the ones that are really stale"""
+        retry = []
+        for notification in rejected:
+            token, snapshot = self.tokens.refresh(notification['user_id'])
+            if token and token != notification['token']:
+                retry.append(dict(notification, token=token))
+            elif token:
+                self._prune(notification['user_id'], snapshot)
+            else:
+                self.no_token += 1
+        if not retry:
+            return
+        for notification, (message_id, error) in zip(retry, self.sender(retry)):
+            if error is None:
+                self.sent += 1
+                self.resent += 1
+            else:
+                self.failed += 1
+                logger.warning("FCM resend failed", extra={"user_id": notification['user_id'], "error": error})
+
+    def _prune(self, user_id, snapshot):
+        self.tokens.invalidate(user_id)
+        try:
+            # Only if the document is unchanged since we read the stale token,
+            # so a refresh that lands in between is never deleted
+            snapshot.reference.update(
+                {'fcmToken': DELETE_FIELD},
+                option=self.db.write_option(last_update_time=snapshot.update_time),
+            )
+            self.pruned += 1
+            logger.info("Pruned invalid FCM token", extra={"user_id": user_id})
+        except Exception as e:
+            logger.warning("Could not prune FCM token", extra={"user_id": user_id, "error": str(e)})
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            'pending': pending,
+            'sent': self.sent,
+            'failed': self.failed,
+            'no_token': self.no_token,
+            'resent': self.resent,
+            'pruned': self.pruned,
+            'tokens': self.tokens.stats(),
+        }
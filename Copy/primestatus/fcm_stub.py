@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the FCM v1 send endpoint.
+
+Accepts every message except those whose token starts with ``stale``,
+which get the UNREGISTERED error FCM returns for expired tokens. GET /stats
+shows what was received. Point the webhook server at it with:
+
+    python fcm_stub.py --port 9099 --latency-ms 20
+    FCM_ENDPOINT=http://127.0.0.1:9099 python webhook_server.py
+"""
+
+import argparse
+import itertools
+import threading
+import time
+
+from flask import Flask, jsonify, request
+
+app = Flask(__name__)
+app.config['LATENCY_MS'] = 0
+
+_lock = threading.Lock()
+_ids = itertools.count(1)
+_stats = {'accepted': 0, 'unregistered': 0, 'by_token': {}}
+
+
+@app.route('/v1/projects/<project>/messages:send', methods=['POST'])
+def send(project):
+    if app.config['LATENCY_MS']:
+        time.sleep(app.config['LATENCY_MS'] / 1000.0)
+    message = (request.get_json(silent=True) or {}).get('message', {})
+    token = message.get('token', '')
+    with _lock:
+        _stats['by_token'][token] = _stats['by_token'].get(token, 0) + 1
+        if token.startswith('stale'):
+            _stats['unregistered'] += 1
+        else:
+            _stats['accepted'] += 1
+            message_id = next(_ids)
+    if token.startswith('stale'):
+        return jsonify({'error': {
+            'code': 404,
+            'message': 'Requested entity was not found.',
+            'status': 'NOT_FOUND',
+            'details': [{
+                '@type': 'type.googleapis.com/google.firebase.fcm.v1.FcmError',
+                'errorCode': 'UNREGISTERED',
+            }],
+        }}), 404
+    return jsonify({'name': f"projects/{project}/messages/{message_id}"})
+
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    with _lock:
+        return jsonify(_stats)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local FCM v1 stub')
+    parser.add_argument('--port', type=int, default=9099)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    args = parser.parse_args()
+    app.config['LATENCY_MS'] = args.latency_ms
+    app.run(host='127.0.0.1', port=args.port, threaded=True)
@@ -0,0 +1,124 @@
+"""
+Write coalescing for Firestore.
+
+ArchiveWriter buffers independent document creates (webhook archive
+entries) and commits them as WriteBatches, flushing when a batch is full
+or when the oldest buffered write has waited ``max_latency`` seconds. A
+burst of webhooks then costs one commit RPC per batch instead of one per
+event. add() returns a Future that resolves once the write is committed
+(or fails if its batch is dropped), so callers only treat the write as
+done when it really is.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+# Firestore rejects batches with more than 500 writes
+MAX_BATCH_WRITES = 500
+
+
+class ArchiveWriter:
+    def __init__(self, db, collection, max_batch=100, max_latency=1.0, max_retries=3):
+        self.db = db
+        self.collection = collection
+        self.max_batch = min(max_batch, MAX_BATCH_WRITES)
+        self.max_latency = max_latency
+        self.max_retries = max_retries
+        self._buffer = []
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.commits = 0
+        self.written = 0
+        self.failed = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='archive-writer', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+        self.flush()
+
+    def add(self, data):
+        """Buffer one document create; returns a Future resolved when it is committed"""
+        future = Future()
+        with self._lock:
+            if not self._buffer:
+                self._oldest = time.monotonic()
+            self._buffer.append((data, future))
+            full = len(self._buffer) >= self.max_batch
+        if full:
+            self._wakeup.set()
+        return future
+
+    def flush(self):
+        """Commit everything buffered so far; returns the number of documents written"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._buffer, self._oldest = self._buffer, [], None
+            written = 0
+            for start in range(0, len(pending), self.max_batch):
+                written += self._commit(pending[start:start + self.max_batch])
+            return written
+
+    def _commit(self, chunk):
+        for attempt in range(1, self.max_retries + 1):
+            batch = self.db.batch()
+            for data, _ in chunk:
+                batch.set(self.db.collection(self.collection).document(), data)
+            try:
+                batch.commit()
+                self.commits += 1
+                self.written += len(chunk)
+                for _, future in chunk:
+                    future.set_result(None)
+                return len(chunk)
+            except Exception as e:
+                logger.warning("Archive batch commit failed", extra={
+                    "attempt": attempt, "documents": len(chunk), "error": str(e),
+                })
+                time.sleep(min(2 ** attempt * 0.1, 2.0))
+        self.failed += len(chunk)
+        logger.error("Dropping archive batch", extra={"documents": len(chunk)})
+        for _, future in chunk:
+            future.set_exception(RuntimeError("Archive batch commit failed"))
+        return 0
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self._lock:
+                oldest = self._oldest
+                size = len(self._buffer)
+            if size >= self.max_batch:
+                timeout = 0
+            elif oldest is not None:
+                timeout = max(0.0, oldest + self.max_latency - time.monotonic())
+            else:
+                timeout = self.max_latency
+            if timeout > 0:
+                self._wakeup.wait(timeout)
+                self._wakeup.clear()
+                continue
+            self.flush()
+
+    def stats(self):
+        with self._lock:
+            buffered = len(self._buffer)
+        return {
+            'buffered': buffered,
+            'commits': self.commits,
+            'written': self.written,
+            'failed': self.failed,
+        }
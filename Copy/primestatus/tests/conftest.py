@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The webhook modules live next to webhook_server.py, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,77 @@
+import pytest
+
+from webhook_dedup import APPLY, DUPLICATE, STALE, EventLedger, dedup_keys
+
+
+@pytest.fixture
+def ledger_path(tmp_path):
+    return str(tmp_path / 'ledger.sqlite3')
+
+
+def test_unseen_event_is_applied(ledger_path):
+    ledger = EventLedger(ledger_path)
+    assert ledger.check('evt_1', 'payment.captured', 'pay_1') == APPLY
+
+
+def test_recorded_event_is_a_duplicate_from_the_lru(ledger_path):
+    ledger = EventLedger(ledger_path)
+    ledger.record('evt_1', 'payment.captured', 'pay_1')
+    assert ledger.check('evt_1', 'payment.captured', 'pay_1') == DUPLICATE
+    assert ledger.lru_hits == 1
+    assert ledger.table_hits == 0
+
+
+def test_same_payment_event_under_new_delivery_id_is_a_duplicate(ledger_path):
+    ledger = EventLedger(ledger_path)
+    ledger.record('evt_1', 'payment.captured', 'pay_1')
+    assert ledger.check('evt_2', 'payment.captured', 'pay_1') == DUPLICATE
+
+
+def test_duplicates_are_found_in_sqlite_after_lru_eviction(ledger_path):
+    ledger = EventLedger(ledger_path, lru_size=2)
+    ledger.record('evt_1', 'payment.captured', 'pay_1')
+    ledger.record('evt_2', 'payment.captured', 'pay_2')
+    assert not any(key in ledger._lru for key in dedup_keys('evt_1', 'payment.captured', 'pay_1'))
+
+    assert ledger.check('evt_1', 'payment.captured', 'pay_1') == DUPLICATE
+    assert ledger.table_hits == 1
+    # The table hit is promoted back into the LRU
+    assert ledger.check('evt_1', 'payment.captured', 'pay_1') == DUPLICATE
+    assert ledger.table_hits == 1
+
+
+def test_duplicates_survive_a_restart(ledger_path):
+    EventLedger(ledger_path).record('evt_1', 'payment.captured', 'pay_1')
+    restarted = EventLedger(ledger_path)
+    assert restarted.check('evt_1', 'payment.captured', 'pay_1') == DUPLICATE
+    assert restarted.table_hits == 1
+
+
+def test_earlier_lifecycle_event_after_a_later_one_is_stale(ledger_path):
+    ledger = EventLedger(ledger_path)
+    ledger.record('evt_2', 'payment.captured', 'pay_1')
+    assert ledger.check('evt_1', 'payment.failed', 'pay_1') == STALE
+    assert ledger.check('evt_0', 'payment.authorized', 'pay_1') == STALE
+
+
+def test_payment_state_only_moves_forward(ledger_path):
+    ledger = EventLedger(ledger_path)
+    ledger.record('evt_2', 'payment.captured', 'pay_1')
+    # Recording an older event (e.g. forced through) must not roll the state back
+    ledger.record('evt_1', 'payment.failed', 'pay_1')
+    assert ledger.check('evt_3', 'payment.authorized', 'pay_1') == STALE
+    assert ledger.check('evt_4', 'payment.failed', 'pay_2') == APPLY
+
+
+def test_unranked_events_are_never_stale(ledger_path):
+    ledger = EventLedger(ledger_path)
+    ledger.record('evt_1', 'payment.captured', 'pay_1')
+    assert ledger.check('evt_2', 'refund.created', 'pay_1') == APPLY
+
+
+def test_purge_forgets_old_keys_and_states(ledger_path):
+    ledger = EventLedger(ledger_path)
+    ledger.record('evt_1', 'payment.captured', 'pay_1')
+    assert ledger.purge(older_than_seconds=3600) == 0
+    assert ledger.purge(older_than_seconds=-1) == 3
+    assert EventLedger(ledger_path).check('evt_1', 'payment.captured', 'pay_1') == APPLY
@@ -0,0 +1,139 @@
+import time
+from concurrent.futures import Future
+
+import pytest
+
+from webhook_queue import WebhookQueue, WebhookWorkers
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return WebhookQueue(str(tmp_path / 'queue.sqlite3'), max_attempts=3, base_delay=0.01, max_delay=0.01)
+
+
+def test_enqueue_ignores_repeated_event_id(queue):
+    assert queue.enqueue('evt_1', 'payment.captured', b'{}', ordering_key='pay_1')
+    assert not queue.enqueue('evt_1', 'payment.captured', b'{}', ordering_key='pay_1')
+    assert queue.stats() == {'pending': 1}
+
+
+def test_claim_marks_processing_and_returns_none_when_empty(queue):
+    queue.enqueue('evt_1', 'payment.captured', b'body', ordering_key='pay_1')
+    row = queue.claim()
+    assert row['event_id'] == 'evt_1'
+    assert row['body'] == b'body'
+    assert queue.stats() == {'processing': 1}
+    assert queue.claim() is None
+
+
+def test_events_for_one_payment_are_claimed_one_at_a_time_in_order(queue):
+    queue.enqueue('evt_1', 'payment.authorized', b'{}', ordering_key='pay_1')
+    queue.enqueue('evt_2', 'payment.captured', b'{}', ordering_key='pay_1')
+    queue.enqueue('evt_3', 'payment.captured', b'{}', ordering_key='pay_2')
+
+    first = queue.claim()
+    other = queue.claim()
+    assert first['event_id'] == 'evt_1'
+    # evt_2 waits for evt_1; another payment's event isn't held up
+    assert other['event_id'] == 'evt_3'
+    assert queue.claim() is None
+
+    queue.complete(first['id'])
+    assert queue.claim()['event_id'] == 'evt_2'
+
+
+def test_later_event_waits_for_earlier_one_in_retry(queue):
+    queue.enqueue('evt_1', 'payment.authorized', b'{}', ordering_key='pay_1')
+    queue.enqueue('evt_2', 'payment.captured', b'{}', ordering_key='pay_1')
+
+    first = queue.claim()
+    assert queue.fail(first['id'], first['attempts'], RuntimeError('boom')) == 'pending'
+    # evt_1 is pending again but not due yet; evt_2 must not overtake it
+    assert queue.claim() is None
+
+    time.sleep(0.03)
+    retried = queue.claim()
+    assert retried['event_id'] == 'evt_1'
+    assert retried['attempts'] == 1
+
+
+def test_events_without_ordering_key_are_independent(queue):
+    queue.enqueue('evt_1', 'order.paid', b'{}')
+    queue.enqueue('evt_2', 'order.paid', b'{}')
+    assert {queue.claim()['event_id'], queue.claim()['event_id']} == {'evt_1', 'evt_2'}
+
+
+def test_fail_gives_up_after_max_attempts(queue):
+    queue.enqueue('evt_1', 'payment.captured', b'{}', ordering_key='pay_1')
+    row = queue.claim()
+    attempts = row['attempts']
+    for status in ('pending', 'pending', 'dead'):
+        assert queue.fail(row['id'], attempts, RuntimeError('boom')) == status
+        attempts += 1
+    assert queue.stats() == {'dead': 1}
+
+
+def test_recover_requeues_interrupted_events(queue):
+    queue.enqueue('evt_1', 'payment.captured', b'{}', ordering_key='pay_1')
+    queue.claim()
+    assert queue.recover() == 1
+    assert queue.claim()['event_id'] == 'evt_1'
+
+
+def test_purge_done_keeps_unfinished_events(queue):
+    queue.enqueue('evt_1', 'payment.captured', b'{}', ordering_key='pay_1')
+    queue.enqueue('evt_2', 'payment.captured', b'{}', ordering_key='pay_2')
+    queue.complete(queue.claim()['id'])
+    assert queue.purge_done(older_than_seconds=0) == 1
+    assert queue.stats() == {'pending': 1}
+
+
+def test_workers_retry_failed_events_until_they_succeed(queue):
+    calls = []
+
+    def handler(row):
+        calls.append(row['event_id'])
+        if len(calls) == 1:
+            raise RuntimeError('transient')
+
+    workers = WebhookWorkers(queue, handler, threads=1, poll_interval=0.01, purge_interval=0)
+    queue.enqueue('evt_1', 'payment.captured', b'{}', ordering_key='pay_1')
+    workers.start()
+    try:
+        deadline = time.time() + 5
+        while queue.stats() != {'done': 1} and time.time() < deadline:
+            time.sleep(0.01)
+    finally:
+        workers.stop()
+    assert calls == ['evt_1', 'evt_1']
+    assert queue.stats() == {'done': 1}
+
+
+def test_event_returning_a_future_stays_processing_until_it_resolves(queue):
+    pending = []
+
+    def handler(row):
+        pending.append(Future())
+        return pending[-1]
+
+    def wait_for(stats):
+        deadline = time.time() + 5
+        while queue.stats() != stats and time.time() < deadline:
+            time.sleep(0.01)
+        return queue.stats()
+
+    workers = WebhookWorkers(queue, handler, threads=1, poll_interval=0.01, purge_interval=0)
+    queue.enqueue('evt_1', 'payment.failed', b'{}', ordering_key='pay_1')
+    workers.start()
+    try:
+        assert wait_for({'processing': 1}) == {'processing': 1}
+        # A dropped archive write is retried, not acknowledged
+        pending[0].set_exception(RuntimeError('archive batch dropped'))
+        deadline = time.time() + 5
+        while len(pending) < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        assert queue.stats() == {'processing': 1}
+        pending[1].set_result(None)
+        assert queue.stats() == {'done': 1}
+    finally:
+        workers.stop()
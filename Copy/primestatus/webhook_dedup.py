@@ -0,0 +1,157 @@
+"""
+Idempotency and ordering for webhook events.
+
+Razorpay retries deliveries and can send events for one payment out of
+order. The ledger remembers which events were applied (an in-memory LRU in
+front of a SQLite table, so duplicates are rejected without touching
+Firestore) and the furthest lifecycle state reached by every payment, so a
+late payment.failed can't undo a payment.captured.
+"""
+
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Lifecycle position of payment events; a lower-ranked event arriving after
+# a higher-ranked one for the same payment is stale
+EVENT_RANK = {
+    'payment.authorized': 1,
+    'payment.failed': 2,
+    'payment.captured': 3,
+}
+
+DUPLICATE = 'duplicate'
+STALE = 'stale'
+APPLY = 'apply'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS processed_webhook_keys (
+    dedup_key TEXT PRIMARY KEY,
+    processed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS payment_states (
+    payment_id TEXT PRIMARY KEY,
+    event TEXT NOT NULL,
+    rank INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+def dedup_keys(event_id, event, payment_id):
+    """An event is a duplicate if its delivery ID or its (payment, event) pair was applied"""
+    keys = [f"event:{event_id}"]
+    if payment_id:
+        keys.append(f"payment:{payment_id}:{event}")
+    return keys
+
+
+class EventLedger:
+    def __init__(self, path, lru_size=10000):
+        self.path = path
+        self.lru_size = lru_size
+        self._lru = OrderedDict()
+        self._lru_lock = threading.Lock()
+        self._local = threading.local()
+        self.lru_hits = 0
+        self.table_hits = 0
+        self._connect().executescript(SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _remember(self, keys):
+        with self._lru_lock:
+            for key in keys:
+                self._lru[key] = True
+                self._lru.move_to_end(key)
+            while len(self._lru) > self.lru_size:
+                self._lru.popitem(last=False)
+
+    def seen(self, keys):
+        """Fast-path duplicate check: LRU first, then the persistent table"""
+        with self._lru_lock:
+            for key in keys:
+                if key in self._lru:
+                    self._lru.move_to_end(key)
+                    self.lru_hits += 1
+                    return True
+        placeholders = ','.join('?' * len(keys))
+        row = self._connect().execute(
+            f'SELECT dedup_key FROM processed_webhook_keys WHERE dedup_key IN ({placeholders}) LIMIT 1',
+            keys,
+        ).fetchone()
+        if row is not None:
+            self.table_hits += 1
+            self._remember([row[0]])
+            return True
+        return False
+
+    def check(self, event_id, event, payment_id):
+        """Decide whether an event should be applied: APPLY, DUPLICATE or STALE"""
+        if self.seen(dedup_keys(event_id, event, payment_id)):
+            return DUPLICATE
+        rank = EVENT_RANK.get(event)
+        if payment_id and rank is not None:
+            row = self._connect().execute(
+                'SELECT rank FROM payment_states WHERE payment_id = ?', (payment_id,)
+            ).fetchone()
+            if row is not None and row[0] > rank:
+                return STALE
+        return APPLY
+
+    def record(self, event_id, event, payment_id):
+        """Mark an event as applied and advance its payment's state"""
+        keys = dedup_keys(event_id, event, payment_id)
+        now = time.time()
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(
+                'INSERT OR IGNORE INTO processed_webhook_keys (dedup_key, processed_at) VALUES (?, ?)',
+                [(key, now) for key in keys],
+            )
+            rank = EVENT_RANK.get(event)
+            if payment_id and rank is not None:
+                # Only move a payment forward in its lifecycle
+                conn.execute(
+                    'INSERT INTO payment_states (payment_id, event, rank, updated_at) VALUES (?, ?, ?, ?) '
+                    'ON CONFLICT(payment_id) DO UPDATE SET event = excluded.event, rank = excluded.rank, '
+                    'updated_at = excluded.updated_at WHERE excluded.rank > payment_states.rank',
+                    (payment_id, event, rank, now),
+                )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        self._remember(keys)
+
+    def purge(self, older_than_seconds):
+        """Forget keys and payment states untouched for ``older_than_seconds``
+
+        Razorpay stops retrying a delivery long before this, so a key that
+        old can't be needed for deduplication any more.
+        """
+        cutoff = time.time() - older_than_seconds
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            keys = conn.execute('DELETE FROM processed_webhook_keys WHERE processed_at < ?', (cutoff,)).rowcount
+            states = conn.execute('DELETE FROM payment_states WHERE updated_at < ?', (cutoff,)).rowcount
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return keys + states
+
+    def stats(self):
+        with self._lru_lock:
+            lru_entries = len(self._lru)
+        return {'lru_entries': lru_entries, 'lru_hits': self.lru_hits, 'table_hits': self.table_hits}
@@ -0,0 +1,244 @@
+"""
+Durable local queue for webhook deliveries.
+
+The HTTP handler only verifies the signature and appends the raw event here,
+so Razorpay gets its 200 in milliseconds. Worker threads claim events and
+run the Firestore side effects, retrying failures with exponential backoff.
+Events live in SQLite (WAL mode), so a crash or restart never loses one:
+events that were being processed go back to pending on startup.
+
+Events that share an ordering key (the payment ID) are processed one at a
+time in arrival order, across all worker threads and processes.
+"""
+
+import logging
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS webhook_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    event_id TEXT NOT NULL UNIQUE,
+    event TEXT,
+    ordering_key TEXT,
+    body BLOB NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_webhook_events_ready
+    ON webhook_events (status, next_attempt_at);
+"""
+
+
+class WebhookQueue:
+    def __init__(self, path, max_attempts=8, base_delay=2.0, max_delay=600.0):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._local = threading.local()
+        self._wakeup = threading.Event()
+        conn = self._connect()
+        conn.executescript(SCHEMA)
+        columns = {row['name'] for row in conn.execute('PRAGMA table_info(webhook_events)')}
+        if 'ordering_key' not in columns:
+            conn.execute('ALTER TABLE webhook_events ADD COLUMN ordering_key TEXT')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_webhook_events_ordering ON webhook_events (ordering_key, status)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            # WAL + NORMAL survives process crashes; only an OS crash can drop the last commits
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def enqueue(self, event_id, event, body, ordering_key=None):
+        """Persist a delivery; returns False if this event ID was already queued"""
+        now = time.time()
+        cursor = self._connect().execute(
+            'INSERT OR IGNORE INTO webhook_events '
+            '(event_id, event, ordering_key, body, next_attempt_at, created_at, updated_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (event_id, event, ordering_key, body, now, now, now),
+        )
+        if cursor.rowcount:
+            self._wakeup.set()
+            return True
+        return False
+
+    def claim(self):
+        """Atomically take the next ready event, or None"""
+        conn = self._connect()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Skip events whose payment already has an event in flight, or
+            # an earlier event still waiting for its retry
+            row = conn.execute(
+                "SELECT e.id, e.event_id, e.event, e.ordering_key, e.body, e.attempts "
+                "FROM webhook_events e "
+                "WHERE e.status = 'pending' AND e.next_attempt_at <= ? "
+                "AND (e.ordering_key IS NULL OR NOT EXISTS ("
+                "    SELECT 1 FROM webhook_events o WHERE o.ordering_key = e.ordering_key "
+                "    AND (o.status = 'processing' OR (o.status = 'pending' AND o.id < e.id)))) "
+                "ORDER BY e.next_attempt_at, e.id LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE webhook_events SET status = 'processing', updated_at = ? WHERE id = ?",
+                    (now, row['id']),
+                )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return dict(row) if row is not None else None
+
+    def complete(self, row_id):
+        self._connect().execute(
+            "UPDATE webhook_events SET status = 'done', last_error = NULL, updated_at = ? WHERE id = ?",
+            (time.time(), row_id),
+        )
+
+    def fail(self, row_id, attempts, error):
+        """Schedule a retry with jittered exponential backoff, or give up"""
+        attempts += 1
+        now = time.time()
+        if attempts >= self.max_attempts:
+            status, next_attempt_at = 'dead', now
+        else:
+            delay = min(self.base_delay * (2 ** (attempts - 1)), self.max_delay)
+            status, next_attempt_at = 'pending', now + delay * random.uniform(0.5, 1.5)
+        self._connect().execute(
+            'UPDATE webhook_events SET status = ?, attempts = ?, next_attempt_at = ?, '
+            'last_error = ?, updated_at = ? WHERE id = ?',
+            (status, attempts, next_attempt_at, str(error)[:1000], now, row_id),
+        )
+        return status
+
+    def recover(self):
+        """Return events left 'processing' by a crashed process to the queue"""
+        cursor = self._connect().execute(
+            "UPDATE webhook_events SET status = 'pending', updated_at = ? WHERE status = 'processing'",
+            (time.time(),),
+        )
+        return cursor.rowcount
+
+    def purge_done(self, older_than_seconds=7 * 24 * 3600):
+        cursor = self._connect().execute(
+            "DELETE FROM webhook_events WHERE status = 'done' AND updated_at < ?",
+            (time.time() - older_than_seconds,),
+        )
+        return cursor.rowcount
+
+    def wait(self, timeout):
+        self._wakeup.wait(timeout)
+        self._wakeup.clear()
+
+    def stats(self):
+        rows = self._connect().execute(
+            'SELECT status, COUNT(*) AS n FROM webhook_events GROUP BY status'
+        ).fetchall()
+        return {row['status']: row['n'] for row in rows}
+
+
+class WebhookWorkers:
+    """Background threads that drain a WebhookQueue through ``handler(event_row)``
+
+    A handler that returns a Future finishes asynchronously: the event
+    stays 'processing' (so it is redone after a crash, and later events
+    for its payment wait) until the Future resolves, and a failed Future
+    schedules a retry like an exception would.
+
+    A housekeeping thread deletes finished events older than
+    ``retention_seconds`` every ``purge_interval`` seconds, and runs each
+    of ``purgers`` (callables taking the same age, e.g. EventLedger.purge)
+    so nothing kept per event grows without bound.
+    """
+
+    def __init__(self, queue, handler, threads=2, poll_interval=1.0,
+                 purge_interval=3600.0, retention_seconds=7 * 24 * 3600, purgers=()):
+        self.queue = queue
+        self.handler = handler
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self.purge_interval = purge_interval
+        self.retention_seconds = retention_seconds
+        self.purgers = list(purgers)
+        self._stop = threading.Event()
+        self._start_lock = threading.Lock()
+        self._workers = []
+
+    def start(self):
+        with self._start_lock:
+            if self._workers:
+                return
+            recovered = self.queue.recover()
+            if recovered:
+                logger.info("Re-queued interrupted webhook events", extra={"count": recovered})
+            for i in range(self.threads):
+                worker = threading.Thread(target=self._run, name=f"webhook-worker-{i}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+            if self.purge_interval:
+                purger = threading.Thread(target=self._purge_periodically, name="webhook-purge", daemon=True)
+                purger.start()
+                self._workers.append(purger)
+
+    def stop(self):
+        self._stop.set()
+
+    def purge(self):
+        """Delete finished events (and whatever the purgers keep) past the retention period"""
+        purged = {'events': self.queue.purge_done(self.retention_seconds)}
+        for purger in self.purgers:
+            purged[getattr(purger, '__qualname__', repr(purger))] = purger(self.retention_seconds)
+        logger.info("Purged old webhook state", extra={"purged": purged})
+        return purged
+
+    def _purge_periodically(self):
+        while not self._stop.wait(self.purge_interval):
+            try:
+                self.purge()
+            except Exception:
+                logger.exception("Webhook purge failed")
+
+    def _run(self):
+        while not self._stop.is_set():
+            row = self.queue.claim()
+            if row is None:
+                self.queue.wait(self.poll_interval)
+                continue
+            try:
+                result = self.handler(row)
+            except Exception as e:
+                self._finish(row, e)
+            else:
+                if isinstance(result, Future):
+                    result.add_done_callback(lambda future, row=row: self._finish(row, future.exception()))
+                else:
+                    self._finish(row, None)
+
+    def _finish(self, row, error):
+        if error is None:
+            self.queue.complete(row['id'])
+            return
+        status = self.queue.fail(row['id'], row['attempts'], error)
+        logger.warning("Webhook processing failed", extra={
+            "event_id": row['event_id'], "attempts": row['attempts'] + 1,
+            "status": status, "error": str(error),
+        })
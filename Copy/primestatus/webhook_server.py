@@ -8,13 +8,44 @@ import os
 import json
 import hmac
 import hashlib
+import atexit
+import logging
+import threading
 import requests
+from concurrent.futures import Future
+from datetime import datetime, timedelta
 from flask import Flask, request, jsonify
+from werkzeug.exceptions import RequestEntityTooLarge
 from firebase_admin import initialize_app, firestore, credentials
+import logging_setup
+from webhook_queue import WebhookQueue, WebhookWorkers
+from webhook_dedup import APPLY, EventLedger, dedup_keys
+from firestore_batching import ArchiveWriter
+from fcm_dispatcher import FirebaseSender, HttpSender, NotificationDispatcher, TokenCache
+
+logging_setup.setup_logging()
+logger = logging.getLogger("webhook_server")
 
 # Initialize Flask app
 app = Flask(__name__)
 
+@app.before_request
+def assign_request_id():
+    request.environ['request_id_token'] = logging_setup.request_id_var.set(
+        logging_setup.new_request_id(request.headers.get('X-Request-ID'))
+    )
+
+@app.after_request
+def add_request_id_header(response):
+    response.headers['X-Request-ID'] = logging_setup.request_id_var.get()
+    return response
+
+@app.teardown_request
+def reset_request_id(exc):
+    token = request.environ.pop('request_id_token', None)
+    if token is not None:
+        logging_setup.request_id_var.reset(token)
+
 # Initialize Firebase
 try:
     # Use service account key if available
@@ -26,228 +57,352 @@ try:
         firebase_app = initialize_app()
     
     db = firestore.client()
-    print("✅ Firebase initialized successfully")
+    logger.info("Firebase initialized successfully")
 except Exception as e:
-    print(f"❌ Firebase initialization failed: {e}")
+    logger.error("Firebase initialization failed", extra={"error": str(e)})
     db = None
 
 # Razorpay webhook secret (set this in environment variables)
 WEBHOOK_SECRET = os.getenv('RAZORPAY_WEBHOOK_SECRET', 'your_webhook_secret_here')
 
-def verify_webhook_signature(payload, signature):
-    """Verify Razorpay webhook signature"""
-    try:
-        expected_signature = hmac.new(
-            WEBHOOK_SECRET.encode('utf-8'),
-            payload.encode('utf-8'),
-            hashlib.sha256
-        ).hexdigest()
-        
-        return hmac.compare_digest(expected_signature, signature)
-    except Exception as e:
-        print(f"❌ Webhook signature verification failed: {e}")
-        return False
+# Keyed once; each request copies this instead of re-deriving the HMAC key
+_WEBHOOK_HMAC = hmac.new(WEBHOOK_SECRET.encode('utf-8'), digestmod=hashlib.sha256)
+
+# Razorpay payloads are a few KB; anything far larger is rejected with 413 before it is read
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('WEBHOOK_MAX_BODY_BYTES', 256 * 1024))
+
+def verify_webhook_signature(body, signature):
+    """Verify Razorpay webhook signature over the raw request bytes"""
+    mac = _WEBHOOK_HMAC.copy()
+    mac.update(body)
+    return hmac.compare_digest(mac.hexdigest().encode('ascii'), signature.encode('utf-8'))
+
+def archive_record(webhook_data):
+    return {
+        'data': webhook_data,
+        'timestamp': firestore.SERVER_TIMESTAMP,
+        'processed': True
+    }
 
 def send_to_firebase(webhook_data):
-    """Send webhook data to Firebase"""
-    try:
-        if db is None:
-            print("❌ Firebase not initialized")
-            return False
-        
-        # Store webhook in Firestore
-        webhook_ref = db.collection('webhooks').document()
-        webhook_ref.set({
-            'data': webhook_data,
-            'timestamp': firestore.SERVER_TIMESTAMP,
-            'processed': False
-        })
-        
-        print(f"✅ Webhook stored in Firebase: {webhook_ref.id}")
-        return True
-    except Exception as e:
-        print(f"❌ Failed to send to Firebase: {e}")
-        return False
+    """Queue webhook data for the next archive batch; returns a Future resolved once it is committed"""
+    if db is None:
+        raise RuntimeError("Firebase not initialized")
+    
+    return archive_writer.add(archive_record(webhook_data))
 
 def send_fcm_notification(user_id, title, body, data=None):
-    """Send FCM notification to user"""
-    try:
-        # Get user's FCM token from Firestore
-        user_doc = db.collection('users').document(user_id).get()
-        if not user_doc.exists:
-            print(f"❌ User {user_id} not found")
-            return False
-        
-        user_data = user_doc.to_dict()
-        fcm_token = user_data.get('fcmToken')
-        
-        if not fcm_token:
-            print(f"❌ No FCM token for user {user_id}")
-            return False
-        
-        # Send FCM notification (you'll need to implement this)
-        # For now, just log it
-        print(f"📱 FCM Notification to {user_id}:")
-        print(f"   Title: {title}")
-        print(f"   Body: {body}")
-        print(f"   Data: {data}")
-        
-        return True
-    except Exception as e:
-        print(f"❌ FCM notification failed: {e}")
+    """Queue an FCM notification for the user; it is sent with the next batch"""
+    if notification_dispatcher is None:
+        logger.warning("FCM notification dropped, Firebase not initialized", extra={"user_id": user_id})
         return False
+    notification_dispatcher.notify(user_id, title, body, data)
+    return True
+
+def create_notification_dispatcher():
+    # FCM_ENDPOINT points at an FCM v1 compatible server such as fcm_stub.py
+    endpoint = os.getenv('FCM_ENDPOINT')
+    if endpoint:
+        sender = HttpSender(endpoint, os.getenv('GCLOUD_PROJECT', 'demo-primestatus'))
+    else:
+        sender = FirebaseSender(firebase_app)
+    return NotificationDispatcher(
+        db,
+        sender,
+        token_cache=TokenCache(db, ttl_seconds=float(os.getenv('FCM_TOKEN_TTL_SECONDS', 3600))),
+        batch_size=int(os.getenv('FCM_BATCH_SIZE', 500)),
+        max_latency=float(os.getenv('FCM_BATCH_MAX_LATENCY', 0.5)),
+        max_concurrent_batches=int(os.getenv('FCM_MAX_CONCURRENT_BATCHES', 4)),
+    )
+
+notification_dispatcher = create_notification_dispatcher() if db is not None else None
+
+# Received webhooks are persisted here and processed by background workers
+webhook_queue = WebhookQueue(
+    os.getenv('WEBHOOK_QUEUE_PATH', 'webhook_queue.sqlite3'),
+    max_attempts=int(os.getenv('WEBHOOK_MAX_ATTEMPTS', 8)),
+)
+
+# Which events were already applied, and how far each payment has got
+event_ledger = EventLedger(
+    os.getenv('WEBHOOK_QUEUE_PATH', 'webhook_queue.sqlite3'),
+    lru_size=int(os.getenv('WEBHOOK_DEDUP_LRU_SIZE', 10000)),
+)
+
+# Archive entries from many events share one commit, bounded by size and age
+archive_writer = ArchiveWriter(
+    db,
+    'webhooks',
+    max_batch=int(os.getenv('WEBHOOK_ARCHIVE_BATCH_SIZE', 100)),
+    max_latency=float(os.getenv('WEBHOOK_ARCHIVE_MAX_LATENCY', 1.0)),
+)
 
 @app.route('/api/payment/callback', methods=['POST'])
 def payment_webhook():
-    """Handle Razorpay payment webhooks"""
+    """Handle Razorpay payment webhooks
+
+    Only verifies and persists the delivery; the Firestore work happens in
+    the background workers so Razorpay gets its response immediately.
+    """
     try:
-        # Get webhook data
-        webhook_data = request.get_json()
         signature = request.headers.get('X-Razorpay-Signature')
-        
-        if not webhook_data:
-            print("❌ No webhook data received")
-            return jsonify({'error': 'No data received'}), 400
-        
         if not signature:
-            print("❌ No signature received")
+            logger.warning("No signature received")
             return jsonify({'error': 'No signature'}), 400
         
-        # Verify webhook signature
-        payload = request.get_data(as_text=True)
-        if not verify_webhook_signature(payload, signature):
-            print("❌ Invalid webhook signature")
-            return jsonify({'error': 'Invalid signature'}), 401
+        # Raw bytes, exactly as signed; MAX_CONTENT_LENGTH caps how much is read
+        body = request.get_data(cache=False)
         
-        print(f"🔔 [WEBHOOK] Received webhook: {json.dumps(webhook_data, indent=2)}")
+        if not body:
+            logger.warning("No webhook data received")
+            return jsonify({'error': 'No data received'}), 400
+        
+        # Verify webhook signature before looking at the payload
+        if not verify_webhook_signature(body, signature):
+            logger.warning("Invalid webhook signature")
+            return jsonify({'error': 'Invalid signature'}), 401
         
-        # Extract event details
+        webhook_data = json.loads(body)
         event = webhook_data.get('event')
-        payload_data = webhook_data.get('payload', {})
+        # Razorpay sends the same event ID on every retry of a delivery
+        event_id = request.headers.get('X-Razorpay-Event-Id') or hashlib.sha256(body).hexdigest()
+        payment_id = payment_entity(webhook_data.get('payload', {})).get('id')
         
-        if event == 'payment.captured':
-            await handle_payment_captured(payload_data)
-        elif event == 'payment.failed':
-            await handle_payment_failed(payload_data)
-        else:
-            print(f"ℹ️ Unhandled event: {event}")
+        # Fast path: retries of already applied events never reach the queue
+        if event_ledger.seen(dedup_keys(event_id, event, payment_id)):
+            logger.info("Duplicate webhook", extra={"event": event, "event_id": event_id})
+            return jsonify({'status': 'duplicate'}), 200
         
-        # Store webhook in Firebase
-        send_to_firebase(webhook_data)
+        queued = webhook_queue.enqueue(event_id, event, body, ordering_key=payment_id)
+        logger.info("Received webhook", extra={"event": event, "event_id": event_id, "duplicate": not queued})
         
-        return jsonify({'status': 'success'}), 200
+        return jsonify({'status': 'queued' if queued else 'duplicate'}), 200
         
+    except RequestEntityTooLarge:
+        logger.warning("Webhook body too large", extra={"content_length": request.content_length})
+        return jsonify({'error': 'Payload too large'}), 413
+    except ValueError:
+        logger.warning("Webhook body is not valid JSON")
+        return jsonify({'error': 'Invalid JSON'}), 400
     except Exception as e:
-        print(f"❌ Webhook processing error: {e}")
+        logger.exception("Webhook ingestion error")
         return jsonify({'error': str(e)}), 500
 
-async def handle_payment_captured(payload):
-    """Handle successful payment"""
-    try:
-        payment = payload.get('payment', payload.get('entity', {}))
-        notes = payment.get('notes', {})
-        
-        user_id = notes.get('user_id')
-        plan_title = notes.get('plan_title', 'Premium Plan')
-        
-        if user_id:
-            print(f"✅ Payment successful for user: {user_id}")
-            
-            # Send success notification
-            send_fcm_notification(
-                user_id=user_id,
-                title="Payment Successful! 🎉",
-                body=f"Your {plan_title} subscription has been activated successfully.",
-                data={
-                    'type': 'payment_success',
-                    'planTitle': plan_title
-                }
-            )
-            
-            # Update user subscription in Firestore
-            update_user_subscription(user_id, payment, notes)
-        else:
-            print("❌ No user_id in payment notes")
-            
-    except Exception as e:
-        print(f"❌ Error handling payment captured: {e}")
+def payment_entity(payload):
+    """Razorpay nests the payment as payload.payment.entity"""
+    payment = payload.get('payment', payload.get('entity', {}))
+    return payment.get('entity', payment)
 
-async def handle_payment_failed(payload):
-    """Handle failed payment"""
-    try:
-        payment = payload.get('payment', payload.get('entity', {}))
-        notes = payment.get('notes', {})
-        
-        user_id = notes.get('user_id')
-        
-        if user_id:
-            print(f"❌ Payment failed for user: {user_id}")
-            
-            # Send failure notification
-            send_fcm_notification(
-                user_id=user_id,
-                title="Payment Failed",
-                body="Your payment was unsuccessful. Please try again.",
-                data={'type': 'payment_failed'}
-            )
-        else:
-            print("❌ No user_id in payment notes")
-            
-    except Exception as e:
-        print(f"❌ Error handling payment failed: {e}")
+def process_webhook_event(row):
+    """Run the side effects of one queued webhook; raising schedules a retry
 
-def update_user_subscription(user_id, payment, notes):
-    """Update user subscription in Firestore"""
-    try:
-        from datetime import datetime, timedelta
-        
-        plan_id = notes.get('plan_id', '')
-        plan_title = notes.get('plan_title', 'Premium Plan')
-        duration = int(notes.get('duration', 30))
-        usage_type = notes.get('usage_type', 'Personal')
-        amount = payment.get('amount', 0) / 100.0  # Convert from paise
-        
-        now = datetime.now()
-        expiry_date = now + timedelta(days=duration)
-        
-        # Update user document
-        user_ref = db.collection('users').document(user_id)
-        user_ref.update({
-            'subscription': 'Premium',
-            'subscriptionPlanId': plan_id,
-            'subscriptionPlanTitle': plan_title,
-            'subscriptionStartDate': now,
-            'subscriptionEndDate': expiry_date,
-            'subscriptionStatus': 'active',
-            'lastPaymentDate': now,
-            'updatedAt': firestore.SERVER_TIMESTAMP,
-        })
-        
-        # Add subscription history
-        user_ref.collection('subscriptionHistory').add({
-            'planId': plan_id,
-            'planTitle': plan_title,
-            'amount': amount,
-            'duration': duration,
-            'usageType': usage_type,
-            'startDate': now,
-            'endDate': expiry_date,
-            'status': 'active',
-            'paymentId': payment.get('id'),
-            'orderId': payment.get('order_id'),
-            'createdAt': firestore.SERVER_TIMESTAMP,
+    Returns a Future when the event's only write went to the shared archive
+    batch: the event is recorded and acknowledged when that commits.
+    """
+    webhook_data = json.loads(row['body'])
+    event = webhook_data.get('event')
+    payload_data = webhook_data.get('payload', {})
+    payment_id = row['ordering_key']
+    logger.debug("Webhook payload", extra={"event_id": row['event_id'], "payload": webhook_data})
+    
+    # Skip duplicates and events older than what the payment already reached
+    # (e.g. payment.failed arriving after payment.captured) before any Firestore work
+    decision = event_ledger.check(row['event_id'], event, payment_id)
+    if decision != APPLY:
+        logger.info("Skipping webhook", extra={
+            "event": event, "event_id": row['event_id'], "payment_id": payment_id, "reason": decision,
         })
-        
-        print(f"✅ User {user_id} subscription updated successfully")
-        
-    except Exception as e:
-        print(f"❌ Error updating user subscription: {e}")
+        return
+    
+    # Everything one event changes is committed together: the subscription,
+    # its history entry and the archive record either all land or none do
+    if db is None:
+        raise RuntimeError("Firebase not initialized")
+    batch = db.batch()
+    notifications = []
+    staged = False
+    if event == 'payment.captured':
+        notifications = handle_payment_captured(payload_data, batch)
+        staged = bool(notifications)
+    elif event == 'payment.failed':
+        notifications = handle_payment_failed(payload_data)
+    else:
+        logger.info("Unhandled event", extra={"event": event})
+    
+    def finish():
+        event_ledger.record(row['event_id'], event, payment_id)
+        # Notify only once the writes are durable
+        for notification in notifications:
+            send_fcm_notification(**notification)
+    
+    if staged:
+        batch.set(db.collection('webhooks').document(), archive_record(webhook_data))
+        batch.commit()
+        finish()
+        return None
+    
+    # Nothing else to write for this event, so its archive record can wait
+    # for a shared batch. The event is only recorded (and its queue row
+    # marked done) once that batch commits; if it is dropped or the process
+    # dies first, the event is retried
+    archived = send_to_firebase(webhook_data)
+    done = Future()
+    def on_archived(future):
+        try:
+            future.result()
+            finish()
+        except Exception as e:
+            done.set_exception(e)
+        else:
+            done.set_result(None)
+    archived.add_done_callback(on_archived)
+    return done
+
+def handle_payment_captured(payload, batch):
+    """Stage the subscription writes for a successful payment; returns notifications to send"""
+    payment = payment_entity(payload)
+    notes = payment.get('notes', {})
+    
+    user_id = notes.get('user_id')
+    plan_title = notes.get('plan_title', 'Premium Plan')
+    
+    if not user_id:
+        logger.warning("No user_id in payment notes", extra={"payment_id": payment.get('id')})
+        return []
+    
+    logger.info("Payment successful", extra={"user_id": user_id, "payment_id": payment.get('id')})
+    
+    # Update user subscription in Firestore
+    update_user_subscription(user_id, payment, notes, batch)
+    
+    # Send success notification
+    return [{
+        'user_id': user_id,
+        'title': "Payment Successful! 🎉",
+        'body': f"Your {plan_title} subscription has been activated successfully.",
+        'data': {
+            'type': 'payment_success',
+            'planTitle': plan_title
+        },
+    }]
+
+def handle_payment_failed(payload):
+    """Handle failed payment; returns notifications to send"""
+    payment = payment_entity(payload)
+    notes = payment.get('notes', {})
+    
+    user_id = notes.get('user_id')
+    
+    if not user_id:
+        logger.warning("No user_id in payment notes", extra={"payment_id": payment.get('id')})
+        return []
+    
+    logger.info("Payment failed", extra={"user_id": user_id, "payment_id": payment.get('id')})
+    
+    # Send failure notification
+    return [{
+        'user_id': user_id,
+        'title': "Payment Failed",
+        'body': "Your payment was unsuccessful. Please try again.",
+        'data': {'type': 'payment_failed'},
+    }]
+
+def update_user_subscription(user_id, payment, notes, batch):
+    """Stage the user's subscription update and history entry on ``batch``"""
+    plan_id = notes.get('plan_id', '')
+    plan_title = notes.get('plan_title', 'Premium Plan')
+    duration = int(notes.get('duration', 30))
+    usage_type = notes.get('usage_type', 'Personal')
+    amount = payment.get('amount', 0) / 100.0  # Convert from paise
+    
+    now = datetime.now()
+    expiry_date = now + timedelta(days=duration)
+    
+    # Update user document
+    user_ref = db.collection('users').document(user_id)
+    batch.update(user_ref, {
+        'subscription': 'Premium',
+        'subscriptionPlanId': plan_id,
+        'subscriptionPlanTitle': plan_title,
+        'subscriptionStartDate': now,
+        'subscriptionEndDate': expiry_date,
+        'subscriptionStatus': 'active',
+        'lastPaymentDate': now,
+        'updatedAt': firestore.SERVER_TIMESTAMP,
+    })
+    
+    # Add subscription history, keyed by payment so a retried event overwrites
+    # its own entry instead of adding another one
+    history = user_ref.collection('subscriptionHistory')
+    history_ref = history.document(payment['id']) if payment.get('id') else history.document()
+    batch.set(history_ref, {
+        'planId': plan_id,
+        'planTitle': plan_title,
+        'amount': amount,
+        'duration': duration,
+        'usageType': usage_type,
+        'startDate': now,
+        'endDate': expiry_date,
+        'status': 'active',
+        'paymentId': payment.get('id'),
+        'orderId': payment.get('order_id'),
+        'createdAt': firestore.SERVER_TIMESTAMP,
+    })
+    
+    logger.info("User subscription staged", extra={"user_id": user_id, "plan_id": plan_id})
+
+webhook_workers = WebhookWorkers(
+    webhook_queue,
+    process_webhook_event,
+    threads=int(os.getenv('WEBHOOK_WORKER_THREADS', 2)),
+    purge_interval=float(os.getenv('WEBHOOK_PURGE_INTERVAL', 3600)),
+    retention_seconds=float(os.getenv('WEBHOOK_RETENTION_SECONDS', 7 * 24 * 3600)),
+    purgers=[event_ledger.purge],
+)
+
+_background_started = False
+_background_lock = threading.Lock()
+
+def start_background_workers():
+    """Start the queue workers, archive writer and notification dispatcher once per process
+
+    Not done at import: the debug reloader imports this module in a
+    watcher process too, and two sets of workers would drain one queue.
+    """
+    global _background_started
+    with _background_lock:
+        if _background_started:
+            return
+        _background_started = True
+    if webhook_workers.threads > 0:
+        webhook_workers.start()
+    if db is not None:
+        archive_writer.start()
+        atexit.register(archive_writer.stop)
+        notification_dispatcher.start()
+        atexit.register(notification_dispatcher.stop)
+
+@app.before_request
+def ensure_background_workers():
+    # Under a WSGI server the module is never __main__; start with the first request
+    start_background_workers()
 
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return jsonify({'status': 'healthy', 'timestamp': datetime.now().isoformat()})
+    return jsonify({
+        'status': 'healthy',
+        'timestamp': datetime.now().isoformat(),
+        'queue': webhook_queue.stats(),
+        'dedup': event_ledger.stats(),
+        'archive': archive_writer.stats(),
+        'notifications': notification_dispatcher.stats() if notification_dispatcher else None,
+        'logging': logging_setup.stats(),
+    })
 
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 5000))
+    # With the reloader only the serving child (WERKZEUG_RUN_MAIN) runs workers
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_workers()
     app.run(host='0.0.0.0', port=port, debug=True) 
\ No newline at end of file
@@ -0,0 +1,199 @@
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger(__name__)
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def current_rss_bytes():
+    """Resident set size of this process right now (not the peak), or None if unknown"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def cgroup_memory_limit_bytes():
+    """The container's memory limit (cgroup v2, then v1), or None when unlimited"""
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value.isdigit() and int(value) < 1 << 60:
+            return int(value)
+    return None
+
+
+class Rejected(Exception):
+    def __init__(self, route_class, reason, retry_after):
+        super().__init__(f"{route_class.name} requests are over capacity ({reason})")
+        self.route_class = route_class
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class RouteClass:
+    """A group of routes that share a concurrency limit and wait queue.
+
+    ``prefixes`` and ``methods`` decide which requests belong to it.
+    ``memory_cost_bytes`` is roughly what one request holds in RAM while it
+    runs; it is reserved on admission and checked against the memory
+    limit. Classes with ``shed_on_memory=False`` (cheap reads) are never
+    rejected for memory, only for their own queue.
+    """
+
+    def __init__(self, name, prefixes=(), methods=None, max_concurrent=8, max_queue=16,
+                 queue_timeout=10.0, memory_cost_bytes=0, shed_on_memory=True):
+        self.name = name
+        self.prefixes = tuple(prefixes)
+        self.methods = {method.upper() for method in methods} if methods else None
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.memory_cost_bytes = memory_cost_bytes
+        self.shed_on_memory = shed_on_memory
+        self._semaphore = None
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = {'queue_full': 0, 'queue_timeout': 0, 'memory': 0}
+        # Moving average of how long admitted requests take, for Retry-After
+        self.mean_seconds = 1.0
+
+    def matches(self, method, path):
+        if self.methods is not None and method.upper() not in self.methods:
+            return False
+        return any(path.startswith(prefix) for prefix in self.prefixes)
+
+    @property
+    def semaphore(self):
+        # Created on first use so it belongs to the server's event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        return self._semaphore
+
+    def retry_after(self):
+        """Seconds until a slot is likely free: the queue ahead, drained max_concurrent at a time"""
+        backlog = (self.waiting + 1) / self.max_concurrent
+        return max(1, min(60, round(backlog * self.mean_seconds)))
+
+    def stats(self):
+        return {
+            'max_concurrent': self.max_concurrent,
+            'max_queue': self.max_queue,
+            'active': self.active,
+            'waiting': self.waiting,
+            'admitted': self.admitted,
+            'rejected': dict(self.rejected),
+            'mean_seconds': round(self.mean_seconds, 3),
+        }
+
+
+class AdmissionController:
+    """Decides whether a request may start now, wait for a slot, or be turned away.
+
+    Every request belongs to one RouteClass (``default`` when no class
+    matches), and each class has its own slots and bounded wait queue, so
+    a burst of uploads or renders only ever queues behind itself and cheap
+    reads keep their latency. A request is rejected straight away when its
+    class's queue is full or - for classes that shed on memory - when the
+    process's RSS plus the memory reserved by admitted requests plus its
+    own cost would pass ``memory_limit_bytes``; one that waits longer than
+    its class's ``queue_timeout`` is rejected too. Rejections carry a
+    Retry-After estimate from the class's recent service time.
+    """
+
+    def __init__(self, classes, default, memory_limit_bytes=None, rss=current_rss_bytes, on_reject=None):
+        self.classes = list(classes)
+        self.default = default
+        self.memory_limit_bytes = memory_limit_bytes
+        self.rss = rss
+        self.on_reject = on_reject
+        self.reserved_bytes = 0
+
+    def classify(self, method, path):
+        for route_class in self.classes:
+            if route_class.matches(method, path):
+                return route_class
+        return self.default
+
+    def _reject(self, route_class, reason):
+        route_class.rejected[reason] += 1
+        if self.on_reject is not None:
+            self.on_reject(route_class.name, reason)
+        logger.warning("Request rejected by admission control",
+                       extra={"route_class": route_class.name, "reason": reason})
+        return Rejected(route_class, reason, route_class.retry_after())
+
+    def _over_memory(self, route_class):
+        if not route_class.shed_on_memory or not self.memory_limit_bytes:
+            return False
+        rss = self.rss()
+        if rss is None:
+            return False
+        # Conservative: reservations of running requests may already be in the RSS
+        return rss + self.reserved_bytes + route_class.memory_cost_bytes > self.memory_limit_bytes
+
+    @asynccontextmanager
+    async def admit(self, method, path):
+        """Hold a slot of the request's class for the duration of the block; raises Rejected"""
+        route_class = self.classify(method, path)
+        semaphore = route_class.semaphore
+        if semaphore.locked() and route_class.waiting >= route_class.max_queue:
+            raise self._reject(route_class, 'queue_full')
+        if self._over_memory(route_class):
+            raise self._reject(route_class, 'memory')
+
+        if not semaphore.locked():
+            # A free slot is taken without suspending, so the next
+            # request already sees it as taken
+            await semaphore.acquire()
+        else:
+            route_class.waiting += 1
+            acquired = False
+            try:
+                # Not wait_for(): before Python 3.12 it can time out after the
+                # acquire went through, and that slot would never be released
+                async with asyncio.timeout(route_class.queue_timeout):
+                    await semaphore.acquire()
+                    acquired = True
+            except TimeoutError:
+                if acquired:
+                    semaphore.release()
+                raise self._reject(route_class, 'queue_timeout')
+            finally:
+                route_class.waiting -= 1
+            if self._over_memory(route_class):
+                # Memory filled up while this one was queued
+                semaphore.release()
+                raise self._reject(route_class, 'memory')
+
+        route_class.active += 1
+        route_class.admitted += 1
+        self.reserved_bytes += route_class.memory_cost_bytes
+        started = time.perf_counter()
+        try:
+            yield route_class
+        finally:
+            route_class.mean_seconds += 0.1 * (time.perf_counter() - started - route_class.mean_seconds)
+            self.reserved_bytes -= route_class.memory_cost_bytes
+            route_class.active -= 1
+            route_class.semaphore.release()
+
+    def stats(self):
+        return {
+            'memory_limit_bytes': self.memory_limit_bytes,
+            'rss_bytes': self.rss(),
+            'reserved_bytes': self.reserved_bytes,
+            'classes': {
+                route_class.name: route_class.stats()
+                for route_class in self.classes + [self.default]
+            },
+        }
@@ -0,0 +1,112 @@
+"""Benchmark cases. Each factory takes the imported main module and returns
+the zero-argument callable that gets timed."""
+import os
+
+from fixtures import (
+    BG_REMOVAL_INPUT, FIXTURES_DIR, PROFILE_IMAGE, TEMPLATE_IMAGE, TEMPLATE_VIDEO,
+)
+from stubs import fixture_url
+
+FRAME_SIZE = {'width': 1080, 'height': 1920}
+
+ADMIN_POST = {
+    'mainImage': fixture_url(TEMPLATE_IMAGE),
+    'mediaType': 'image',
+    'frameSize': FRAME_SIZE,
+    'profileSettings': {'enabled': True, 'size': 120, 'x': 80, 'y': 85, 'shape': 'circle'},
+    'textSettings': {
+        'fontSize': 28, 'x': 20, 'y': 85, 'font': 'Arial',
+        'color': '#ffffff', 'hasBackground': True, 'backgroundColor': '#000000',
+    },
+    'phoneSettings': {
+        'enabled': True, 'fontSize': 22, 'x': 20, 'y': 90, 'font': 'Arial',
+        'color': '#ffffff', 'hasBackground': True, 'backgroundColor': '#1e3a8a',
+    },
+    'addressSettings': {
+        'enabled': True, 'fontSize': 18, 'x': 5, 'y': 93, 'font': 'Arial',
+        'color': '#ffffff', 'hasBackground': True, 'backgroundColor': '#1e3a8a',
+    },
+}
+
+VIDEO_POST = dict(ADMIN_POST, mainImage=fixture_url(TEMPLATE_VIDEO), mediaType='video')
+
+PERSONAL_USER = {
+    'name': 'Ramesh Kumar',
+    'profilePhotoUrl': fixture_url(PROFILE_IMAGE),
+    'usageType': 'Personal',
+}
+
+BUSINESS_USER = dict(
+    PERSONAL_USER,
+    usageType='Business',
+    phoneNumber='+91 98765 43210',
+    address='12, MG Road, Bengaluru',
+)
+
+LONG_ADDRESS_USER = dict(
+    BUSINESS_USER,
+    address=(
+        'Shop No. 14, Ground Floor, Sri Lakshmi Venkateshwara Complex, '
+        '3rd Cross, 5th Main Road, Opposite Government High School, '
+        'Near Bus Stand, Rajajinagar Industrial Area, Bengaluru, '
+        'Karnataka 560010, India'
+    ),
+)
+
+
+def overlay_personal(main):
+    return lambda: main.buffer_pool.release(main.create_overlay_image(ADMIN_POST, PERSONAL_USER))
+
+
+def overlay_business(main):
+    return lambda: main.buffer_pool.release(main.create_overlay_image(ADMIN_POST, BUSINESS_USER))
+
+
+def overlay_business_long_address(main):
+    return lambda: main.buffer_pool.release(main.create_overlay_image(ADMIN_POST, LONG_ADDRESS_USER))
+
+
+def overlay_business_numpy(main):
+    main.OVERLAY_COMPOSITOR = 'numpy'
+    return lambda: main.buffer_pool.release(main.create_overlay_image(ADMIN_POST, BUSINESS_USER))
+
+
+def upload_encode(main):
+    image = main.create_overlay_image(ADMIN_POST, BUSINESS_USER)
+    return lambda: main.upload_to_firebase(image, 'bench_user', 'bench_post')
+
+
+def video_overlay(main):
+    def run():
+        os.unlink(main.create_video_overlay(VIDEO_POST, BUSINESS_USER))
+    return run
+
+
+def remove_bg(main):
+    from fastapi.testclient import TestClient
+
+    client = TestClient(main.app)
+    with open(os.path.join(FIXTURES_DIR, BG_REMOVAL_INPUT), 'rb') as f:
+        payload = f.read()
+
+    def run():
+        response = client.post('/remove-bg/', files={'file': ('portrait.png', payload, 'image/png')})
+        response.raise_for_status()
+    return run
+
+
+CASES = {
+    'overlay_personal': overlay_personal,
+    'overlay_business': overlay_business,
+    'overlay_business_long_address': overlay_business_long_address,
+    'overlay_business_numpy': overlay_business_numpy,
+    'upload_encode': upload_encode,
+    'video_overlay': video_overlay,
+    'remove_bg': remove_bg,
+}
+
+# Slow cases get fewer iterations unless overridden on the command line
+DEFAULT_ITERATIONS = {
+    'video_overlay': 5,
+    'remove_bg': 10,
+}
@@ -0,0 +1,61 @@
+"""Deterministic fixture media for the benchmarks.
+
+Files are generated on first use into benchmarks/fixtures/ (not committed)
+from a fixed seed, so every machine benchmarks the same pixels.
+"""
+import os
+import random
+
+from PIL import Image, ImageDraw
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+TEMPLATE_IMAGE = 'template_2160x3840.jpg'
+PROFILE_IMAGE = 'profile_800x800.jpg'
+TEMPLATE_VIDEO = 'template_720x1280_3s.mp4'
+BG_REMOVAL_INPUT = 'portrait_1024x1024.png'
+
+
+def _busy_image(size, seed):
+    """Gradient with random shapes: compresses and resizes like a real photo"""
+    rng = random.Random(seed)
+    width, height = size
+    image = Image.linear_gradient('L').resize(size).convert('RGB')
+    draw = ImageDraw.Draw(image)
+    for _ in range(400):
+        x, y = rng.randrange(width), rng.randrange(height)
+        w, h = rng.randrange(10, width // 4), rng.randrange(10, height // 4)
+        color = (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+        if rng.random() < 0.5:
+            draw.ellipse([x, y, x + w, y + h], fill=color)
+        else:
+            draw.rectangle([x, y, x + w, y + h], fill=color)
+    return image
+
+
+def _write_video(path):
+    from moviepy.editor import ImageClip
+
+    frame = _busy_image((720, 1280), seed=3)
+    frame_path = path + '.frame.png'
+    frame.save(frame_path)
+    clip = ImageClip(frame_path).set_duration(3).set_fps(24)
+    clip.write_videofile(path, codec='libx264', audio=False, verbose=False, logger=None)
+    clip.close()
+    os.unlink(frame_path)
+
+
+def ensure_fixtures(include_video=True):
+    os.makedirs(FIXTURES_DIR, exist_ok=True)
+    builders = {
+        TEMPLATE_IMAGE: lambda p: _busy_image((2160, 3840), seed=1).save(p, quality=90),
+        PROFILE_IMAGE: lambda p: _busy_image((800, 800), seed=2).save(p, quality=90),
+        BG_REMOVAL_INPUT: lambda p: _busy_image((1024, 1024), seed=4).save(p),
+    }
+    if include_video:
+        builders[TEMPLATE_VIDEO] = _write_video
+    for filename, build in builders.items():
+        path = os.path.join(FIXTURES_DIR, filename)
+        if not os.path.exists(path):
+            build(path)
+    return FIXTURES_DIR
@@ -0,0 +1,186 @@
+"""Benchmark runner for the overlay pipeline and background removal.
+
+Each case runs in a fresh process so peak RSS is per case. Results go to
+benchmarks/results/latest.json; --save-baseline NAME stores them under
+benchmarks/baselines/NAME.json and --compare NAME reports regressions
+against that baseline (exit code 1 if any metric regressed).
+
+    python benchmarks/run.py
+    python benchmarks/run.py --cases overlay_business --iterations 50
+    python benchmarks/run.py --save-baseline main
+    python benchmarks/run.py --compare main --threshold 0.10
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+BASELINES_DIR = os.path.join(BENCH_DIR, 'baselines')
+
+sys.path[:0] = [BENCH_DIR, BACKEND_DIR]
+
+# metric -> True if higher is better
+METRICS = {
+    'throughput_per_s': True,
+    'p50_ms': False,
+    'p95_ms': False,
+    'p99_ms': False,
+    'peak_rss_mb': False,
+}
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+# Cache namespaces that would otherwise serve repeated inputs without doing the work
+CACHE_TTL_SETTINGS = ('RESULT_CACHE_TTL_SECONDS', 'TEMPLATE_CACHE_TTL_SECONDS', 'BG_REMOVAL_CACHE_TTL_SECONDS')
+
+
+def run_case(name, iterations, warmup):
+    """Runs in a child process: import main against local stubs and time one case"""
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    # remove_bg repeats one client's upload far past the per-IP limit
+    os.environ.setdefault('RATE_LIMIT_ANONYMOUS_BG', 'off')
+    # Every iteration renders the same inputs; with the caches on, all but
+    # the first would only time a cache hit
+    for setting in CACHE_TTL_SETTINGS:
+        os.environ.setdefault(setting, '0')
+    from fixtures import ensure_fixtures
+    import stubs
+
+    fixtures_dir = ensure_fixtures(include_video=(name == 'video_overlay'))
+    stubs.install(fixtures_dir)
+    # main writes upload/ and db.sqlite3 relative to the working directory
+    os.chdir(tempfile.mkdtemp(prefix='bench_'))
+
+    import main
+    from cases import CASES
+
+    fn = CASES[name](main)
+    for _ in range(warmup):
+        fn()
+    rss_before = peak_rss_mb()
+
+    latencies = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - started)
+
+    latencies.sort()
+    return {
+        'iterations': iterations,
+        'throughput_per_s': round(iterations / sum(latencies), 3),
+        'mean_ms': round(sum(latencies) / iterations * 1000, 3),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'setup_rss_mb': round(rss_before, 1),
+    }
+
+
+def environment():
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def compare(results, baseline, threshold):
+    """Print a comparison table; returns True if anything regressed"""
+    regressed = False
+    print(f"\n{'case':32} {'metric':18} {'baseline':>12} {'current':>12} {'change':>9}")
+    for name, current in results['cases'].items():
+        base = baseline['cases'].get(name)
+        if base is None:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            old, new = base[metric], current[metric]
+            if not old:
+                continue
+            change = (new - old) / old
+            worse = -change if higher_is_better else change
+            flag = ''
+            if worse > threshold:
+                flag = '  REGRESSION'
+                regressed = True
+            print(f"{name:32} {metric:18} {old:12.2f} {new:12.2f} {change:+8.1%}{flag}")
+    return regressed
+
+
+def main():
+    from cases import CASES, DEFAULT_ITERATIONS
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cases', default=','.join(CASES), help='comma-separated case names')
+    parser.add_argument('--iterations', type=int, help='timed iterations per case')
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--save-baseline', metavar='NAME')
+    parser.add_argument('--compare', metavar='NAME')
+    parser.add_argument('--threshold', type=float, default=0.10, help='allowed relative regression')
+    args = parser.parse_args()
+
+    results = {'environment': environment(), 'cases': {}}
+    spawn = multiprocessing.get_context('spawn')
+    for name in args.cases.split(','):
+        if name not in CASES:
+            parser.error(f"unknown case {name!r}; choose from {', '.join(CASES)}")
+        iterations = args.iterations or DEFAULT_ITERATIONS.get(name, 30)
+        with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as pool:
+            result = pool.submit(run_case, name, iterations, args.warmup).result()
+        results['cases'][name] = result
+        print(f"{name:32} {result['throughput_per_s']:8.2f}/s  p50 {result['p50_ms']:9.1f} ms  "
+              f"p95 {result['p95_ms']:9.1f} ms  p99 {result['p99_ms']:9.1f} ms  "
+              f"peak RSS {result['peak_rss_mb']:7.1f} MB")
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    with open(os.path.join(RESULTS_DIR, 'latest.json'), 'w') as f:
+        json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        os.makedirs(BASELINES_DIR, exist_ok=True)
+        path = os.path.join(BASELINES_DIR, f"{args.save_baseline}.json")
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved baseline {path}")
+
+    if args.compare:
+        with open(os.path.join(BASELINES_DIR, f"{args.compare}.json")) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
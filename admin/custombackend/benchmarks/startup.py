@@ -0,0 +1,89 @@
+"""Startup benchmark: import time and time to first request.
+
+Each run is a fresh interpreter (nothing cached in sys.modules) that
+installs the local stubs, imports main, then sends one request through
+the app with startup events enabled. Reports the median of --runs and
+which heavy libraries the import pulled in.
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --runs 10 --path /cache/stats
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+
+# Libraries that should only load when a request needs them
+HEAVY_MODULES = ('rembg', 'onnxruntime', 'moviepy', 'sqlalchemy', 'uvicorn')
+
+
+def measure_once(path):
+    """Runs in the child interpreter; prints one JSON result line"""
+    import time
+
+    started = time.perf_counter()
+    sys.path[:0] = [BENCH_DIR, BACKEND_DIR]
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    os.environ.setdefault('FEED_INDEX_ENABLED', 'false')
+    from fixtures import ensure_fixtures
+    import stubs
+
+    stubs.install(ensure_fixtures(include_video=False))
+    # main writes upload/ and db.sqlite3 relative to the working directory
+    os.chdir(tempfile.mkdtemp(prefix='bench_startup_'))
+
+    import_started = time.perf_counter()
+    import main
+    imported = time.perf_counter()
+
+    from fastapi.testclient import TestClient
+
+    with TestClient(main.app) as client:
+        response = client.get(path)
+        first_response = time.perf_counter()
+
+    print(json.dumps({
+        'import_ms': (imported - import_started) * 1000,
+        'first_request_ms': (first_response - imported) * 1000,
+        'time_to_first_response_ms': (first_response - started) * 1000,
+        'status': response.status_code,
+        'heavy_modules_loaded': [name for name in HEAVY_MODULES if name in sys.modules],
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--path', default='/cache/stats', help='path of the first request')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        measure_once(args.path)
+        return
+
+    results = []
+    for _ in range(args.runs):
+        output = subprocess.check_output(
+            [sys.executable, os.path.abspath(__file__), '--child', '--path', args.path],
+            cwd=BACKEND_DIR, text=True,
+        )
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    for metric in ('import_ms', 'first_request_ms', 'time_to_first_response_ms'):
+        values = [result[metric] for result in results]
+        print(f"{metric:28} median {statistics.median(values):9.1f} ms  "
+              f"min {min(values):9.1f} ms  max {max(values):9.1f} ms")
+    print(f"{'first response status':28} {results[-1]['status']}")
+    loaded = results[-1]['heavy_modules_loaded']
+    print(f"{'heavy modules imported':28} {', '.join(loaded) if loaded else 'none'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""Local stand-ins for Firebase, Cloud Storage and HTTP used by the benchmarks.
+
+install() must run before ``import main``: main initialises Firebase and
+the Storage bucket at import time.
+"""
+import os
+import sys
+import types
+from urllib.parse import urlparse
+
+FIXTURE_HOST = 'fixtures.local'
+
+
+def fixture_url(filename):
+    return f"http://{FIXTURE_HOST}/{filename}"
+
+
+class FakeSnapshot:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return self._data.get(field)
+
+
+class FakeDocument:
+    def __init__(self, collection, doc_id):
+        self._collection = collection
+        self.id = doc_id
+
+    def get(self):
+        return FakeSnapshot(self.id, self._collection.docs.get(self.id))
+
+    def set(self, data):
+        self._collection.docs[self.id] = dict(data)
+
+    def update(self, data):
+        self._collection.docs.setdefault(self.id, {}).update(data)
+
+    def delete(self):
+        self._collection.docs.pop(self.id, None)
+
+
+class FakeCollection:
+    def __init__(self):
+        self.docs = {}
+
+    def document(self, doc_id=None):
+        return FakeDocument(self, doc_id or f"doc{len(self.docs)}")
+
+    def where(self, *args, **kwargs):
+        return self
+
+    def select(self, fields):
+        return self
+
+    def stream(self):
+        return (FakeSnapshot(doc_id, data) for doc_id, data in list(self.docs.items()))
+
+
+class FakeFirestore:
+    def __init__(self):
+        self.collections = {}
+
+    def collection(self, name):
+        return self.collections.setdefault(name, FakeCollection())
+
+
+class FakeBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+
+    def upload_from_file(self, file_obj, content_type=None):
+        self.bucket.uploaded_bytes += len(file_obj.read())
+        self.bucket.uploads += 1
+
+    def upload_from_filename(self, filename, content_type=None):
+        self.bucket.uploaded_bytes += os.path.getsize(filename)
+        self.bucket.uploads += 1
+
+    def upload_from_string(self, data, content_type=None):
+        self.bucket.uploaded_bytes += len(data)
+        self.bucket.uploads += 1
+
+    def make_public(self):
+        pass
+
+
+class FakeBucket:
+    name = 'benchmark-bucket'
+
+    def __init__(self):
+        self.uploads = 0
+        self.uploaded_bytes = 0
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+
+class FakeResponse:
+    def __init__(self, content):
+        self.content = content
+        self.status_code = 200
+
+    def raise_for_status(self):
+        pass
+
+
+def install(fixtures_dir):
+    """Replace firebase_admin and requests.get with local fakes"""
+    firestore_client = FakeFirestore()
+    bucket = FakeBucket()
+
+    firebase_admin = types.ModuleType('firebase_admin')
+    firebase_admin._apps = {}
+    firebase_admin.initialize_app = lambda *args, **kwargs: firebase_admin._apps.setdefault('[DEFAULT]', object())
+
+    credentials = types.ModuleType('firebase_admin.credentials')
+    credentials.Certificate = lambda path: None
+
+    firestore = types.ModuleType('firebase_admin.firestore')
+    firestore.client = lambda *args, **kwargs: firestore_client
+    firestore.SERVER_TIMESTAMP = object()
+    firestore.Query = types.SimpleNamespace(DESCENDING='DESCENDING', ASCENDING='ASCENDING')
+
+    storage = types.ModuleType('firebase_admin.storage')
+    storage.bucket = lambda *args, **kwargs: bucket
+
+    firebase_admin.credentials = credentials
+    firebase_admin.firestore = firestore
+    firebase_admin.storage = storage
+    sys.modules.update({
+        'firebase_admin': firebase_admin,
+        'firebase_admin.credentials': credentials,
+        'firebase_admin.firestore': firestore,
+        'firebase_admin.storage': storage,
+    })
+
+    import requests
+
+    def fake_get(url, *args, **kwargs):
+        parsed = urlparse(url)
+        if parsed.netloc != FIXTURE_HOST:
+            raise RuntimeError(f"Benchmarks must not touch the network: {url}")
+        with open(os.path.join(fixtures_dir, parsed.path.lstrip('/')), 'rb') as f:
+            return FakeResponse(f.read())
+
+    requests.get = fake_get
+    return firestore_client, bucket
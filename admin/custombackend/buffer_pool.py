@@ -0,0 +1,119 @@
+import threading
+import weakref
+from contextlib import contextmanager
+from io import BytesIO
+
+from PIL import Image
+
+
+def _image_bytes(mode, size):
+    return size[0] * size[1] * Image.getmodebands(mode)
+
+
+class BufferPool:
+    """Reuses render canvases and PNG encode buffers between requests.
+
+    Canvases are kept per (mode, size), so renders of the same frame size
+    get back a canvas that is already allocated and only needs refilling.
+    A canvas is leased with canvas() and handed back with release() once
+    nothing reads it any more; one that is never released is simply
+    garbage collected. Idle buffers count against ``max_bytes``; anything
+    released past that (or past ``max_per_key`` for one size) is dropped.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, max_per_key=8):
+        self.max_bytes = max_bytes
+        self.max_per_key = max_per_key
+        self._lock = threading.Lock()
+        self._canvases = {}     # (mode, size) -> idle images
+        self._leased = {}       # id(image) -> (key, weakref)
+        self._encode_buffers = []
+        self.pooled_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.dropped = 0
+
+    def canvas(self, mode, size, color=0):
+        """A ``mode`` image of ``size`` filled with ``color``"""
+        key = (mode, tuple(size))
+        with self._lock:
+            idle = self._canvases.get(key)
+            image = idle.pop() if idle else None
+            if image is not None:
+                self.hits += 1
+                self.pooled_bytes -= _image_bytes(mode, key[1])
+            else:
+                self.misses += 1
+        if image is None:
+            image = Image.new(mode, key[1], color)
+        else:
+            image.paste(color, (0, 0) + key[1])
+        image_id = id(image)
+        ref = weakref.ref(image, lambda ref: self._forget(image_id, ref))
+        with self._lock:
+            self._leased[image_id] = (key, ref)
+        return image
+
+    def _forget(self, image_id, ref):
+        # A leased canvas was garbage collected without being released.
+        # Called from the GC, so no lock: a single dict check-and-pop is enough
+        if self._leased.get(image_id, (None, None))[1] is ref:
+            self._leased.pop(image_id, None)
+
+    def release(self, image):
+        """Return a canvas from canvas(); anything else is ignored"""
+        with self._lock:
+            key, ref = self._leased.pop(id(image), (None, None))
+            if ref is None or ref() is not image:
+                return False
+            idle = self._canvases.setdefault(key, [])
+            nbytes = _image_bytes(*key)
+            if len(idle) >= self.max_per_key or self.pooled_bytes + nbytes > self.max_bytes:
+                self.dropped += 1
+                return False
+            idle.append(image)
+            self.pooled_bytes += nbytes
+            return True
+
+    @contextmanager
+    def encode_buffer(self):
+        """A BytesIO positioned at 0, returned to the pool afterwards
+
+        The previous contents are overwritten rather than cleared, so the
+        buffer keeps its capacity; callers truncate() after writing.
+        """
+        with self._lock:
+            buffer, size = self._encode_buffers.pop() if self._encode_buffers else (None, 0)
+            if buffer is not None:
+                self.hits += 1
+                self.pooled_bytes -= size
+            else:
+                self.misses += 1
+        if buffer is None:
+            buffer = BytesIO()
+        buffer.seek(0)
+        try:
+            yield buffer
+        finally:
+            size = buffer.seek(0, 2)
+            with self._lock:
+                if len(self._encode_buffers) >= self.max_per_key or self.pooled_bytes + size > self.max_bytes:
+                    self.dropped += 1
+                else:
+                    self._encode_buffers.append((buffer, size))
+                    self.pooled_bytes += size
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'dropped': self.dropped,
+                'pooled_bytes': self.pooled_bytes,
+                'leased': len(self._leased),
+                'idle_canvases': {
+                    f"{mode} {size[0]}x{size[1]}": len(idle)
+                    for (mode, size), idle in self._canvases.items() if idle
+                },
+                'idle_encode_buffers': len(self._encode_buffers),
+            }
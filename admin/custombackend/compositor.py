@@ -0,0 +1,223 @@
+import functools
+import threading
+
+import numpy as np
+from PIL import Image, ImageColor, ImageDraw
+
+
+@functools.lru_cache(maxsize=64)
+def circle_mask_image(size):
+    """Circular 'L' mask for a size x size profile tile, drawn once per size"""
+    mask = Image.new('L', (size, size), 0)
+    ImageDraw.Draw(mask).ellipse([0, 0, size, size], fill=255)
+    return mask
+
+
+class PillowCanvas:
+    """Draws each overlay element straight onto the image with Pillow"""
+
+    def __init__(self, image):
+        self.image = image
+        self.draw = ImageDraw.Draw(image)
+
+    def rectangle(self, box, fill):
+        self.draw.rectangle(box, fill=fill)
+
+    def text(self, xy, text, fill, font):
+        self.draw.text(xy, text, fill=fill, font=font)
+
+    def paste_profile(self, tile, xy, circle):
+        if circle:
+            output = Image.new('RGBA', tile.size, (0, 0, 0, 0))
+            output.paste(tile, (0, 0), circle_mask_image(tile.width))
+            tile = output
+        self.image.paste(tile, xy, tile)
+
+    def finish(self):
+        return self.image
+
+
+class NumpyCanvas:
+    """Records overlay elements as layers and blends them all in one pass.
+
+    ``draw`` is still a Pillow ImageDraw so callers can measure text; the
+    image itself is only touched by finish(), which hands the layers to a
+    Compositor.
+    """
+
+    def __init__(self, image, compositor):
+        self.image = image
+        self.draw = ImageDraw.Draw(image)
+        self.compositor = compositor
+        self.layers = []
+
+    def _color(self, fill):
+        color = ImageColor.getrgb(fill) if isinstance(fill, str) else tuple(fill)
+        return color[:3] + (255,) if len(color) == 3 else color
+
+    def rectangle(self, box, fill):
+        x0, y0, x1, y1 = box
+        if x1 < x0 or y1 < y0:
+            raise ValueError("x1 must be greater than or equal to x0, and y1 greater than or equal to y0")
+        # Pillow truncates the corners and includes the far edge
+        x0, y0, x1, y1 = (int(v) for v in box)
+        self.layers.append(('fill', x0, y0, (x1 - x0 + 1, y1 - y0 + 1), self._color(fill)))
+
+    def text(self, xy, text, fill, font):
+        left, top, right, bottom = self.draw.textbbox(xy, text, font=font)
+        if right <= left or bottom <= top:
+            return
+        glyphs = Image.new('L', (right - left, bottom - top), 0)
+        ImageDraw.Draw(glyphs).text((xy[0] - left, xy[1] - top), text, fill=255, font=font)
+        self.layers.append(('mask', left, top, np.asarray(glyphs), self._color(fill)))
+
+    def paste_profile(self, tile, xy, circle):
+        pixels = np.asarray(tile)
+        self.layers.append(('image', xy[0], xy[1], pixels, circle_mask_image(tile.width) if circle else None))
+
+    def finish(self):
+        self.compositor.composite(self.image, self.layers)
+        self.layers = []
+        return self.image
+
+
+class Compositor:
+    """Blends overlay layers onto an image with NumPy, matching Pillow exactly.
+
+    Each cluster of overlapping layers is read once into an integer work
+    buffer and every layer is applied to it in draw order, with the same
+    8-bit arithmetic Pillow's paste and text drawing use (so the result is
+    identical, overlaps included); the cluster is then written back with a
+    single paste. Work buffers are kept per thread and reused across
+    renders, growing only when a larger region comes along.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def _buffer(self, name, shape, dtype=np.int32):
+        """A per-thread scratch array of at least ``shape``, reused between calls"""
+        buffers = self._local.__dict__.setdefault('buffers', {})
+        buffer = buffers.get(name)
+        if buffer is None or any(have < need for have, need in zip(buffer.shape, shape)):
+            grown = shape if buffer is None else tuple(max(a, b) for a, b in zip(buffer.shape, shape))
+            buffer = buffers[name] = np.empty(grown, dtype=dtype)
+        return buffer[tuple(slice(0, n) for n in shape)]
+
+    @staticmethod
+    def _clip(layer, width, height):
+        """Visible (x0, y0, x1, y1) of a layer on the canvas, or None"""
+        kind, x, y, data, _ = layer
+        w, h = data if kind == 'fill' else (data.shape[1], data.shape[0])
+        x0, y0, x1, y1 = max(x, 0), max(y, 0), min(x + w, width), min(y + h, height)
+        return (x0, y0, x1, y1) if x1 > x0 and y1 > y0 else None
+
+    @staticmethod
+    def _div255(values, scratch):
+        """In place: Pillow's rounded division by 255, ((v + 128) >> 8 + v + 128) >> 8"""
+        values += 128
+        np.right_shift(values, 8, out=scratch)
+        values += scratch
+        np.right_shift(values, 8, out=values)
+
+    def _blend(self, dst, mask, inverse, source, scratch):
+        """In place: dst moves towards ``source`` by ``mask`` (0-255), like Pillow's BLEND"""
+        dst *= inverse
+        np.multiply(mask, source, out=scratch)
+        dst += scratch
+        self._div255(dst, scratch)
+
+    @staticmethod
+    def _regions(layers, boxes):
+        """Merge overlapping layer boxes; yields (region, [(layer, box)] in draw order)
+
+        Overlay elements sit far apart (name near the top, profile and
+        address near the bottom), so blending each cluster separately
+        converts a few small patches instead of most of the frame.
+        """
+        groups = [(box, [(index, layers[index], box)]) for index, box in enumerate(boxes) if box]
+        merged = True
+        while merged:
+            merged = False
+            for a in range(len(groups)):
+                for b in range(a + 1, len(groups)):
+                    (ra, ma), (rb, mb) = groups[a], groups[b]
+                    if ra[0] < rb[2] and rb[0] < ra[2] and ra[1] < rb[3] and rb[1] < ra[3]:
+                        region = (min(ra[0], rb[0]), min(ra[1], rb[1]), max(ra[2], rb[2]), max(ra[3], rb[3]))
+                        groups[a] = (region, ma + mb)
+                        del groups[b]
+                        merged = True
+                        break
+                if merged:
+                    break
+        for region, members in groups:
+            yield region, [(layer, box) for _, layer, box in sorted(members, key=lambda m: m[0])]
+
+    def composite(self, image, layers):
+        channels = len(image.getbands())
+        boxes = [self._clip(layer, image.width, image.height) for layer in layers]
+        for region, members in self._regions(layers, boxes):
+            self._composite_region(image, region, members, channels)
+        return image
+
+    def _composite_region(self, image, region, members, channels):
+        rx0, ry0, rx1, ry1 = region
+        height, width = ry1 - ry0, rx1 - rx0
+        # Planar (channel, row, column) so per-pixel masks apply to whole planes
+        work = self._buffer('work', (channels, height, width))
+        work[...] = np.asarray(image.crop(region)).transpose(2, 0, 1)
+
+        for (kind, x, y, data, extra), (x0, y0, x1, y1) in members:
+            dst = work[:, y0 - ry0:y1 - ry0, x0 - rx0:x1 - rx0]
+            if kind == 'fill':
+                # Rectangles replace the pixels, alpha included
+                for channel in range(channels):
+                    dst[channel] = extra[channel]
+                continue
+
+            shape = dst.shape[1:]
+            rows, cols = slice(y0 - y, y1 - y), slice(x0 - x, x1 - x)
+            mask, inverse, scratch = (self._buffer(name, shape) for name in ('mask', 'inverse', 'scratch'))
+            if kind == 'mask':
+                # Text: each channel moves towards the ink by the glyph coverage
+                mask[...] = data[rows, cols]
+                np.subtract(255, mask, out=inverse)
+                if channels == 4:
+                    # ...except that colour on fully transparent pixels becomes the ink
+                    color_mask = self._buffer('color_mask', shape)
+                    np.copyto(color_mask, mask)
+                    color_mask[(dst[3] == 0) & (mask != 0)] = 255
+                    color_inverse = self._buffer('color_inverse', shape)
+                    np.subtract(255, color_mask, out=color_inverse)
+                    for channel in range(3):
+                        self._blend(dst[channel], color_mask, color_inverse, extra[channel], scratch)
+                    self._blend(dst[3], mask, inverse, extra[3], scratch)
+                else:
+                    for channel in range(channels):
+                        self._blend(dst[channel], mask, inverse, extra[channel], scratch)
+                continue
+
+            # Profile tile, pasted through its own alpha
+            sources = self._buffer('tile', (4,) + shape)
+            sources[...] = data[rows, cols].transpose(2, 0, 1)
+            if extra is not None:
+                # Cut out through the circle first, as a paste onto a transparent tile would
+                circle = np.asarray(extra)[rows, cols]
+                for channel in range(4):
+                    sources[channel] *= circle
+                    self._div255(sources[channel], scratch)
+            np.copyto(mask, sources[3])
+            np.subtract(255, mask, out=inverse)
+            for channel in range(channels):
+                self._blend(dst[channel], mask, inverse, sources[channel], scratch)
+
+        pixels = self._buffer('pixels', (height, width, channels), np.uint8)
+        np.copyto(pixels, work.transpose(1, 2, 0), casting='unsafe')
+        image.paste(Image.fromarray(pixels, image.mode), (rx0, ry0))
+
+
+def make_canvas(image, engine, compositor):
+    """Canvas for create_overlay_image: 'numpy' or the plain Pillow one"""
+    if engine == 'numpy':
+        return NumpyCanvas(image, compositor)
+    return PillowCanvas(image)
@@ -0,0 +1,208 @@
+import logging
+import queue
+import threading
+from io import BytesIO
+
+from PIL import Image
+
+from prerender import is_video_post
+
+logger = logging.getLogger(__name__)
+
+# Width-bounded versions for list views; never upscaled
+WIDTH_DERIVATIVES = (('thumbnail', 320), ('feed', 1080))
+# Only list views get lossy versions; renders start from the lossless frame one
+JPEG_QUALITY = {'thumbnail': 80, 'feed': 85}
+
+
+def frame_fit_size(width, height, frame_width, frame_height):
+    """Size the renderer scales a template to: contained in the frame, aspect kept"""
+    scale = min(frame_width / width, frame_height / height)
+    return int(width * scale), int(height * scale)
+
+
+def frame_dimensions(admin_post):
+    frame_size = admin_post.get('frameSize', {'width': 1080, 'height': 1920})
+    return frame_size.get('width', 1080), frame_size.get('height', 1920)
+
+
+def current_derivatives(admin_post):
+    """Derivatives that were generated from the post's current mainImage"""
+    derivatives = admin_post.get('derivatives') or {}
+    source = admin_post.get('mainImage')
+    return {
+        name: info for name, info in derivatives.items()
+        if isinstance(info, dict) and info.get('source') == source and info.get('url')
+    }
+
+
+def is_lossless(info):
+    return info.get('format') == 'png'
+
+
+def pick_template_url(admin_post, frame_width, frame_height):
+    """Smallest lossless derivative that still covers the frame-fit size, else mainImage"""
+    best = None
+    for info in current_derivatives(admin_post).values():
+        if not is_lossless(info):
+            # Rendering from a JPEG would add its artifacts to every overlay
+            continue
+        needed = frame_fit_size(info['width'], info['height'], frame_width, frame_height)
+        if info['width'] >= needed[0] and info['height'] >= needed[1]:
+            if best is None or info['width'] * info['height'] < best['width'] * best['height']:
+                best = info
+    return best['url'] if best else admin_post['mainImage']
+
+
+def pick_display_url(admin_post, width):
+    """Smallest JPEG derivative at least ``width`` pixels wide, else the largest one or mainImage"""
+    # The lossless frame version is for rendering; it's far heavier than a JPEG for list views
+    candidates = sorted((info for info in current_derivatives(admin_post).values() if not is_lossless(info)),
+                        key=lambda info: info['width'])
+    for info in candidates:
+        if info['width'] >= width:
+            return info['url']
+    return candidates[-1]['url'] if candidates else admin_post.get('mainImage')
+
+
+def build_derivatives(image, frame_width, frame_height):
+    """Yield (name, resized image) for every derivative of an RGB template"""
+    width, height = image.size
+    frame_size = frame_fit_size(width, height, frame_width, frame_height)
+    for name, max_width in WIDTH_DERIVATIVES:
+        size = (max_width, max(1, round(height * max_width / width)))
+        # Made even when the frame-fit version has the same size, as that one is a PNG
+        if width > max_width:
+            yield name, image.resize(size, Image.Resampling.LANCZOS)
+    yield 'frame', image if frame_size == image.size else image.resize(frame_size, Image.Resampling.LANCZOS)
+
+
+class DerivativeGenerator:
+    """Generates thumbnail and feed (JPEG) and frame-fit (PNG) versions of admin post images.
+
+    Listens for published posts whose derivatives are missing or were made
+    from a different mainImage (including ones published before this ran),
+    and generates them on a background thread. Each version is uploaded
+    once and recorded on the post under ``derivatives.<name>`` with its URL,
+    size and source image, which is how the renderer and the feed find it.
+    """
+
+    def __init__(self, db, bucket, fetch_bytes):
+        self.db = db
+        self.bucket = bucket
+        self.fetch_bytes = fetch_bytes
+        self._posts = queue.Queue()
+        self._queued_ids = set()
+        self._stop = threading.Event()
+        self._worker = None
+        self._watch = None
+        self.generated = 0
+        self.failed = 0
+
+    def start(self):
+        if self._worker is not None:
+            return
+        self._worker = threading.Thread(target=self._run, name='derivatives', daemon=True)
+        self._worker.start()
+        query = self.db.collection('admin_posts').where('isPublished', '==', True)
+        self._watch = query.on_snapshot(self._on_snapshot)
+
+    def stop(self):
+        self._stop.set()
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+
+    def enqueue_post(self, admin_post_id):
+        """Queue a post for derivative generation (no-op if it is already queued)"""
+        if admin_post_id in self._queued_ids:
+            return False
+        self._queued_ids.add(admin_post_id)
+        self._posts.put(admin_post_id)
+        return True
+
+    def stats(self):
+        return {'queued_posts': self._posts.qsize(), 'generated': self.generated, 'failed': self.failed}
+
+    def _on_snapshot(self, docs, changes, read_time):
+        for change in changes:
+            if change.type.name == 'REMOVED':
+                continue
+            admin_post = change.document.to_dict() or {}
+            if self._needs_derivatives(admin_post):
+                self.enqueue_post(change.document.id)
+
+    def _needs_derivatives(self, admin_post):
+        if not admin_post.get('mainImage') or is_video_post(admin_post):
+            return False
+        derivatives = current_derivatives(admin_post)
+        # Frame versions from before they were stored losslessly are redone
+        frame = derivatives.get('frame')
+        if frame is None or not is_lossless(frame):
+            return True
+        # So are posts whose feed version was skipped for matching the frame one
+        return 'thumbnail' in derivatives and 'feed' not in derivatives and frame['width'] == dict(WIDTH_DERIVATIVES)['feed']
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                admin_post_id = self._posts.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            try:
+                self.generate(admin_post_id)
+            except Exception:
+                self.failed += 1
+                logger.exception("Derivative generation failed", extra={"admin_post_id": admin_post_id})
+            finally:
+                self._queued_ids.discard(admin_post_id)
+
+    def generate(self, admin_post_id):
+        """Generate, upload and record all derivatives of one post; returns their names"""
+        doc_ref = self.db.collection('admin_posts').document(admin_post_id)
+        admin_doc = doc_ref.get()
+        if not admin_doc.exists:
+            return []
+        admin_post = admin_doc.to_dict()
+        if not self._needs_derivatives(admin_post):
+            return []
+
+        source = admin_post['mainImage']
+        image = Image.open(BytesIO(self.fetch_bytes(source)))
+        image.load()
+        # The renderer flattens templates to RGB the same way, so the PNG
+        # frame version has exactly the pixels a render from mainImage sees
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        frame_width, frame_height = frame_dimensions(admin_post)
+
+        updates = {}
+        for name, derivative in build_derivatives(image, frame_width, frame_height):
+            url = self._upload(admin_post_id, name, derivative)
+            updates[f"derivatives.{name}"] = {
+                'url': url,
+                'width': derivative.width,
+                'height': derivative.height,
+                'source': source,
+                'format': 'jpeg' if name in JPEG_QUALITY else 'png',
+            }
+        # updatedAt is left alone: the template content is unchanged, so
+        # cached overlays stay valid
+        doc_ref.update(updates)
+        self.generated += 1
+        logger.info("Generated derivatives", extra={"admin_post_id": admin_post_id, "derivatives": len(updates)})
+        return [key.split('.', 1)[1] for key in updates]
+
+    def _upload(self, admin_post_id, name, image):
+        buffer = BytesIO()
+        if name in JPEG_QUALITY:
+            image.save(buffer, format='JPEG', quality=JPEG_QUALITY[name], optimize=True)
+            extension, content_type = 'jpg', 'image/jpeg'
+        else:
+            image.save(buffer, format='PNG')
+            extension, content_type = 'png', 'image/png'
+        filename = f"admin_post_derivatives/{admin_post_id}/{name}_{image.width}x{image.height}.{extension}"
+        blob = self.bucket.blob(filename)
+        blob.upload_from_string(buffer.getvalue(), content_type=content_type)
+        blob.make_public()
+        return f"https://firebasestorage.googleapis.com/v0/b/{self.bucket.name}/o/{filename.replace('/', '%2F')}?alt=media"
@@ -0,0 +1,149 @@
+import base64
+import bisect
+import hashlib
+import logging
+import threading
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+ALL = '*'
+
+
+def _sort_key(post_id, data):
+    """Newest first: negated createdAt, then ID to break ties"""
+    created = data.get('createdAt')
+    timestamp = created.timestamp() if isinstance(created, datetime) else 0.0
+    return (-timestamp, post_id)
+
+
+def _categories(data):
+    categories = data.get('categories') or []
+    if isinstance(categories, str):
+        categories = [categories]
+    if data.get('category'):
+        categories = list(categories) + [data['category']]
+    return set(categories)
+
+
+def _jsonable(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, dict):
+        return {k: _jsonable(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_jsonable(v) for v in value]
+    return value
+
+
+def encode_cursor(sort_key):
+    raw = f"{sort_key[0]!r}|{sort_key[1]}".encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; raises ValueError on anything malformed"""
+    padded = cursor + '=' * (-len(cursor) % 4)
+    timestamp, _, post_id = base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8').partition('|')
+    if not post_id:
+        raise ValueError('bad cursor')
+    return (float(timestamp), post_id)
+
+
+class FeedIndex:
+    """In-memory feed of published admin posts, kept current by a snapshot listener.
+
+    Every post is filed under (category, language) buckets, including
+    wildcard ones, as a list of sort keys kept in order with bisect. A
+    change re-files just that post, so a page request is a bisect and a
+    slice: Firestore is read once per change, not once per client.
+    """
+
+    def __init__(self, db, collection='admin_posts'):
+        self.db = db
+        self.collection = collection
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._watch = None
+        self._posts = {}    # post_id -> (sort_key, buckets, json-ready post, update token)
+        self._buckets = {}  # (category, language) -> sorted list of sort keys
+        self.changes = 0
+
+    def start(self):
+        if self._watch is None:
+            query = self.db.collection(self.collection).where('isPublished', '==', True)
+            self._watch = query.on_snapshot(self._on_snapshot)
+
+    def stop(self):
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+
+    def wait_ready(self, timeout):
+        return self._ready.wait(timeout)
+
+    def _on_snapshot(self, docs, changes, read_time):
+        with self._lock:
+            for change in changes:
+                doc = change.document
+                self._remove(doc.id)
+                if change.type.name != 'REMOVED':
+                    self._add(doc.id, doc.to_dict() or {}, getattr(doc, 'update_time', None))
+            self.changes += len(changes)
+        if not self._ready.is_set():
+            self._ready.set()
+            logger.info("Feed index loaded", extra={"posts": len(self._posts)})
+
+    def _add(self, post_id, data, update_time):
+        sort_key = _sort_key(post_id, data)
+        categories = _categories(data) | {ALL}
+        languages = {data.get('language') or ALL, ALL}
+        buckets = [(category, language) for category in categories for language in languages]
+        for bucket in buckets:
+            bisect.insort(self._buckets.setdefault(bucket, []), sort_key)
+        post = _jsonable(dict(data, id=post_id))
+        token = str(update_time.timestamp() if update_time is not None else sort_key[0])
+        self._posts[post_id] = (sort_key, buckets, post, token)
+
+    def _remove(self, post_id):
+        entry = self._posts.pop(post_id, None)
+        if entry is None:
+            return
+        sort_key, buckets, _, _ = entry
+        for bucket in buckets:
+            keys = self._buckets.get(bucket)
+            index = bisect.bisect_left(keys, sort_key)
+            if index < len(keys) and keys[index] == sort_key:
+                del keys[index]
+            if not keys:
+                del self._buckets[bucket]
+
+    def page(self, category=None, language=None, cursor=None, limit=20):
+        """Return (posts, next_cursor, etag) for one page of a bucket
+
+        ``cursor`` is the opaque value from a previous page; raises
+        ValueError if it can't be decoded.
+        """
+        after = decode_cursor(cursor) if cursor else None
+        with self._lock:
+            keys = self._buckets.get((category or ALL, language or ALL), [])
+            start = bisect.bisect_right(keys, after) if after is not None else 0
+            page_keys = keys[start:start + limit]
+            entries = [self._posts[key[1]] for key in page_keys]
+            has_more = start + limit < len(keys)
+        posts = [entry[2] for entry in entries]
+        next_cursor = encode_cursor(page_keys[-1]) if has_more and page_keys else None
+        digest = hashlib.sha1()
+        for entry in entries:
+            digest.update(f"{entry[0][1]}:{entry[3]};".encode('utf-8'))
+        digest.update(f"next={next_cursor}".encode('utf-8'))
+        return posts, next_cursor, f'W/"{digest.hexdigest()}"'
+
+    def stats(self):
+        with self._lock:
+            return {
+                'ready': self._ready.is_set(),
+                'posts': len(self._posts),
+                'buckets': len(self._buckets),
+                'changes': self.changes,
+            }
@@ -0,0 +1,46 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Lazy:
+    """Builds an expensive object on first use and proxies attribute access to it.
+
+    ``db.collection(...)`` on a Lazy firestore client works like it does on
+    the client itself; the import and connection happen on that first
+    call instead of at module load. get() returns the object directly.
+    """
+
+    def __init__(self, factory, label):
+        self._factory = factory
+        self._label = label
+        self._lock = threading.Lock()
+        self._target = None
+        self.load_seconds = None
+
+    @property
+    def label(self):
+        # Not ``name``: that would shadow attributes like bucket.name
+        return self._label
+
+    @property
+    def loaded(self):
+        return self._target is not None
+
+    def get(self):
+        if self._target is None:
+            with self._lock:
+                if self._target is None:
+                    started = time.perf_counter()
+                    target = self._factory()
+                    self.load_seconds = time.perf_counter() - started
+                    self._target = target
+                    logger.info("Loaded %s", self._label, extra={"seconds": round(self.load_seconds, 3)})
+        return self._target
+
+    def __getattr__(self, attr):
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        return getattr(self.get(), attr)
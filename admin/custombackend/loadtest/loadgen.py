@@ -0,0 +1,250 @@
+"""Open-loop load generator for the custombackend API.
+
+For every worker count it starts ``uvicorn main:app --workers N`` against
+the Firestore/Storage emulators, then steps through the requested rates.
+Each step sends requests on a fixed schedule (open loop: a slow server
+does not slow the generator down) with an upper bound on in-flight
+requests, and records achieved throughput, latency percentiles and error
+rate. The knee is the highest rate that was still served on time.
+
+    python loadtest/loadgen.py --workers 1,2,4 --rps 1,2,4,8,16 --duration 30
+
+See loadtest/README.md for the emulator setup.
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+LOADTEST_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(LOADTEST_DIR)
+RESULTS_DIR = os.path.join(LOADTEST_DIR, 'results')
+sys.path[:0] = [LOADTEST_DIR, os.path.join(BACKEND_DIR, 'benchmarks')]
+
+from fixtures import BG_REMOVAL_INPUT, FIXTURES_DIR
+from seed_emulator import IMAGE_POST_ID, VIDEO_POST_ID, user_id
+import static_server
+
+DEFAULT_MIX = 'overlay_personal=4,overlay_business=4,remove_bg=1,download=1'
+DOWNLOAD_FILENAME = 'no-bg-loadtest.png'
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class Scenario:
+    def __init__(self, mix, users, seed):
+        self.rng = random.Random(seed)
+        self.names, self.weights = [], []
+        for part in mix.split(','):
+            name, weight = part.split('=')
+            self.names.append(name)
+            self.weights.append(float(weight))
+        self.users = users
+        self.next_user = 0
+        with open(os.path.join(FIXTURES_DIR, BG_REMOVAL_INPUT), 'rb') as f:
+            self.bg_input = f.read()
+
+    def _user(self):
+        self.next_user = (self.next_user + 1) % self.users
+        return user_id(self.next_user)
+
+    def next_request(self):
+        """Returns (name, method, path, request kwargs)"""
+        name = self.rng.choices(self.names, self.weights)[0]
+        if name in ('overlay_personal', 'overlay_business', 'overlay_video'):
+            endpoint = '/overlay_personal' if name == 'overlay_personal' else '/overlay_business'
+            post_id = VIDEO_POST_ID if name == 'overlay_video' else IMAGE_POST_ID
+            return name, 'POST', endpoint, {'json': {'user_id': self._user(), 'admin_post_id': post_id}}
+        if name == 'remove_bg':
+            return name, 'POST', '/remove-bg/', {'files': {'file': ('loadtest.png', self.bg_input, 'image/png')}}
+        if name == 'download':
+            return name, 'GET', f"/download/{DOWNLOAD_FILENAME}", {}
+        raise ValueError(f"unknown scenario {name!r}")
+
+
+async def run_step(client, scenario, rps, duration, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    samples = []  # (name, latency seconds, ok)
+    rejected = 0
+    tasks = []
+
+    async def send(name, method, path, kwargs):
+        started = time.perf_counter()
+        ok = False
+        try:
+            response = await client.request(method, path, **kwargs)
+            ok = response.status_code < 400
+        except httpx.HTTPError:
+            pass
+        finally:
+            samples.append((name, time.perf_counter() - started, ok))
+            semaphore.release()
+
+    start = time.perf_counter()
+    total = int(rps * duration)
+    for i in range(total):
+        delay = start + i / rps - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if semaphore.locked():
+            # Open loop: never queue behind a saturated server, count it instead
+            rejected += 1
+            continue
+        await semaphore.acquire()
+        tasks.append(asyncio.create_task(send(*scenario.next_request())))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for _, latency, ok in samples if ok)
+    errors = sum(1 for _, _, ok in samples if not ok) + rejected
+    per_endpoint = {}
+    for name, latency, ok in samples:
+        entry = per_endpoint.setdefault(name, {'requests': 0, 'errors': 0})
+        entry['requests'] += 1
+        entry['errors'] += 0 if ok else 1
+    return {
+        'target_rps': rps,
+        'achieved_rps': round(len(latencies) / elapsed, 3),
+        'sent': len(samples),
+        'client_rejected': rejected,
+        'error_rate': round(errors / total, 4) if total else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+        'per_endpoint': per_endpoint,
+    }
+
+
+def find_knee(steps, max_error_rate, latency_factor):
+    """Highest step that kept up with its target, stayed under the error
+    budget and kept p95 within ``latency_factor`` of the lightest step."""
+    if not steps:
+        return None
+    base_p95 = steps[0]['p95_ms'] or 1.0
+    knee = None
+    for step in steps:
+        on_time = step['achieved_rps'] >= 0.9 * step['target_rps']
+        if on_time and step['error_rate'] <= max_error_rate and step['p95_ms'] <= latency_factor * base_p95:
+            knee = step['target_rps']
+        else:
+            break
+    return knee
+
+
+def start_server(workers, port, state_dir):
+    """Start the API with its caches, media store and rate-limit buckets under ``state_dir``"""
+    env = dict(os.environ, LOG_LEVEL=os.getenv('LOG_LEVEL', 'WARNING'))
+    # Measure capacity, not the per-user rate limits
+    for name in ('RATE_LIMIT_PERSONAL_OVERLAY', 'RATE_LIMIT_BUSINESS_OVERLAY', 'RATE_LIMIT_ANONYMOUS_BG'):
+        env.setdefault(name, 'off')
+    # ...nor cache hits: the scenarios repeat the same templates and uploads
+    for name in ('RESULT_CACHE_TTL_SECONDS', 'TEMPLATE_CACHE_TTL_SECONDS', 'BG_REMOVAL_CACHE_TTL_SECONDS'):
+        env.setdefault(name, '0')
+    # Nothing a previous run stored on disk is reused
+    env.update(
+        CACHE_DIR=os.path.join(state_dir, 'cache'),
+        MEDIA_STORE_DIR=os.path.join(state_dir, 'media_store'),
+        RATE_LIMIT_SQLITE_PATH=os.path.join(state_dir, 'rate_limits.sqlite3'),
+    )
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'main:app', '--host', '127.0.0.1',
+         '--port', str(port), '--workers', str(workers), '--no-access-log'],
+        cwd=BACKEND_DIR, env=env,
+    )
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/metrics", timeout=1).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError(f"API with {workers} workers did not start")
+
+
+async def sweep(base_url, scenario, rates, duration, concurrency):
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        # Make sure /download has something to serve
+        await client.post('/remove-bg/', files={'file': ('loadtest.png', scenario.bg_input, 'image/png')})
+        steps = []
+        for rps in rates:
+            step = await run_step(client, scenario, rps, duration, concurrency)
+            print(f"  {rps:>7} rps -> {step['achieved_rps']:8.2f} ok/s  p95 {step['p95_ms']:9.1f} ms  "
+                  f"errors {step['error_rate']:.1%}")
+            steps.append(step)
+        return steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', default='1,2,4', help='uvicorn worker counts to sweep')
+    parser.add_argument('--rps', default='1,2,4,8,16', help='request rates to step through')
+    parser.add_argument('--duration', type=float, default=30, help='seconds per step')
+    parser.add_argument('--concurrency', type=int, default=64, help='max in-flight requests')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='weighted scenario mix')
+    parser.add_argument('--users', type=int, default=200, help='seeded users to rotate through')
+    parser.add_argument('--port', type=int, default=8105)
+    parser.add_argument('--static-port', type=int, default=8765)
+    parser.add_argument('--base-url', help='test an already running API instead of starting one')
+    parser.add_argument('--max-error-rate', type=float, default=0.01)
+    parser.add_argument('--latency-factor', type=float, default=3.0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if not args.base_url and not os.getenv('FIRESTORE_EMULATOR_HOST'):
+        sys.exit('Set FIRESTORE_EMULATOR_HOST (and STORAGE_EMULATOR_HOST) before starting the API')
+
+    static_server.serve(args.static_port, background=True)
+    rates = [float(r) for r in args.rps.split(',')]
+    worker_counts = [None] if args.base_url else [int(w) for w in args.workers.split(',')]
+
+    report = {'args': vars(args), 'runs': []}
+    for workers in worker_counts:
+        print(f"workers={workers or 'external'}")
+        state_dir = tempfile.mkdtemp(prefix='loadtest_')
+        process = start_server(workers, args.port, state_dir) if workers else None
+        try:
+            base_url = args.base_url or f"http://127.0.0.1:{args.port}"
+            scenario = Scenario(args.mix, args.users, args.seed)
+            steps = asyncio.run(sweep(base_url, scenario, rates, args.duration, args.concurrency))
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+            shutil.rmtree(state_dir, ignore_errors=True)
+        knee = find_knee(steps, args.max_error_rate, args.latency_factor)
+        print(f"  knee: {knee} rps")
+        report['runs'].append({'workers': workers, 'knee_rps': knee, 'steps': steps})
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    stamp = time.strftime('%Y%m%d_%H%M%S')
+    with open(os.path.join(RESULTS_DIR, f"loadtest_{stamp}.json"), 'w') as f:
+        json.dump(report, f, indent=2)
+    with open(os.path.join(RESULTS_DIR, f"loadtest_{stamp}.csv"), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['workers', 'target_rps', 'achieved_rps', 'p50_ms', 'p95_ms', 'p99_ms', 'error_rate'])
+        for run in report['runs']:
+            for step in run['steps']:
+                writer.writerow([run['workers'], step['target_rps'], step['achieved_rps'],
+                                 step['p50_ms'], step['p95_ms'], step['p99_ms'], step['error_rate']])
+    print(f"Wrote {RESULTS_DIR}/loadtest_{stamp}.json and .csv")
+
+
+if __name__ == '__main__':
+    main()
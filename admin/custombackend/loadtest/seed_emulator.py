@@ -0,0 +1,58 @@
+"""Seeds the Firestore emulator with admin posts and users for load tests.
+
+Refuses to run unless FIRESTORE_EMULATOR_HOST is set, so it can't write to
+the production project by accident.
+
+    FIRESTORE_EMULATOR_HOST=127.0.0.1:8080 python loadtest/seed_emulator.py --users 200
+"""
+import argparse
+import os
+import sys
+
+import firebase_admin
+from firebase_admin import firestore
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from cases import ADMIN_POST, LONG_ADDRESS_USER, BUSINESS_USER, PERSONAL_USER
+from fixtures import PROFILE_IMAGE, TEMPLATE_IMAGE, TEMPLATE_VIDEO
+
+IMAGE_POST_ID = 'loadtest_image_post'
+VIDEO_POST_ID = 'loadtest_video_post'
+
+
+def user_id(i):
+    return f"loadtest_user_{i:05d}"
+
+
+def seed(static_base_url, users):
+    if not os.getenv('FIRESTORE_EMULATOR_HOST'):
+        sys.exit('FIRESTORE_EMULATOR_HOST is not set; refusing to seed a real project')
+    if not firebase_admin._apps:
+        firebase_admin.initialize_app(options={'projectId': os.getenv('GCLOUD_PROJECT', 'demo-primestatus')})
+    db = firestore.client()
+
+    image_post = dict(ADMIN_POST, mainImage=f"{static_base_url}/{TEMPLATE_IMAGE}", isPublished=True)
+    video_post = dict(image_post, mainImage=f"{static_base_url}/{TEMPLATE_VIDEO}", mediaType='video')
+    db.collection('admin_posts').document(IMAGE_POST_ID).set(image_post)
+    db.collection('admin_posts').document(VIDEO_POST_ID).set(video_post)
+
+    profile_url = f"{static_base_url}/{PROFILE_IMAGE}"
+    templates = [PERSONAL_USER, BUSINESS_USER, LONG_ADDRESS_USER]
+    batch = db.batch()
+    for i in range(users):
+        user = dict(templates[i % len(templates)], profilePhotoUrl=profile_url, name=f"Load Test User {i}")
+        batch.set(db.collection('users').document(user_id(i)), user)
+        if (i + 1) % 500 == 0:
+            batch.commit()
+            batch = db.batch()
+    batch.commit()
+    print(f"Seeded 2 admin posts and {users} users")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--static-base-url', default='http://127.0.0.1:8765')
+    parser.add_argument('--users', type=int, default=200)
+    args = parser.parse_args()
+    seed(args.static_base_url, args.users)
@@ -0,0 +1,40 @@
+"""Serves template and profile images to the API under load.
+
+The seeded admin posts and users point at this server instead of the real
+CDN, so the overlay endpoints' downloads stay on the local machine.
+
+    python loadtest/static_server.py --port 8765
+"""
+import argparse
+import functools
+import os
+import sys
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from fixtures import ensure_fixtures
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, background=False):
+    directory = ensure_fixtures(include_video=True)
+    handler = functools.partial(QuietHandler, directory=directory)
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    if background:
+        threading.Thread(target=server.serve_forever, name='static-server', daemon=True).start()
+        return server
+    print(f"Serving {directory} on http://127.0.0.1:{port}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8765)
+    serve(parser.parse_args().port)
@@ -0,0 +1,149 @@
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+import uuid
+from contextvars import ContextVar
+
+# Request ID of the request being served, attached to every log record
+request_id_var = ContextVar('request_id', default='-')
+
+_RESERVED_ATTRS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'request_id'}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; anything passed via ``extra=`` becomes a field"""
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'request_id': getattr(record, 'request_id', '-'),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class RequestContextFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps only a fraction of DEBUG records so hot-path debug lines stay cheap"""
+
+    def __init__(self, debug_rate):
+        super().__init__()
+        self.debug_rate = debug_rate
+        self.sampled_out = 0
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.debug_rate >= 1.0:
+            return True
+        if random.random() < self.debug_rate:
+            return True
+        self.sampled_out += 1
+        return False
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to a background listener; drops them if the queue is full
+
+    Formatting and the write to stdout happen on the listener thread, so a
+    request thread only pays for building the record and a put_nowait.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.emitted = 0
+        self.dropped = 0
+        self.emit_seconds = 0.0
+
+    def prepare(self, record):
+        # The listener formats; only make the record safe to hand across threads
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        started = time.perf_counter()
+        try:
+            self.queue.put_nowait(self.prepare(record))
+            self.emitted += 1
+        except queue.Full:
+            self.dropped += 1
+        finally:
+            self.emit_seconds += time.perf_counter() - started
+
+
+_queue_handler = None
+_sampling_filter = None
+_listener = None
+
+
+def setup_logging(level=None, debug_sample_rate=None, queue_size=10000):
+    """Route all logging through a sampled, non-blocking JSON pipeline"""
+    global _queue_handler, _sampling_filter, _listener
+    if _listener is not None:
+        return
+
+    level = level or os.getenv('LOG_LEVEL', 'INFO')
+    if debug_sample_rate is None:
+        debug_sample_rate = float(os.getenv('LOG_DEBUG_SAMPLE_RATE', 0.01))
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter())
+
+    log_queue = queue.Queue(maxsize=queue_size)
+    _queue_handler = NonBlockingQueueHandler(log_queue)
+    _sampling_filter = SamplingFilter(debug_sample_rate)
+    _queue_handler.addFilter(_sampling_filter)
+    _queue_handler.addFilter(RequestContextFilter())
+
+    root = logging.getLogger()
+    root.handlers = [_queue_handler]
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def new_request_id(incoming=None):
+    """Use the caller's X-Request-ID if it sent one, otherwise mint a new one"""
+    return incoming or uuid.uuid4().hex[:16]
+
+
+def stats():
+    """Logging overhead counters (emit_seconds is time spent on request threads)"""
+    if _queue_handler is None:
+        return {}
+    return {
+        'emitted': _queue_handler.emitted,
+        'dropped': _queue_handler.dropped,
+        'sampled_out': _sampling_filter.sampled_out,
+        'emit_seconds': round(_queue_handler.emit_seconds, 6),
+        'queue_depth': _queue_handler.queue.qsize(),
+    }
@@ -1,29 +1,54 @@
-from fastapi import FastAPI, HTTPException, File, UploadFile
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi import APIRouter, FastAPI, HTTPException, File, UploadFile, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+from typing import Optional
 import firebase_admin
-from firebase_admin import credentials, firestore, storage
+from firebase_admin import credentials
 import os
+import shutil
+import threading
 from dotenv import load_dotenv
-import uvicorn
-from PIL import Image, ImageDraw, ImageFont
-from rembg import remove
+from PIL import Image, ImageFont
 import requests
+from requests.adapters import HTTPAdapter
 from io import BytesIO
 import uuid
+import hashlib
+import hmac
+import json
 from datetime import datetime
-from sqlalchemy import create_engine, Column, Integer, String, DateTime
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from moviepy.editor import VideoFileClip, ImageClip, CompositeVideoClip
 import tempfile
+from result_cache import overlay_cache_key
+from tiered_cache import IMAGE, JSON, TieredCache
+from prerender import PrerenderScheduler, is_video_post, overlay_type_for, overlay_user_data
+from singleflight import SingleFlight
+from feed_index import FeedIndex
+from derivatives import DerivativeGenerator, pick_display_url, pick_template_url
+from compositor import Compositor, make_canvas
+from buffer_pool import BufferPool
+from media_store import MediaStore
+from lazy import Lazy
+from worker_pools import PoolBusy, WorkerPool
+from admission import AdmissionController, Rejected, RouteClass, cgroup_memory_limit_bytes
+from rate_limit import Limit, MemoryBackend, RateLimited, RateLimiter, SQLiteBackend
+import metrics
+from metrics import stage
+import logging
+import logging_setup
 
 load_dotenv()
 
+logging_setup.setup_logging()
+logger = logging.getLogger("custombackend")
+
 # Create folders for background removal
 os.makedirs("upload/input", exist_ok=True)
 os.makedirs("upload/output", exist_ok=True)
+# Background-removal results by content hash; /download names link to these
+BG_RESULTS_DIR = "upload/output/by_digest"
+os.makedirs(BG_RESULTS_DIR, exist_ok=True)
 
 # Initialize Firebase
 cred_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS", "serviceAccountKey.json")
@@ -38,12 +63,375 @@ if not firebase_admin._apps:
         'storageBucket': bucket_name
     })
 
-db = firestore.client()
-bucket = storage.bucket()
+# Heavy clients and libraries load on first use (or through /warmup), so
+# the process starts serving without paying for the ones it never needs
+def connect_firestore():
+    from firebase_admin import firestore
+    return firestore.client()
+
+def connect_storage():
+    from firebase_admin import storage
+    return storage.bucket()
+
+def load_bg_remover():
+    # One model session for the process instead of one per request
+    from rembg import new_session, remove
+    session = new_session()
+    return lambda image: remove(image, session=session)
+
+def load_video_editor():
+    import moviepy.editor
+    return moviepy.editor
+
+db = Lazy(connect_firestore, "firestore")
+bucket = Lazy(connect_storage, "storage")
+bg_remover = Lazy(load_bg_remover, "rembg")
+video_editor = Lazy(load_video_editor, "moviepy")
+LAZY_COMPONENTS = {component.label: component for component in (db, bucket, bg_remover, video_editor)}
 
 app = FastAPI(title="Crafto API")
 
-# Allow Swagger UI file upload
+# Admission control: each kind of request gets its own slots and bounded
+# wait queue, and expensive ones are turned away (429) before they read
+# their body when memory is short. Limits come from
+# ADMISSION_<CLASS>_{MAX_CONCURRENT,MAX_QUEUE,QUEUE_TIMEOUT,MEMORY_MB}
+def route_class(name, prefixes, methods=None, max_concurrent=8, max_queue=16,
+                queue_timeout=10, memory_mb=0, shed_on_memory=True):
+    prefix = f"ADMISSION_{name.upper()}_"
+    return RouteClass(
+        name, prefixes, methods,
+        max_concurrent=int(os.getenv(prefix + "MAX_CONCURRENT", max_concurrent)),
+        max_queue=int(os.getenv(prefix + "MAX_QUEUE", max_queue)),
+        queue_timeout=float(os.getenv(prefix + "QUEUE_TIMEOUT", queue_timeout)),
+        memory_cost_bytes=int(os.getenv(prefix + "MEMORY_MB", memory_mb)) * 1024 * 1024,
+        shed_on_memory=shed_on_memory,
+    )
+
+def admission_memory_limit():
+    """ADMISSION_MEMORY_LIMIT_MB, else 85% of the container limit, else no memory shedding"""
+    if os.getenv("ADMISSION_MEMORY_LIMIT_MB"):
+        return int(os.getenv("ADMISSION_MEMORY_LIMIT_MB")) * 1024 * 1024
+    limit = cgroup_memory_limit_bytes()
+    return int(limit * 0.85) if limit else None
+
+admission = AdmissionController(
+    [
+        route_class("overlay", ("/overlay_",), ("POST",), max_concurrent=16, max_queue=64, memory_mb=64),
+        route_class("bg", ("/remove-bg",), ("POST",), max_concurrent=2, max_queue=8, queue_timeout=30, memory_mb=512),
+        route_class("render", ("/prerender/", "/derivatives/", "/warmup"), ("POST",),
+                    max_concurrent=2, max_queue=8, memory_mb=128),
+    ],
+    # Cheap reads: a much larger share, never shed for memory, so their
+    # latency holds while uploads and renders queue
+    default=route_class("api", (), max_concurrent=200, max_queue=400, queue_timeout=5, shed_on_memory=False),
+    memory_limit_bytes=admission_memory_limit(),
+    on_reject=lambda name, reason: metrics.ADMISSION_REJECTIONS.labels(name, reason).inc(),
+)
+
+@app.middleware("http")
+async def admission_control(request, call_next):
+    try:
+        async with admission.admit(request.method, request.url.path):
+            return await call_next(request)
+    except Rejected as e:
+        return JSONResponse({"detail": str(e)}, status_code=429, headers={"Retry-After": str(e.retry_after)})
+
+@app.get("/admission/stats")
+def admission_stats():
+    """Slots, queues and rejections per route class, and the memory picture"""
+    return admission.stats()
+
+# Routes are grouped by the kind of work they do. SERVICE_ROLES picks the
+# groups this process serves (all of them by default), so the same app can
+# run as an API deployment, an image renderer, a video renderer or a bg
+# removal worker, each on its own port and scaled on its own. A role that
+# isn't served here is forwarded to WORKER_URLS (e.g.
+# "video=http://video-render:8007,bg=http://bg-worker:8008") if it has one.
+SERVICE_ROLES = {role.strip() for role in os.getenv("SERVICE_ROLES", "api,image,video,bg").split(",") if role.strip()}
+WORKER_URLS = dict(
+    entry.strip().split("=", 1) for entry in os.getenv("WORKER_URLS", "").split(",") if "=" in entry
+)
+WORKER_TIMEOUT = float(os.getenv("WORKER_TIMEOUT_SECONDS", 300))
+
+api_router = APIRouter()       # Firestore reads and the feed
+overlay_router = APIRouter()   # /overlay_*, rendered on the image or video pool
+render_router = APIRouter()    # pre-rendering and derivatives
+bg_router = APIRouter()        # background removal and its downloads
+
+def make_pool(role, max_workers, max_queue):
+    prefix = role.upper()
+    return WorkerPool(
+        role,
+        max_workers=int(os.getenv(f"{prefix}_POOL_WORKERS", max_workers)),
+        max_queue=int(os.getenv(f"{prefix}_POOL_QUEUE", max_queue)),
+        remote_url=None if role in SERVICE_ROLES else WORKER_URLS.get(role),
+    )
+
+def pool_available(pool):
+    return pool.name in SERVICE_ROLES or pool.remote_url is not None
+
+# Heavy work never runs on the threads that serve cheap requests
+image_pool = make_pool("image", 4, 32)
+video_pool = make_pool("video", 1, 4)
+bg_pool = make_pool("bg", 1, 8)
+WORKER_POOLS = (image_pool, video_pool, bg_pool)
+for pool in WORKER_POOLS:
+    for name in ("running", "completed", "failed", "rejected"):
+        metrics.WORKER_POOL.labels(pool.name, name).set_function(lambda pool=pool, name=name: getattr(pool, name))
+
+@app.on_event("startup")
+def limit_api_threads():
+    # Sync API handlers run on AnyIO's shared thread pool; API_POOL_WORKERS sizes it
+    import anyio.to_thread
+    anyio.to_thread.current_default_thread_limiter().total_tokens = int(os.getenv("API_POOL_WORKERS", 40))
+
+@app.on_event("shutdown")
+def stop_worker_pools():
+    for pool in WORKER_POOLS:
+        pool.shutdown()
+    for session in forwarding_sessions.values():
+        session.close()
+
+@app.exception_handler(PoolBusy)
+async def pool_busy(request, exc):
+    return JSONResponse({"detail": str(exc)}, status_code=503, headers={"Retry-After": "5"})
+
+def forwarding_session(pool):
+    """Keep-alive connections to the pool's deployment, one per pool thread"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool.max_workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+# Forwarded calls reuse connections instead of connecting to the worker every time
+forwarding_sessions = {pool.name: forwarding_session(pool) for pool in WORKER_POOLS if pool.remote_url}
+
+def _forward_request(session, url, method, body, headers):
+    return session.request(method, url, data=body, headers=headers, timeout=WORKER_TIMEOUT)
+
+async def forward(pool, request):
+    """Send a request on to the deployment that serves ``pool``'s role"""
+    url = pool.remote_url + request.url.path + (f"?{request.url.query}" if request.url.query else "")
+    headers = {
+        key: value for key, value in request.headers.items()
+        if key.lower() in ("content-type", "x-request-id", "if-none-match", "authorization")
+    }
+    headers["X-Request-ID"] = logging_setup.request_id_var.get()
+    headers["X-Forwarded-For"] = client_ip(request)
+    if WORKER_SHARED_SECRET:
+        # Tells the worker the call comes from here: its X-Forwarded-For is
+        # genuine and its rate limit has already been charged
+        headers["X-Worker-Secret"] = WORKER_SHARED_SECRET
+    with stage('forward'):
+        remote = await pool.run(_forward_request, forwarding_sessions[pool.name], url, request.method,
+                                await request.body(), headers)
+    passed = {key: value for key, value in remote.headers.items()
+              if key.lower() in ("content-type", "content-disposition", "etag", "cache-control", "retry-after",
+                                  "x-overlay-tier")}
+    return Response(content=remote.content, status_code=remote.status_code, headers=passed)
+
+def forwarding_routes(router, pool, checks=None):
+    """A router with the same paths as ``router`` that forwards everything to ``pool``
+
+    ``checks`` maps a route path to a function run on the request before
+    it is forwarded, such as the rate limit the local route enforces.
+    """
+    forwarding = APIRouter()
+    def forwarder(check):
+        async def forward_to_pool(request: Request):
+            if check is not None:
+                await run_in_threadpool(check, request)
+            return await forward(pool, request)
+        return forward_to_pool
+    for route in router.routes:
+        forwarding.add_api_route(route.path, forwarder((checks or {}).get(route.path)),
+                                 methods=list(route.methods), include_in_schema=False)
+    return forwarding
+
+# Per-caller rate limits: overlays by user and subscription tier
+# (personal/business), background removal by client IP ("anonymous").
+# RATE_LIMIT_<TIER>_<ACTION>="<calls>/<seconds>" overrides a limit, "off"
+# removes it. RATE_LIMIT_BACKEND=sqlite shares the buckets between the
+# worker processes of one host through RATE_LIMIT_SQLITE_PATH
+DEFAULT_RATE_LIMITS = {
+    ("personal", "overlay"): "30/60",
+    ("business", "overlay"): "120/60",
+    ("anonymous", "bg"): "10/60",
+}
+# A video render takes this many overlay tokens
+VIDEO_RATE_COST = int(os.getenv("RATE_LIMIT_VIDEO_COST", 5))
+# Only for a proxy in front that overwrites X-Forwarded-For; otherwise callers could pick their own bucket
+TRUST_FORWARDED_FOR = os.getenv("RATE_LIMIT_TRUST_FORWARDED_FOR", "false").lower() == "true"
+# Shared by the API and its workers in a split deployment. Overlays and
+# background removal are rate-limited by the API before it forwards; the
+# worker recognises the forwarded calls by this secret and doesn't charge
+# them again
+WORKER_SHARED_SECRET = os.getenv("WORKER_SHARED_SECRET", "")
+
+def rate_limits():
+    limits = {}
+    for (tier, action), default in DEFAULT_RATE_LIMITS.items():
+        spec = os.getenv(f"RATE_LIMIT_{tier.upper()}_{action.upper()}", default)
+        if spec.lower() != "off":
+            limits[(tier, action)] = Limit.parse(spec)
+    return limits
+
+def rate_limit_backend():
+    if os.getenv("RATE_LIMIT_BACKEND", "memory").lower() == "sqlite":
+        return SQLiteBackend(os.getenv("RATE_LIMIT_SQLITE_PATH", "rate_limits.sqlite3"))
+    return MemoryBackend()
+
+rate_limiter = RateLimiter(rate_limit_backend(), rate_limits())
+
+def forwarded_by_api(request):
+    """Whether the request was forwarded by our own API (it carries the shared secret)"""
+    secret = request.headers.get("X-Worker-Secret")
+    return bool(WORKER_SHARED_SECRET and secret) and hmac.compare_digest(secret.encode(), WORKER_SHARED_SECRET.encode())
+
+def client_ip(request):
+    """The caller's address; X-Forwarded-For is only believed from our API or a trusted proxy"""
+    if (TRUST_FORWARDED_FOR or forwarded_by_api(request)) and request.headers.get("X-Forwarded-For"):
+        return request.headers["X-Forwarded-For"].split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+def enforce_rate_limit(key, tier, action, cost=1):
+    try:
+        rate_limiter.check(key, tier, action, cost)
+    except RateLimited as e:
+        metrics.RATE_LIMITED.labels(e.tier, e.action).inc()
+        raise HTTPException(status_code=429, detail=str(e), headers={
+            "Retry-After": str(max(1, round(e.retry_after))),
+            "X-RateLimit-Limit": repr(e.limit),
+        })
+
+@app.get("/ratelimit/stats")
+def rate_limit_stats():
+    """Configured limits, allowed and limited calls per tier and action"""
+    return rate_limiter.stats()
+
+@app.get("/pools/stats")
+def pool_stats():
+    """Roles served here and the load on each worker pool"""
+    return {
+        "roles": sorted(SERVICE_ROLES),
+        "pools": {pool.name: pool.stats() for pool in WORKER_POOLS},
+    }
+
+@app.post("/warmup")
+def warmup(components: Optional[str] = None):
+    """Load lazy components now (comma-separated names, default all)"""
+    names = components.split(",") if components else list(LAZY_COMPONENTS)
+    unknown = [name for name in names if name not in LAZY_COMPONENTS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown components: {', '.join(unknown)}")
+    for name in names:
+        LAZY_COMPONENTS[name].get()
+    return lazy_status()
+
+@app.get("/warmup")
+def lazy_status():
+    return {
+        name: {"loaded": component.loaded, "load_seconds": component.load_seconds}
+        for name, component in LAZY_COMPONENTS.items()
+    }
+
+@app.on_event("startup")
+def warm_up_in_background():
+    """WARMUP_ON_STARTUP=rembg,moviepy loads those without delaying the first request"""
+    names = [name for name in os.getenv("WARMUP_ON_STARTUP", "").split(",") if name in LAZY_COMPONENTS]
+    if names:
+        threading.Thread(target=lambda: [LAZY_COMPONENTS[name].get() for name in names],
+                         name="warmup", daemon=True).start()
+
+# Memory, then disk: render results, fitted templates and fonts
+cache = TieredCache(
+    max_memory_bytes=int(os.getenv("CACHE_MEMORY_MB", 256)) * 1024 * 1024,
+    disk_dir=os.getenv("CACHE_DIR", "cache"),
+    max_disk_bytes=int(os.getenv("CACHE_DISK_MB", 512)) * 1024 * 1024,
+)
+
+# Rendered overlay results, keyed by every input that affects the output
+result_cache = cache.namespace(
+    "overlay_results",
+    ttl_seconds=int(os.getenv("RESULT_CACHE_TTL_SECONDS", 6 * 60 * 60)),
+    serializer=JSON,
+    disk=True,
+)
+# Decoded templates already fitted to a frame size; memory only, as
+# re-encoding them for disk would cost about as much as a decode
+template_cache = cache.namespace(
+    "templates",
+    ttl_seconds=int(os.getenv("TEMPLATE_CACHE_TTL_SECONDS", 60 * 60)),
+    serializer=IMAGE,
+)
+# Background-removal results keyed by a hash of the uploaded file. The
+# value is the result's path, stored once under its digest (see
+# remove_background_and_store), so the PNG is only kept on disk there
+bg_removal_cache = cache.namespace(
+    "bg_removal",
+    ttl_seconds=int(os.getenv("BG_REMOVAL_CACHE_TTL_SECONDS", 7 * 24 * 60 * 60)),
+    serializer=JSON,
+    disk=True,
+)
+# Each user's overlay tier (personal/business) as last read from their doc,
+# so their rate limit can be charged before any Firestore read
+user_tiers = cache.namespace(
+    "user_tiers",
+    ttl_seconds=int(os.getenv("USER_TIER_CACHE_TTL_SECONDS", 10 * 60)),
+    serializer=JSON,
+)
+# Parsed fonts per (name, size); the font file is a fair guess at the memory used
+font_cache = cache.namespace(
+    "fonts",
+    sizeof=lambda font: os.path.getsize(font.path) if isinstance(getattr(font, 'path', None), str) else 64 * 1024,
+)
+
+# Number of /overlay_* requests currently being served
+inflight_overlay_requests = 0
+
+@app.middleware("http")
+async def track_overlay_load(request, call_next):
+    global inflight_overlay_requests
+    if not request.url.path.startswith("/overlay_"):
+        return await call_next(request)
+    inflight_overlay_requests += 1
+    try:
+        return await call_next(request)
+    finally:
+        inflight_overlay_requests -= 1
+
+@app.middleware("http")
+async def assign_request_id(request, call_next):
+    request_id = logging_setup.new_request_id(request.headers.get("X-Request-ID"))
+    token = logging_setup.request_id_var.set(request_id)
+    try:
+        response = await call_next(request)
+    finally:
+        logging_setup.request_id_var.reset(token)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
+@app.middleware("http")
+async def record_request_metrics(request, call_next):
+    if request.url.path == "/metrics":
+        return await call_next(request)
+    timings, token = metrics.begin_request(request.url.path)
+    failed = True
+    try:
+        response = await call_next(request)
+        failed = response.status_code >= 500
+    finally:
+        # Label by route template so IDs in the path don't explode cardinality
+        route = request.scope.get("route")
+        if route is not None:
+            timings.endpoint = route.path
+        total = metrics.finish_request(timings, token, failed)
+    response.headers["Server-Timing"] = timings.server_timing(total)
+    return response
+
+# Allow Swagger UI file upload. Added after every other middleware so it is
+# the outermost one, and admission-control 429s get CORS headers too
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -51,36 +439,89 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# SQLite DB Setup for background removal
-DATABASE_URL = "sqlite:///./db.sqlite3"
-engine = create_engine(DATABASE_URL)
-Base = declarative_base()
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
-class UploadLog(Base):
-    __tablename__ = "uploads"
-    id = Column(Integer, primary_key=True, index=True)
-    filename = Column(String, index=True)
-    result_filename = Column(String)
-    timestamp = Column(DateTime, default=datetime.utcnow)
+@app.get("/metrics")
+def prometheus_metrics():
+    body, content_type = metrics.latest()
+    return Response(content=body, media_type=content_type)
 
-Base.metadata.create_all(bind=engine)
+def is_idle():
+    return inflight_overlay_requests <= int(os.getenv("PRERENDER_IDLE_THRESHOLD", 0))
 
 class OverlayRequest(BaseModel):
     user_id: str
     admin_post_id: str
 
-def download_image(url):
+# Concurrent identical downloads and renders share one in-flight call
+template_downloads = SingleFlight("template_downloads")
+profile_downloads = SingleFlight("profile_downloads")
+overlay_renders = SingleFlight("overlay_renders")
+for flight in (template_downloads, profile_downloads, overlay_renders):
+    metrics.COALESCED.labels(flight.name).set_function(lambda flight=flight: flight.coalesced)
+for name in ("emitted", "dropped", "sampled_out", "emit_seconds"):
+    metrics.LOGGING.labels(name).set_function(lambda name=name: logging_setup.stats().get(name, 0))
+
+# Local copy of templates and profile photos, shared by
+# every worker on this disk and kept across restarts
+media_store = MediaStore(
+    os.getenv("MEDIA_STORE_DIR", "media_store"),
+    max_bytes=int(os.getenv("MEDIA_STORE_MAX_MB", 2048)) * 1024 * 1024,
+)
+# URLs can be overwritten in place (profile photos), so they are re-fetched after this
+MEDIA_URL_TTL = int(os.getenv("MEDIA_STORE_URL_TTL_SECONDS", 24 * 60 * 60))
+
+def fetch_bytes(url):
+    response = requests.get(url)
+    response.raise_for_status()
+    return response.content
+
+def fetch_to_store(url):
+    """Download a URL into the media store; returns the object digest"""
+    return media_store.put(fetch_bytes(url), name=f"url:{url}")
+
+def fetch_media(url, flight=template_downloads):
+    """Digest of the URL's content in the media store, downloading it on a miss"""
+    digest = media_store.lookup(f"url:{url}", max_age=MEDIA_URL_TTL)
+    if digest is None or not os.path.exists(media_store.object_path(digest)):
+        # Only the digest is shared; each caller maps and decodes its own copy
+        digest = flight.do(url, fetch_to_store, url)
+    return digest
+
+def open_media(url, flight=template_downloads):
+    """(digest, verified read-only mmap) of the URL's content"""
+    digest = fetch_media(url, flight)
+    mapped = media_store.open(digest)
+    if mapped is None:
+        # Evicted or corrupt between the download and the open
+        digest = fetch_to_store(url)
+        mapped = media_store.open(digest)
+    return digest, mapped
+
+def download_image(url, flight=template_downloads):
     """Download image from URL"""
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        return Image.open(BytesIO(response.content))
+        # Decoded straight from the mapped file
+        _, mapped = open_media(url, flight)
+        return Image.open(mapped)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Failed to download image: {str(e)}")
 
+# 'pillow' draws elements one by one; 'numpy' blends them in a single pass
+OVERLAY_COMPOSITOR = os.getenv("OVERLAY_COMPOSITOR", "pillow").lower()
+compositor = Compositor()
+
+# Canvases and PNG encode buffers are reused between renders of the same frame size
+buffer_pool = BufferPool(
+    max_bytes=int(os.getenv("RENDER_POOL_MAX_MB", 256)) * 1024 * 1024,
+    max_per_key=int(os.getenv("RENDER_POOL_MAX_PER_SIZE", 8)),
+)
+for name in ("hits", "misses", "dropped", "pooled_bytes"):
+    metrics.BUFFER_POOL.labels(name).set_function(lambda name=name: getattr(buffer_pool, name))
+
 def get_font(font_name, font_size):
     """Get font object, fallback to default if not found"""
+    return font_cache.get(f"{font_name}:{font_size}", lambda key: load_font(font_name, font_size))
+
+def load_font(font_name, font_size):
     try:
         # Try to use the specified font
         if font_name.lower() == 'arial':
@@ -119,290 +560,289 @@ def get_font(font_name, font_size):
         # If even default fails, create a minimal font
         return ImageFont.load_default()
 
-def create_overlay_image(admin_post, user_data):
-    """Create overlay image by merging user data with admin post template"""
-    try:
-        # Get frame dimensions with fallback
-        frame_size = admin_post.get('frameSize', {'width': 1080, 'height': 1920})
-        frame_width = frame_size.get('width', 1080)
-        frame_height = frame_size.get('height', 1920)
-        
-        # Download the main image
-        main_image = download_image(admin_post['mainImage'])
-        
-        # Convert to RGB if necessary
+def fit_template(url, frame_width, frame_height):
+    """Download a template and resize it to fit inside the frame (aspect ratio kept)"""
+    # Download the main image
+    with stage('template_download'):
+        main_image = download_image(url)
+
+    # Decode and convert to RGB if necessary
+    with stage('decode'):
+        main_image.load()
         if main_image.mode != 'RGB':
             main_image = main_image.convert('RGB')
-        
-        # Create a new image with the exact frame size
-        overlay_image = Image.new('RGB', (frame_width, frame_height), color='white')
-        
-        # Resize and fit the main image to contain within the frame (maintaining aspect ratio)
-        # Calculate the scaling factor to fit the image within the frame
-        img_width, img_height = main_image.size
-        scale_x = frame_width / img_width
-        scale_y = frame_height / img_height
-        scale = min(scale_x, scale_y)  # Use the smaller scale to ensure image fits
-        
-        # Calculate new dimensions
-        new_width = int(img_width * scale)
-        new_height = int(img_height * scale)
-        
-        # Resize the main image to fit within the frame
-        # main_image_resized = main_image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-
-        # main_image_resized = main_image.resize((frame_width, frame_height), Image.Resampling.LANCZOS)
-        # overlay_image.paste(main_image_resized, (0, 0))
-
-        
-        # # Calculate position to center the image
-        # x_offset = (frame_width - new_width) // 2
-        # y_offset = (frame_height - new_height) // 2
-        
-        # # Paste the resized main image centered in the frame
-        # overlay_image.paste(main_image_resized, (x_offset, y_offset))
 
+    with stage('resize'):
         # Resize main image proportionally to fit inside frame
         img_width, img_height = main_image.size
         scale = min(frame_width / img_width, frame_height / img_height)
         new_width = int(img_width * scale)
         new_height = int(img_height * scale)
 
-        # Resize main image maintaining aspect ratio
-        main_image_resized = main_image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-
-        # Center the image in the frame
-        x_offset = (frame_width - new_width) // 2
-        y_offset = (frame_height - new_height) // 2
+        # Frame-fit derivatives already have the right size
+        if main_image.size == (new_width, new_height):
+            return main_image
+        return main_image.resize((new_width, new_height), Image.Resampling.LANCZOS)
 
-        overlay_image.paste(main_image_resized, (x_offset, y_offset))
+def create_overlay_image(admin_post, user_data, include_template=True):
+    """Create overlay image by merging user data with admin post template
 
+    With include_template=False only the user overlay is drawn, on a
+    transparent canvas (used for video templates). The canvas comes from
+    buffer_pool; hand it back with buffer_pool.release() once encoded.
+    """
+    overlay_image = None
+    try:
+        # Get frame dimensions with fallback
+        frame_size = admin_post.get('frameSize', {'width': 1080, 'height': 1920})
+        frame_width = frame_size.get('width', 1080)
+        frame_height = frame_size.get('height', 1920)
         
-        # Create drawing context for overlays
-        draw = ImageDraw.Draw(overlay_image)
+        if include_template:
+            # Template fitted to the frame, from the cache or downloaded,
+            # decoded and resized on a miss
+            template_url = pick_template_url(admin_post, frame_width, frame_height)
+            main_image_resized = template_cache.get(
+                f"{template_url}|{frame_width}x{frame_height}",
+                lambda key: fit_template(template_url, frame_width, frame_height),
+            )
         
-        # Add profile picture if enabled and user has one
-        if admin_post.get('profileSettings', {}).get('enabled', False) and user_data.get('profilePhotoUrl'):
-            try:
-                profile_img = download_image(user_data['profilePhotoUrl'])
-                
-                # Keep original image as-is, no conversion
-                if profile_img.mode not in ['RGBA']:
-                    profile_img = profile_img.convert('RGBA')
+            # Create a new image with the exact frame size
+            overlay_image = buffer_pool.canvas('RGB', (frame_width, frame_height), 'white')
+
+            # Center the image in the frame
+            x_offset = (frame_width - main_image_resized.width) // 2
+            y_offset = (frame_height - main_image_resized.height) // 2
+
+            overlay_image.paste(main_image_resized, (x_offset, y_offset))
+        else:
+            # Transparent layer to composite over a video template
+            overlay_image = buffer_pool.canvas('RGBA', (frame_width, frame_height), (0, 0, 0, 0))
+
+        # Create drawing context for overlays (draw is only used to measure text)
+        canvas = make_canvas(overlay_image, OVERLAY_COMPOSITOR, compositor)
+        draw = canvas.draw
+        
+        with stage('profile'):
+            # Add profile picture if enabled and user has one
+            if admin_post.get('profileSettings', {}).get('enabled', False) and user_data.get('profilePhotoUrl'):
+                try:
+                    profile_img = download_image(user_data['profilePhotoUrl'], flight=profile_downloads)
                 
-                # Calculate profile picture position and size based on frame dimensions
-                original_size = int(admin_post['profileSettings']['size'])
-                profile_size = int(original_size * 2)  # 2x larger
+                    # Keep original image as-is, no conversion
+                    if profile_img.mode not in ['RGBA']:
+                        profile_img = profile_img.convert('RGBA')
                 
-                # Convert percentage positions to pixel positions (like Flutter app)
-                profile_x_percent = admin_post['profileSettings']['x'] / 100
-                profile_y_percent = admin_post['profileSettings']['y'] / 100
+                    # Calculate profile picture position and size based on frame dimensions
+                    original_size = int(admin_post['profileSettings']['size'])
+                    profile_size = int(original_size * 2)  # 2x larger
                 
-                # Calculate center position (Flutter app uses center-based positioning)
-                profile_x = int(profile_x_percent * frame_width - profile_size / 2)
-                profile_y = int(profile_y_percent * frame_height - profile_size / 2)
+                    # Convert percentage positions to pixel positions (like Flutter app)
+                    profile_x_percent = admin_post['profileSettings']['x'] / 100
+                    profile_y_percent = admin_post['profileSettings']['y'] / 100
                 
-                # Resize profile image to cover the frame (center crop)
-                img_w, img_h = profile_img.size
-                aspect_img = img_w / img_h
-                aspect_frame = profile_size / profile_size  # always 1
+                    # Calculate center position (Flutter app uses center-based positioning)
+                    profile_x = int(profile_x_percent * frame_width - profile_size / 2)
+                    profile_y = int(profile_y_percent * frame_height - profile_size / 2)
                 
-                # Determine scale and crop box
-                if aspect_img > aspect_frame:
-                    # Image is wider than frame: crop width
-                    new_height = profile_size
-                    new_width = int(profile_size * aspect_img)
-                else:
-                    # Image is taller than frame: crop height
-                    new_width = profile_size
-                    new_height = int(profile_size / aspect_img)
+                    # Resize profile image to cover the frame (center crop)
+                    img_w, img_h = profile_img.size
+                    aspect_img = img_w / img_h
+                    aspect_frame = profile_size / profile_size  # always 1
                 
-                # Resize first
-                profile_img = profile_img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+                    # Determine scale and crop box
+                    if aspect_img > aspect_frame:
+                        # Image is wider than frame: crop width
+                        new_height = profile_size
+                        new_width = int(profile_size * aspect_img)
+                    else:
+                        # Image is taller than frame: crop height
+                        new_width = profile_size
+                        new_height = int(profile_size / aspect_img)
                 
-                # Center crop
-                left = (new_width - profile_size) // 2
-                top = (new_height - profile_size) // 2
-                right = left + profile_size
-                bottom = top + profile_size
-                profile_img = profile_img.crop((left, top, right, bottom))
+                    # Resize first
+                    profile_img = profile_img.resize((new_width, new_height), Image.Resampling.LANCZOS)
                 
-                # Create circular mask if shape is circle
-                if admin_post['profileSettings']['shape'] == 'circle':
-                    mask = Image.new('L', (profile_size, profile_size), 0)
-                    mask_draw = ImageDraw.Draw(mask)
-                    mask_draw.ellipse([0, 0, profile_size, profile_size], fill=255)
-                    output = Image.new('RGBA', (profile_size, profile_size), (0, 0, 0, 0))
-                    output.paste(profile_img, (0, 0), mask)
-                    profile_img = output
+                    # Center crop
+                    left = (new_width - profile_size) // 2
+                    top = (new_height - profile_size) // 2
+                    right = left + profile_size
+                    bottom = top + profile_size
+                    profile_img = profile_img.crop((left, top, right, bottom))
                 
-                # Paste profile image directly - completely raw, no background
-                overlay_image.paste(profile_img, (profile_x, profile_y), profile_img)
+                    # Paste profile image directly - completely raw, no background,
+                    # through a circular mask if shape is circle
+                    circle = admin_post['profileSettings']['shape'] == 'circle'
+                    canvas.paste_profile(profile_img, (profile_x, profile_y), circle)
                     
-            except Exception as e:
-                print(f"Error adding profile picture: {e}")
+                except Exception as e:
+                    logger.warning("Error adding profile picture", extra={"error": str(e)})
         
-        # Add name text
-        if admin_post.get('textSettings') and user_data.get('name'):
-            text_settings = admin_post['textSettings']
-            original_font_size = text_settings.get('fontSize', 24)
-            font_size = int(original_font_size * 2)  # 1.5x larger
-            font = get_font(text_settings.get('font', 'Arial'), font_size)
-            
-            # Calculate text position based on frame dimensions (like Flutter app)
-            text_x_percent = text_settings['x'] / 100
-            text_y_percent = text_settings['y'] / 100
-            
-            # Convert to pixel positions - SCALE DOWN TO 1/4 SIZE
-            text_x = int(text_x_percent * frame_width / 4)
-            text_y = int(text_y_percent * frame_height / 4)
-            
-            # Get text dimensions for background
-            text_bbox = draw.textbbox((0, 0), user_data['name'], font=font)
-            text_width = text_bbox[2] - text_bbox[0]
-            text_height = text_bbox[3] - text_bbox[1]
-            
-            # Apply Flutter-style positioning (center-based with offset)
-            # Flutter uses: Transform.translate(offset: Offset(-0.5 * fontSize * (text.length / 2), -20))
-            text_offset_x = int(-0.5 * font_size * (len(user_data['name']) / 2))
-            text_offset_y = -20
-            
-            final_text_x = text_x + text_offset_x
-            final_text_y = text_y + text_offset_y
-            
-            # Add background if enabled
-            if text_settings.get('hasBackground', False):
-                bg_color = text_settings.get('backgroundColor', '#000000')
-                padding = 8
-                draw.rectangle([
-                    final_text_x - padding, final_text_y - padding,
-                    final_text_x + text_width + padding, final_text_y + text_height + padding
-                ], fill=bg_color)
-            
-            # Add text
-            text_color = text_settings.get('color', '#ffffff')
-            draw.text((final_text_x, final_text_y), user_data['name'], fill=text_color, font=font)
+        with stage('text'):
+            # Add name text
+            if admin_post.get('textSettings') and user_data.get('name'):
+                text_settings = admin_post['textSettings']
+                original_font_size = text_settings.get('fontSize', 24)
+                font_size = int(original_font_size * 2)  # 1.5x larger
+                font = get_font(text_settings.get('font', 'Arial'), font_size)
+            
+                # Calculate text position based on frame dimensions (like Flutter app)
+                text_x_percent = text_settings['x'] / 100
+                text_y_percent = text_settings['y'] / 100
+            
+                # Convert to pixel positions - SCALE DOWN TO 1/4 SIZE
+                text_x = int(text_x_percent * frame_width / 4)
+                text_y = int(text_y_percent * frame_height / 4)
+            
+                # Get text dimensions for background
+                text_bbox = draw.textbbox((0, 0), user_data['name'], font=font)
+                text_width = text_bbox[2] - text_bbox[0]
+                text_height = text_bbox[3] - text_bbox[1]
+            
+                # Apply Flutter-style positioning (center-based with offset)
+                # Flutter uses: Transform.translate(offset: Offset(-0.5 * fontSize * (text.length / 2), -20))
+                text_offset_x = int(-0.5 * font_size * (len(user_data['name']) / 2))
+                text_offset_y = -20
+            
+                final_text_x = text_x + text_offset_x
+                final_text_y = text_y + text_offset_y
+            
+                # Add background if enabled
+                if text_settings.get('hasBackground', False):
+                    bg_color = text_settings.get('backgroundColor', '#000000')
+                    padding = 8
+                    canvas.rectangle([
+                        final_text_x - padding, final_text_y - padding,
+                        final_text_x + text_width + padding, final_text_y + text_height + padding
+                    ], bg_color)
+            
+                # Add text
+                text_color = text_settings.get('color', '#ffffff')
+                canvas.text((final_text_x, final_text_y), user_data['name'], text_color, font)
         
-        # Add phone number for business users
-        if (user_data.get('usageType') == 'Business' and 
-            admin_post.get('phoneSettings', {}).get('enabled', False) and 
-            user_data.get('phoneNumber')):
-            
-            phone_settings = admin_post['phoneSettings']
-            original_font_size = phone_settings.get('fontSize', 24)
-            font_size = int(original_font_size * 2)  # 1.5x larger
-            font = get_font(phone_settings.get('font', 'Arial'), font_size)
-            
-            # Calculate phone text position (like Flutter app)
-            phone_x_percent = phone_settings['x'] / 100
-            phone_y_percent = phone_settings['y'] / 100
-            
-            # Convert to pixel positions - SCALE DOWN TO 1/4 SIZE
-            phone_x = int(phone_x_percent * frame_width / 4)
-            phone_y = int(phone_y_percent * frame_height / 4)
-            
-            # Get phone text dimensions
-            phone_bbox = draw.textbbox((0, 0), user_data['phoneNumber'], font=font)
-            phone_width = phone_bbox[2] - phone_bbox[0]
-            phone_height = phone_bbox[3] - phone_bbox[1]
-            
-            # Apply Flutter-style positioning (center-based with offset)
-            phone_offset_x = int(-0.5 * font_size * (len(user_data['phoneNumber']) / 2))
-            phone_offset_y = -20
-            
-            final_phone_x = phone_x + phone_offset_x
-            final_phone_y = phone_y + phone_offset_y
-            
-            # Add background if enabled
-            if phone_settings.get('hasBackground', False):
-                bg_color = phone_settings.get('backgroundColor', '#000000')
-                padding = 8
-                draw.rectangle([
-                    final_phone_x - padding, final_phone_y - padding,
-                    final_phone_x + phone_width + padding, final_phone_y + phone_height + padding
-                ], fill=bg_color)
-            
-            # Add phone text
-            phone_color = phone_settings.get('color', '#ffffff')
-            draw.text((final_phone_x, final_phone_y), user_data['phoneNumber'], fill=phone_color, font=font)
+            # Add phone number for business users
+            if (user_data.get('usageType') == 'Business' and 
+                admin_post.get('phoneSettings', {}).get('enabled', False) and 
+                user_data.get('phoneNumber')):
+            
+                phone_settings = admin_post['phoneSettings']
+                original_font_size = phone_settings.get('fontSize', 24)
+                font_size = int(original_font_size * 2)  # 1.5x larger
+                font = get_font(phone_settings.get('font', 'Arial'), font_size)
+            
+                # Calculate phone text position (like Flutter app)
+                phone_x_percent = phone_settings['x'] / 100
+                phone_y_percent = phone_settings['y'] / 100
+            
+                # Convert to pixel positions - SCALE DOWN TO 1/4 SIZE
+                phone_x = int(phone_x_percent * frame_width / 4)
+                phone_y = int(phone_y_percent * frame_height / 4)
+            
+                # Get phone text dimensions
+                phone_bbox = draw.textbbox((0, 0), user_data['phoneNumber'], font=font)
+                phone_width = phone_bbox[2] - phone_bbox[0]
+                phone_height = phone_bbox[3] - phone_bbox[1]
+            
+                # Apply Flutter-style positioning (center-based with offset)
+                phone_offset_x = int(-0.5 * font_size * (len(user_data['phoneNumber']) / 2))
+                phone_offset_y = -20
+            
+                final_phone_x = phone_x + phone_offset_x
+                final_phone_y = phone_y + phone_offset_y
+            
+                # Add background if enabled
+                if phone_settings.get('hasBackground', False):
+                    bg_color = phone_settings.get('backgroundColor', '#000000')
+                    padding = 8
+                    canvas.rectangle([
+                        final_phone_x - padding, final_phone_y - padding,
+                        final_phone_x + phone_width + padding, final_phone_y + phone_height + padding
+                    ], bg_color)
+            
+                # Add phone text
+                phone_color = phone_settings.get('color', '#ffffff')
+                canvas.text((final_phone_x, final_phone_y), user_data['phoneNumber'], phone_color, font)
         
-        # Add address for business users
-        if (user_data.get('usageType') == 'Business' and 
-            admin_post.get('addressSettings', {}).get('enabled', False) and 
-            user_data.get('address')):
-            
-            address_settings = admin_post['addressSettings']
-            original_font_size = address_settings.get('fontSize', 24)
-            font_size = int(original_font_size * 2)  # 1.5x larger
-            font = get_font(address_settings.get('font', 'Arial'), font_size)
-            
-            # Calculate address text position (like Flutter app)
-            address_x_percent = address_settings['x'] / 100
-            address_y_percent = address_settings['y'] / 100
-            
-            # Convert to pixel positions
-            address_x = int(address_x_percent * frame_width)
-            address_y = int(address_y_percent * frame_height)
-            
-            # Handle long addresses by wrapping text
-            address_text = user_data['address']
-            max_width = frame_width - address_x - 20  # Leave some margin
-            
-            # Simple text wrapping
-            words = address_text.split()
-            lines = []
-            current_line = []
-            
-            for word in words:
-                test_line = ' '.join(current_line + [word])
-                test_bbox = draw.textbbox((0, 0), test_line, font=font)
-                test_width = test_bbox[2] - test_bbox[0]
+            # Add address for business users
+            if (user_data.get('usageType') == 'Business' and 
+                admin_post.get('addressSettings', {}).get('enabled', False) and 
+                user_data.get('address')):
+            
+                address_settings = admin_post['addressSettings']
+                original_font_size = address_settings.get('fontSize', 24)
+                font_size = int(original_font_size * 2)  # 1.5x larger
+                font = get_font(address_settings.get('font', 'Arial'), font_size)
+            
+                # Calculate address text position (like Flutter app)
+                address_x_percent = address_settings['x'] / 100
+                address_y_percent = address_settings['y'] / 100
+            
+                # Convert to pixel positions
+                address_x = int(address_x_percent * frame_width)
+                address_y = int(address_y_percent * frame_height)
+            
+                # Handle long addresses by wrapping text
+                address_text = user_data['address']
+                max_width = frame_width - address_x - 20  # Leave some margin
+            
+                # Simple text wrapping
+                words = address_text.split()
+                lines = []
+                current_line = []
+            
+                for word in words:
+                    test_line = ' '.join(current_line + [word])
+                    test_bbox = draw.textbbox((0, 0), test_line, font=font)
+                    test_width = test_bbox[2] - test_bbox[0]
                 
-                if test_width <= max_width:
-                    current_line.append(word)
-                else:
-                    if current_line:
-                        lines.append(' '.join(current_line))
-                        current_line = [word]
+                    if test_width <= max_width:
+                        current_line.append(word)
                     else:
-                        lines.append(word)
+                        if current_line:
+                            lines.append(' '.join(current_line))
+                            current_line = [word]
+                        else:
+                            lines.append(word)
             
-            if current_line:
-                lines.append(' '.join(current_line))
+                if current_line:
+                    lines.append(' '.join(current_line))
             
-            # Apply Flutter-style positioning (center-based with offset)
-            address_offset_x = int(-0.5 * font_size * (len(lines[0]) / 2)) if lines else 0
-            address_offset_y = -20
+                # Apply Flutter-style positioning (center-based with offset)
+                address_offset_x = int(-0.5 * font_size * (len(lines[0]) / 2)) if lines else 0
+                address_offset_y = -20
             
-            final_address_x = address_x + address_offset_x
-            final_address_y = address_y + address_offset_y
+                final_address_x = address_x + address_offset_x
+                final_address_y = address_y + address_offset_y
             
-            # Draw each line
-            line_height = font_size + 5
-            for i, line in enumerate(lines):
-                line_y = final_address_y + (i * line_height)
+                # Draw each line
+                line_height = font_size + 5
+                for i, line in enumerate(lines):
+                    line_y = final_address_y + (i * line_height)
                 
-                # Get line dimensions for background
-                line_bbox = draw.textbbox((0, 0), line, font=font)
-                line_width = line_bbox[2] - line_bbox[0]
-                line_text_height = line_bbox[3] - line_bbox[1]
+                    # Get line dimensions for background
+                    line_bbox = draw.textbbox((0, 0), line, font=font)
+                    line_width = line_bbox[2] - line_bbox[0]
+                    line_text_height = line_bbox[3] - line_bbox[1]
                 
-                # Add background if enabled
-                if address_settings.get('hasBackground', False):
-                    bg_color = address_settings.get('backgroundColor', '#000000')
-                    padding = 8
-                    draw.rectangle([
-                        final_address_x - padding, line_y - padding,
-                        final_address_x + line_width + padding, line_y + line_text_height + padding
-                    ], fill=bg_color)
+                    # Add background if enabled
+                    if address_settings.get('hasBackground', False):
+                        bg_color = address_settings.get('backgroundColor', '#000000')
+                        padding = 8
+                        canvas.rectangle([
+                            final_address_x - padding, line_y - padding,
+                            final_address_x + line_width + padding, line_y + line_text_height + padding
+                        ], bg_color)
                 
-                # Add address text
-                address_color = address_settings.get('color', '#ffffff')
-                draw.text((final_address_x, line_y), line, fill=address_color, font=font)
+                    # Add address text
+                    address_color = address_settings.get('color', '#ffffff')
+                    canvas.text((final_address_x, line_y), line, address_color, font)
         
-        return overlay_image
+        with stage('composite'):
+            return canvas.finish()
         
     except Exception as e:
+        if overlay_image is not None:
+            buffer_pool.release(overlay_image)
         raise HTTPException(status_code=500, detail=f"Error creating overlay: {str(e)}")
 
 def upload_to_firebase(image, user_id, admin_post_id, is_video=False, video_path=None):
@@ -413,39 +853,40 @@ def upload_to_firebase(image, user_id, admin_post_id, is_video=False, video_path
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             filename = f"overlay_posts/{user_id}_{admin_post_id}_{timestamp}_{uuid.uuid4().hex[:8]}.mp4"
             
-            # Debug information
-            print(f"Bucket name: {bucket.name}")
-            print(f"Uploading video file: {filename}")
+            logger.debug("Uploading video file", extra={"bucket": bucket.name, "blob": filename})
             
             # Upload video to Firebase Storage
-            blob = bucket.blob(filename)
-            blob.upload_from_filename(video_path, content_type='video/mp4')
-            
-            # Generate download URL
-            blob.make_public()
+            with stage('upload'):
+                blob = bucket.blob(filename)
+                blob.upload_from_filename(video_path, content_type='video/mp4')
+                
+                # Generate download URL
+                blob.make_public()
             download_url = f"https://firebasestorage.googleapis.com/v0/b/{bucket.name}/o/{filename.replace('/', '%2F')}?alt=media"
             
             return download_url
         else:
             # Upload image (existing logic)
-            img_byte_arr = BytesIO()
-            image.save(img_byte_arr, format='PNG')
-            img_byte_arr.seek(0)
+            with buffer_pool.encode_buffer() as img_byte_arr:
+                with stage('encode'):
+                    image.save(img_byte_arr, format='PNG')
+                    # Drop leftovers from a larger previous image
+                    img_byte_arr.truncate()
+                    img_byte_arr.seek(0)
             
-            # Generate unique filename
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"overlay_posts/{user_id}_{admin_post_id}_{timestamp}_{uuid.uuid4().hex[:8]}.png"
-            
-            # Debug information
-            print(f"Bucket name: {bucket.name}")
-            print(f"Uploading file: {filename}")
+                # Generate unique filename
+                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                filename = f"overlay_posts/{user_id}_{admin_post_id}_{timestamp}_{uuid.uuid4().hex[:8]}.png"
             
-            # Upload to Firebase Storage
-            blob = bucket.blob(filename)
-            blob.upload_from_file(img_byte_arr, content_type='image/png')
+                logger.debug("Uploading file", extra={"bucket": bucket.name, "blob": filename})
             
-            # Generate download URL with token (similar to your existing URLs)
-            blob.make_public()
+                # Upload to Firebase Storage
+                with stage('upload'):
+                    blob = bucket.blob(filename)
+                    blob.upload_from_file(img_byte_arr, content_type='image/png')
+                
+                    # Generate download URL with token (similar to your existing URLs)
+                    blob.make_public()
             
             # Get a signed URL that matches your existing pattern
             download_url = f"https://firebasestorage.googleapis.com/v0/b/{bucket.name}/o/{filename.replace('/', '%2F')}?alt=media"
@@ -453,7 +894,7 @@ def upload_to_firebase(image, user_id, admin_post_id, is_video=False, video_path
             return download_url
         
     except Exception as e:
-        print(f"Detailed error: {str(e)}")
+        logger.error("Upload to Firebase Storage failed", extra={"error": str(e)})
         raise HTTPException(status_code=500, detail=f"Error uploading file: {str(e)}")
 
 def create_video_overlay(admin_post, user_data):
@@ -464,42 +905,39 @@ def create_video_overlay(admin_post, user_data):
         frame_width = frame_size.get('width', 1080)
         frame_height = frame_size.get('height', 1920)
         
-        # Download the main video
+        # Download the main video into the media store and read it from there
         video_url = admin_post['mainImage']
-        response = requests.get(video_url)
-        response.raise_for_status()
-        
-        # Save video to temporary file
-        with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as temp_video:
-            temp_video.write(response.content)
-            temp_video_path = temp_video.name
+        with stage('template_download'):
+            digest, mapped = open_media(video_url)
+            mapped.close()
+        video_path = media_store.object_path(digest)
         
         # Load video
-        video_clip = VideoFileClip(temp_video_path)
+        video_clip = video_editor.VideoFileClip(video_path)
         
-        # Create overlay image (same as image overlay)
-        overlay_image = create_overlay_image(admin_post, user_data)
+        # Create overlay layer (same as image overlay, minus the video template)
+        overlay_image = create_overlay_image(admin_post, user_data, include_template=False)
         
         # Save overlay to temporary file
         with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as temp_overlay:
             overlay_image.save(temp_overlay.name, format='PNG')
             overlay_path = temp_overlay.name
+        buffer_pool.release(overlay_image)
         
         # Create image clip from overlay
-        overlay_clip = ImageClip(overlay_path).set_duration(video_clip.duration)
+        overlay_clip = video_editor.ImageClip(overlay_path).set_duration(video_clip.duration)
         
         # Composite video with overlay
-        final_video = CompositeVideoClip([video_clip, overlay_clip])
+        final_video = video_editor.CompositeVideoClip([video_clip, overlay_clip])
         
         # Save final video to temporary file
-        with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as temp_final:
+        with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as temp_final, stage('encode'):
             final_video.write_videofile(temp_final.name, codec='libx264', audio_codec='aac', verbose=False, logger=None)
             final_video_path = temp_final.name
         
         # Clean up temporary files
         video_clip.close()
         final_video.close()
-        os.unlink(temp_video_path)
         os.unlink(overlay_path)
         
         return final_video_path
@@ -507,7 +945,7 @@ def create_video_overlay(admin_post, user_data):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating video overlay: {str(e)}")
 
-@app.get("/admin_posts/{post_id}")
+@api_router.get("/admin_posts/{post_id}")
 def get_admin_post(post_id: str):
     doc_ref = db.collection("admin_posts").document(post_id)
     doc = doc_ref.get()
@@ -516,7 +954,7 @@ def get_admin_post(post_id: str):
     else:
         raise HTTPException(status_code=404, detail="Admin post not found")
 
-@app.get("/users/{user_id}")
+@api_router.get("/users/{user_id}")
 def get_user(user_id: str):
     doc_ref = db.collection("users").document(user_id)
     doc = doc_ref.get()
@@ -525,59 +963,287 @@ def get_user(user_id: str):
     else:
         raise HTTPException(status_code=404, detail="User not found")
 
-@app.post("/overlay_personal")
-def create_personal_overlay(request: OverlayRequest):
-    """Create personal overlay with only name and profile picture"""
+# Published posts per category/language, served from memory
+feed_index = FeedIndex(db)
+FEED_READY_TIMEOUT = float(os.getenv("FEED_READY_TIMEOUT", 5))
+FEED_MAX_LIMIT = 100
+
+@app.on_event("startup")
+def start_feed_index():
+    if "api" in SERVICE_ROLES and os.getenv("FEED_INDEX_ENABLED", "true").lower() == "true":
+        # Connecting to Firestore shouldn't hold up startup; /feed waits for readiness
+        threading.Thread(target=feed_index.start, name="feed-index-start", daemon=True).start()
+
+@app.on_event("shutdown")
+def stop_feed_index():
+    feed_index.stop()
+
+@api_router.get("/feed")
+def get_feed(request: Request, category: Optional[str] = None, language: Optional[str] = None,
+             cursor: Optional[str] = None, limit: int = 20, width: Optional[int] = None):
+    """Published admin posts, newest first, one cursor page at a time
+
+    With ``width`` (the client's display width in pixels) each post gets an
+    ``imageUrl``: the smallest derivative at least that wide.
+    """
+    if not feed_index.wait_ready(FEED_READY_TIMEOUT):
+        return JSONResponse({"detail": "Feed is loading"}, status_code=503, headers={"Retry-After": "2"})
     try:
-        # Get user data
-        user_doc = db.collection("users").document(request.user_id).get()
-        if not user_doc.exists:
-            raise HTTPException(status_code=404, detail="User not found")
-        
-        user_data = user_doc.to_dict()
-        
+        posts, next_cursor, etag = feed_index.page(category, language, cursor, max(1, min(limit, FEED_MAX_LIMIT)))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if width is not None:
+        posts = [dict(post, imageUrl=pick_display_url(post, width)) for post in posts]
+        etag = f'{etag[:-1]}-w{width}"'
+
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag in request.headers.get("If-None-Match", ""):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse({"posts": posts, "next_cursor": next_cursor}, headers=headers)
+
+@app.get("/feed/stats")
+def feed_stats():
+    return feed_index.stats()
+
+# Thumbnail, feed and frame-fit versions of post images, made once per publish
+derivative_generator = DerivativeGenerator(db, bucket, fetch_bytes)
+
+@app.on_event("startup")
+def start_derivative_generator():
+    if "image" in SERVICE_ROLES and os.getenv("DERIVATIVES_ENABLED", "false").lower() == "true":
+        derivative_generator.start()
+
+@app.on_event("shutdown")
+def stop_derivative_generator():
+    derivative_generator.stop()
+
+@render_router.post("/derivatives/{admin_post_id}")
+def generate_derivatives(admin_post_id: str):
+    """Generate missing or stale derivatives for an admin post right away"""
+    try:
+        generated = derivative_generator.generate(admin_post_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to generate derivatives: {str(e)}")
+    return {"success": True, "generated": generated}
+
+@app.get("/derivatives/stats")
+def derivative_stats():
+    return derivative_generator.stats()
+
+def render_overlay(overlay_type, user_id, admin_post_id, admin_post, user_data):
+    """Render and upload an overlay, reusing a cached result when inputs are unchanged
+
+    Returns a (download_url, cache_hit) tuple.
+    """
+    render_data = overlay_user_data(overlay_type, user_data)
+    cache_key = overlay_cache_key(overlay_type, user_id, admin_post_id, admin_post, render_data)
+    metrics.set_media_type('video' if is_video_post(admin_post) else 'image')
+    download_url = result_cache.get(cache_key)
+    metrics.record_cache('result', download_url is not None)
+    if download_url is not None:
+        return download_url, True
+
+    # Double taps and notification bursts for the same inputs wait on one render
+    download_url = overlay_renders.do(
+        cache_key, _render_and_upload, cache_key, user_id, admin_post_id, admin_post, render_data
+    )
+    return download_url, False
+
+def _render_and_upload(cache_key, user_id, admin_post_id, admin_post, render_data):
+    if is_video_post(admin_post):
+        # Create video overlay
+        video_path = create_video_overlay(admin_post, render_data)
+
+        # Upload video to Firebase and get download URL
+        download_url = upload_to_firebase(None, user_id, admin_post_id, is_video=True, video_path=video_path)
+
+        # Clean up temporary video file
+        os.unlink(video_path)
+    else:
+        # Create image overlay
+        overlay_image = create_overlay_image(admin_post, render_data)
+
+        # Upload to Firebase and get download URL
+        try:
+            download_url = upload_to_firebase(overlay_image, user_id, admin_post_id)
+        finally:
+            buffer_pool.release(overlay_image)
+
+    result_cache.set(cache_key, download_url)
+    return download_url
+
+def prerender_overlay(overlay_type, user_id, admin_post_id, admin_post, user_data):
+    token = logging_setup.request_id_var.set(f"prerender-{logging_setup.new_request_id()}")
+    try:
+        with metrics.track_request("prerender"):
+            # Same pool and limits as requested renders; PoolBusy skips this user
+            pool = video_pool if is_video_post(admin_post) else image_pool
+            return pool.submit(
+                render_overlay, overlay_type, user_id, admin_post_id, admin_post, user_data
+            ).result()
+    finally:
+        logging_setup.request_id_var.reset(token)
+
+prerender_scheduler = PrerenderScheduler(
+    db,
+    prerender_overlay,
+    result_cache,
+    is_idle,
+    max_per_second=float(os.getenv("PRERENDER_MAX_PER_SECOND", 2)),
+    max_users_per_post=int(os.getenv("PRERENDER_MAX_USERS_PER_POST", 1000)),
+    active_days=int(os.getenv("PRERENDER_ACTIVE_DAYS", 7)),
+    include_videos=os.getenv("PRERENDER_VIDEOS", "false").lower() == "true",
+)
+
+@app.on_event("startup")
+def start_prerender_scheduler():
+    if "image" in SERVICE_ROLES and os.getenv("PRERENDER_ENABLED", "false").lower() == "true":
+        prerender_scheduler.start()
+
+@app.on_event("shutdown")
+def stop_prerender_scheduler():
+    prerender_scheduler.stop()
+    logging_setup.shutdown_logging()
+
+@render_router.post("/prerender/{admin_post_id}")
+def queue_prerender(admin_post_id: str):
+    """Queue pre-rendering of an admin post for subscribed and active users"""
+    queued = prerender_scheduler.enqueue_post(admin_post_id)
+    return {"success": True, "queued": queued}
+
+@app.get("/prerender/stats")
+def prerender_stats():
+    return {"scheduler": prerender_scheduler.stats(), "result_cache": result_cache.stats()}
+
+@app.get("/cache/stats")
+def cache_stats():
+    """Memory and disk use, and hits, misses and evictions per namespace"""
+    return cache.stats()
+
+@app.get("/media/stats")
+def media_stats():
+    """Local media store size, hit rate and evictions"""
+    return media_store.stats()
+
+@app.get("/buffers/stats")
+def buffer_stats():
+    """Canvas and encode buffer reuse"""
+    return buffer_pool.stats()
+
+@app.get("/coalescing/stats")
+def coalescing_stats():
+    """How many duplicate downloads and renders were coalesced"""
+    return {
+        flight.name: flight.stats()
+        for flight in (template_downloads, profile_downloads, overlay_renders)
+    }
+
+def render_pool(admin_post):
+    pool = video_pool if is_video_post(admin_post) else image_pool
+    if not pool_available(pool):
+        raise HTTPException(status_code=503, detail=f"No {pool.name} render workers configured")
+    return pool
+
+def load_overlay_docs(request):
+    """(pool, user_data, admin_post) for an overlay request; 404 if either doc is missing
+
+    When the pool is remote the request is forwarded and the worker loads
+    the docs itself, so only what's needed to pick the pool is read here:
+    nothing at all when one deployment renders both images and videos,
+    otherwise the admin post. The docs are None then.
+    """
+    remote_urls = {pool.remote_url for pool in (image_pool, video_pool) if pool.remote_url}
+    if image_pool.name not in SERVICE_ROLES and video_pool.name not in SERVICE_ROLES and len(remote_urls) == 1:
+        return (image_pool if image_pool.remote_url else video_pool), None, None
+
+    with stage('firestore_fetch'):
         # Get admin post data
         admin_doc = db.collection("admin_posts").document(request.admin_post_id).get()
-        if not admin_doc.exists:
-            raise HTTPException(status_code=404, detail="Admin post not found")
-        
-        admin_post = admin_doc.to_dict()
-        
-        # Debug information
-        print(f"Frame Size: {admin_post['frameSize']}")
-        print(f"Profile Settings: {admin_post.get('profileSettings', {})}")
-        print(f"Text Settings: {admin_post.get('textSettings', {})}")
-        
-        # For personal overlay, we only include name and profile picture
-        filtered_user_data = {
-            'name': user_data.get('name', ''),
-            'profilePhotoUrl': user_data.get('profilePhotoUrl', ''),
-            'usageType': 'Personal'
-        }
+    if not admin_doc.exists:
+        raise HTTPException(status_code=404, detail="Admin post not found")
+    admin_post = admin_doc.to_dict()
+    pool = render_pool(admin_post)
+    if pool.remote_url:
+        return pool, None, None
+
+    with stage('firestore_fetch'):
+        # Get user data
+        user_doc = db.collection("users").document(request.user_id).get()
+    if not user_doc.exists:
+        raise HTTPException(status_code=404, detail="User not found")
+    return pool, user_doc.to_dict(), admin_post
+
+def overlay_tier(user_id):
+    # Until a user's doc has been read they get the business limits, so a
+    # paying user is never refused on a guess
+    return user_tiers.get(user_id) or "business"
+
+def charge_overlay(request, raw_request):
+    """Charge one overlay token before anything is read; False if our API already did"""
+    if forwarded_by_api(raw_request):
+        return False
+    enforce_rate_limit(f"user:{request.user_id}", overlay_tier(request.user_id), "overlay")
+    return True
+
+def charge_overlay_render(request, user_data, pool):
+    """Once the docs are read: remember the user's tier and charge the rest
+    of a video render's cost; returns the tokens charged"""
+    tier = overlay_type_for(user_data)
+    user_tiers.set(request.user_id, tier)
+    cost = VIDEO_RATE_COST - 1 if pool is video_pool else 0
+    if cost > 0:
+        enforce_rate_limit(f"user:{request.user_id}", tier, "overlay", cost)
+    return max(cost, 0)
+
+def refund_overlay(user_id, cost):
+    """A cached result is cheap to serve, so it isn't counted"""
+    if cost > 0:
+        rate_limiter.refund(f"user:{user_id}", overlay_tier(user_id), "overlay", cost)
+
+async def forward_overlay(pool, request, raw_request, charged):
+    response = await forward(pool, raw_request)
+    # The worker read the user's doc, so it knows their tier for next time
+    if response.headers.get("x-overlay-tier") in ("personal", "business"):
+        user_tiers.set(request.user_id, response.headers["x-overlay-tier"])
+    if charged and response.status_code == 200:
+        try:
+            cached = json.loads(response.body).get("cached")
+        except (ValueError, AttributeError):
+            cached = False
+        if cached:
+            await run_in_threadpool(refund_overlay, request.user_id, 1)
+    return response
+
+@overlay_router.post("/overlay_personal")
+async def create_personal_overlay(request: OverlayRequest, raw_request: Request, response: Response):
+    """Create personal overlay with only name and profile picture"""
+    try:
+        charged = await run_in_threadpool(charge_overlay, request, raw_request)
+        pool, user_data, admin_post = await run_in_threadpool(load_overlay_docs, request)
+        if pool.remote_url:
+            return await forward_overlay(pool, request, raw_request, charged)
         
-        # Check if it's a video
-        is_video = admin_post.get('mediaType') == 'video' or admin_post['mainImage'].lower().endswith(('.mp4', '.mov', '.avi', '.mkv'))
+        logger.debug("Personal overlay settings", extra={
+            "admin_post_id": request.admin_post_id,
+            "frame_size": admin_post['frameSize'],
+            "profile_settings": admin_post.get('profileSettings', {}),
+            "text_settings": admin_post.get('textSettings', {}),
+        })
         
-        if is_video:
-            # Create video overlay
-            video_path = create_video_overlay(admin_post, filtered_user_data)
-            
-            # Upload video to Firebase and get download URL
-            download_url = upload_to_firebase(None, request.user_id, request.admin_post_id, is_video=True, video_path=video_path)
-            
-            # Clean up temporary video file
-            os.unlink(video_path)
-        else:
-            # Create image overlay
-            overlay_image = create_overlay_image(admin_post, filtered_user_data)
-            
-            # Upload to Firebase and get download URL
-            download_url = upload_to_firebase(overlay_image, request.user_id, request.admin_post_id)
+        cost = int(charged) + await run_in_threadpool(charge_overlay_render, request, user_data, pool)
+        response.headers["X-Overlay-Tier"] = overlay_type_for(user_data)
+        filtered_user_data = overlay_user_data('personal', user_data)
+        download_url, cache_hit = await pool.run(
+            render_overlay, 'personal', request.user_id, request.admin_post_id, admin_post, user_data
+        )
+        if cache_hit:
+            await run_in_threadpool(refund_overlay, request.user_id, cost)
         
         return {
             "success": True,
             "overlay_type": "personal",
             "download_url": download_url,
+            "cached": cache_hit,
             "frame_size": admin_post['frameSize'],
             "user_data_used": {
                 "name": filtered_user_data['name'],
@@ -585,60 +1251,40 @@ def create_personal_overlay(request: OverlayRequest):
             }
         }
         
-    except HTTPException:
+    except (HTTPException, PoolBusy):
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating personal overlay: {str(e)}")
 
-@app.post("/overlay_business")
-def create_business_overlay(request: OverlayRequest):
+@overlay_router.post("/overlay_business")
+async def create_business_overlay(request: OverlayRequest, raw_request: Request, response: Response):
     """Create business overlay with all user details"""
     try:
-        # Get user data
-        user_doc = db.collection("users").document(request.user_id).get()
-        if not user_doc.exists:
-            raise HTTPException(status_code=404, detail="User not found")
-        
-        user_data = user_doc.to_dict()
-        
-        # Get admin post data
-        admin_doc = db.collection("admin_posts").document(request.admin_post_id).get()
-        if not admin_doc.exists:
-            raise HTTPException(status_code=404, detail="Admin post not found")
-        
-        admin_post = admin_doc.to_dict()
+        charged = await run_in_threadpool(charge_overlay, request, raw_request)
+        pool, user_data, admin_post = await run_in_threadpool(load_overlay_docs, request)
+        if pool.remote_url:
+            return await forward_overlay(pool, request, raw_request, charged)
         
-        # Debug information
-        print(f"Frame Size: {admin_post['frameSize']}")
-        print(f"Phone Settings: {admin_post.get('phoneSettings', {})}")
-        print(f"Address Settings: {admin_post.get('addressSettings', {})}")
-        
-        # For business overlay, we include all available data
-        user_data['usageType'] = 'Business'
-        
-        # Check if it's a video
-        is_video = admin_post.get('mediaType') == 'video' or admin_post['mainImage'].lower().endswith(('.mp4', '.mov', '.avi', '.mkv'))
+        logger.debug("Business overlay settings", extra={
+            "admin_post_id": request.admin_post_id,
+            "frame_size": admin_post['frameSize'],
+            "phone_settings": admin_post.get('phoneSettings', {}),
+            "address_settings": admin_post.get('addressSettings', {}),
+        })
         
-        if is_video:
-            # Create video overlay
-            video_path = create_video_overlay(admin_post, user_data)
-            
-            # Upload video to Firebase and get download URL
-            download_url = upload_to_firebase(None, request.user_id, request.admin_post_id, is_video=True, video_path=video_path)
-            
-            # Clean up temporary video file
-            os.unlink(video_path)
-        else:
-            # Create image overlay
-            overlay_image = create_overlay_image(admin_post, user_data)
-            
-            # Upload to Firebase and get download URL
-            download_url = upload_to_firebase(overlay_image, request.user_id, request.admin_post_id)
+        cost = int(charged) + await run_in_threadpool(charge_overlay_render, request, user_data, pool)
+        response.headers["X-Overlay-Tier"] = overlay_type_for(user_data)
+        download_url, cache_hit = await pool.run(
+            render_overlay, 'business', request.user_id, request.admin_post_id, admin_post, user_data
+        )
+        if cache_hit:
+            await run_in_threadpool(refund_overlay, request.user_id, cost)
         
         return {
             "success": True,
             "overlay_type": "business",
             "download_url": download_url,
+            "cached": cache_hit,
             "frame_size": admin_post['frameSize'],
             "user_data_used": {
                 "name": user_data.get('name', ''),
@@ -648,56 +1294,116 @@ def create_business_overlay(request: OverlayRequest):
             }
         }
         
-    except HTTPException:
+    except (HTTPException, PoolBusy):
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating business overlay: {str(e)}")
 
 # Background Removal Endpoints
-@app.post("/remove-bg/")
-async def remove_background(file: UploadFile = File(...)):
+@bg_router.post("/remove-bg/")
+async def remove_background(request: Request, file: UploadFile = File(...)):
+    await run_in_threadpool(limit_bg_request, request)
     contents = await file.read()
+    metrics.set_media_type('image')
+    output_filename = await bg_pool.run(remove_background_and_store, contents, file.filename)
 
+    # Return JSON with download URL
+    download_url = f"/download/{output_filename}"
+    return JSONResponse(content={
+        "success": True,
+        "message": "Background removed successfully",
+        "download_url": download_url,
+        "filename": output_filename
+    })
+
+def limit_bg_request(request):
+    """Per-IP limit on background removal, charged where the request first arrives"""
+    if forwarded_by_api(request):
+        return
+    enforce_rate_limit(f"ip:{client_ip(request)}", "anonymous", "bg")
+
+def remove_background_and_store(contents, filename):
+    """Runs on the bg pool; returns the output filename"""
     # Open and convert to RGBA
-    input_image = Image.open(BytesIO(contents)).convert("RGBA")
+    with stage('decode'):
+        input_image = Image.open(BytesIO(contents)).convert("RGBA")
 
     # Extract base name and build PNG paths
-    base_filename = os.path.splitext(file.filename)[0]
+    base_filename = os.path.splitext(filename)[0]
     input_path = f"upload/input/{base_filename}.png"
     output_filename = f"no-bg-{base_filename}.png"
-    output_path = f"upload/output/{output_filename}"
 
     # Save original as PNG (to support RGBA)
     input_image.save(input_path, format="PNG")
 
-    # Remove background and save result as PNG
-    result_image = remove(input_image)
-    result_image.save(output_path, format="PNG")
+    # Remove background and save result as PNG (once per distinct upload).
+    # The result is stored under the upload's digest, which no other
+    # upload can overwrite; the user-facing name is a link to it
+    def remove_and_save(digest):
+        with stage('bg_removal'):
+            result_image = bg_remover.get()(input_image)
+        with stage('encode'):
+            temp_path = f"{BG_RESULTS_DIR}/.{uuid.uuid4().hex}.tmp"
+            result_image.save(temp_path, format="PNG")
+        result_path = f"{BG_RESULTS_DIR}/{digest}.png"
+        os.replace(temp_path, result_path)
+        return result_path
 
-    # Log to SQLite
-    db = SessionLocal()
-    db_entry = UploadLog(filename=file.filename, result_filename=output_filename)
-    db.add(db_entry)
-    db.commit()
-    db.refresh(db_entry)
-    db.close()
+    digest = hashlib.sha256(contents).hexdigest()
+    result_path = bg_removal_cache.get(digest, remove_and_save)
+    if not result_path.startswith(f"{BG_RESULTS_DIR}/") or not os.path.exists(result_path):
+        # An entry from before results were stored by digest, or a result
+        # deleted since: make it again
+        bg_removal_cache.delete(digest)
+        result_path = bg_removal_cache.get(digest, remove_and_save)
+    link_output(result_path, output_filename)
 
-    # Return JSON with download URL
-    download_url = f"/download/{output_filename}"
-    return JSONResponse(content={
-        "success": True,
-        "message": "Background removed successfully",
-        "download_url": download_url,
-        "filename": output_filename
-    })
+    # Log to SQLite (SQLAlchemy is only imported once a removal happens)
+    from upload_log import log_upload
+    log_upload(filename, output_filename)
+    return output_filename
 
-@app.get("/download/{filename}")
+def link_output(result_path, filename):
+    """Point upload/output/<filename> at a stored result without copying it"""
+    temp_path = f"upload/output/.{uuid.uuid4().hex}.tmp"
+    try:
+        os.link(result_path, temp_path)
+    except OSError:
+        # No hard links on this filesystem
+        shutil.copyfile(result_path, temp_path)
+    # A new file replaces the name, so earlier links and results are never rewritten
+    os.replace(temp_path, f"upload/output/{filename}")
+
+@bg_router.get("/download/{filename}")
 async def download_file(filename: str):
     file_path = f"upload/output/{filename}"
-    if os.path.exists(file_path):
+    if os.path.isfile(file_path):
         return FileResponse(file_path, media_type="image/png", filename=filename)
     else:
         return JSONResponse(content={"error": "File not found"}, status_code=404)
 
+def include_role(router, pool=None, role=None, checks=None):
+    role = role or pool.name
+    if role in SERVICE_ROLES:
+        app.include_router(router)
+    elif pool is not None and pool.remote_url:
+        app.include_router(forwarding_routes(router, pool, checks))
+
+include_role(api_router, role="api")
+include_role(render_router, image_pool)
+# The bg worker only sees the API's address, so callers are limited here
+include_role(bg_router, bg_pool, checks={"/remove-bg/": limit_bg_request})
+if bg_pool.remote_url and not WORKER_SHARED_SECRET:
+    logger.warning("WORKER_SHARED_SECRET is not set; the bg worker will rate-limit all forwarded calls "
+                   "as one client unless RATE_LIMIT_ANONYMOUS_BG=off there")
+if (image_pool.remote_url or video_pool.remote_url) and not WORKER_SHARED_SECRET:
+    logger.warning("WORKER_SHARED_SECRET is not set; render workers will charge forwarded overlays "
+                   "to the user's rate limit a second time")
+# Overlays are dispatched per post: images to the image pool, videos to the video pool
+if pool_available(image_pool) or pool_available(video_pool):
+    app.include_router(overlay_router)
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8005)
\ No newline at end of file
+    import uvicorn
+    # 8005 by default; give each role deployment its own PORT
+    uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("PORT", 8005)))
\ No newline at end of file
@@ -0,0 +1,191 @@
+import hashlib
+import logging
+import mmap
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class MediaStore:
+    """Content-addressed media files on local disk, kept under a size budget.
+
+    Objects live at ``objects/<sha256[:2]>/<sha256>`` and are read through
+    read-only mmaps, so decoders work straight from the page cache. Names
+    (template URLs, bg-removal output filenames) point at objects through
+    small files under ``names/``, which is what lets a restarted process -
+    or another worker on the same disk - find what is already there.
+
+    Least recently used objects are deleted once the store is over
+    ``max_bytes``; a file's mtime records its last use so the order
+    survives restarts. Every object is checked against its hash the first
+    time a process opens it, and a corrupt one is removed and treated as
+    missing.
+    """
+
+    TOUCH_INTERVAL = 60
+
+    def __init__(self, root, max_bytes=2 * 1024 * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._objects_dir = os.path.join(root, 'objects')
+        self._names_dir = os.path.join(root, 'names')
+        self._tmp_dir = os.path.join(root, 'tmp')
+        for path in (self._objects_dir, self._names_dir, self._tmp_dir):
+            os.makedirs(path, exist_ok=True)
+        self._lock = threading.Lock()
+        self._lru = OrderedDict()   # digest -> [size, last touched]
+        self._verified = set()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.corrupt = 0
+        self._scan()
+
+    def _scan(self):
+        """Rebuild the LRU from disk, oldest mtime first"""
+        found = []
+        for prefix in os.listdir(self._objects_dir):
+            directory = os.path.join(self._objects_dir, prefix)
+            for digest in os.listdir(directory):
+                st = os.stat(os.path.join(directory, digest))
+                found.append((st.st_mtime, digest, st.st_size))
+        found.sort()
+        with self._lock:
+            for mtime, digest, size in found:
+                self._lru[digest] = [size, mtime]
+                self.bytes += size
+        logger.info("Media store loaded", extra={"objects": len(found), "bytes": self.bytes})
+        self._evict()
+
+    def object_path(self, digest):
+        return os.path.join(self._objects_dir, digest[:2], digest)
+
+    def _name_path(self, name):
+        return os.path.join(self._names_dir, hashlib.sha256(name.encode('utf-8')).hexdigest())
+
+    def _write_atomic(self, path, data):
+        fd, tmp_path = tempfile.mkstemp(dir=self._tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def put(self, data, name=None):
+        """Store bytes (and optionally name them); returns the digest"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._write_atomic(path, data)
+        with self._lock:
+            if digest not in self._lru:
+                self.bytes += len(data)
+            self._lru[digest] = [len(data), time.time()]
+            self._lru.move_to_end(digest)
+            self._verified.add(digest)
+        if name is not None:
+            self._write_atomic(self._name_path(name), digest.encode('ascii'))
+        self._evict()
+        return digest
+
+    def lookup(self, name, max_age=None):
+        """Digest stored under ``name``, or None if unknown or older than ``max_age`` seconds"""
+        path = self._name_path(name)
+        try:
+            if max_age is not None and time.time() - os.path.getmtime(path) > max_age:
+                digest = None
+            else:
+                with open(path, 'rb') as f:
+                    digest = f.read().decode('ascii') or None
+        except FileNotFoundError:
+            digest = None
+        if digest is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return digest
+
+    def open(self, digest):
+        """A read-only mmap of the object (file-like and buffer), or None if it is gone"""
+        path = self.object_path(digest)
+        try:
+            with open(path, 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            # Missing, or empty (which mmap can't map)
+            self._forget(digest)
+            return None
+
+        if digest not in self._verified:
+            if hashlib.sha256(mapped).hexdigest() != digest:
+                mapped.close()
+                logger.warning("Corrupt media object removed", extra={"digest": digest})
+                self.corrupt += 1
+                self._delete(digest)
+                return None
+            self._verified.add(digest)
+
+        self._touch(digest, path, len(mapped))
+        return mapped
+
+    def _touch(self, digest, path, size):
+        now = time.time()
+        with self._lock:
+            entry = self._lru.get(digest)
+            if entry is None:
+                # Written by another process sharing the directory
+                entry = self._lru[digest] = [size, 0]
+                self.bytes += size
+            self._lru.move_to_end(digest)
+            stale = now - entry[1] > self.TOUCH_INTERVAL
+            if stale:
+                entry[1] = now
+        if stale:
+            try:
+                os.utime(path, (now, now))
+            except FileNotFoundError:
+                pass
+
+    def _forget(self, digest):
+        with self._lock:
+            entry = self._lru.pop(digest, None)
+            if entry is not None:
+                self.bytes -= entry[0]
+            self._verified.discard(digest)
+
+    def _delete(self, digest):
+        self._forget(digest)
+        try:
+            # Open mmaps of the file stay valid after the unlink
+            os.unlink(self.object_path(digest))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        while True:
+            with self._lock:
+                if self.bytes <= self.max_bytes or not self._lru:
+                    return
+                digest = next(iter(self._lru))
+            self._delete(digest)
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'objects': len(self._lru),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'corrupt': self.corrupt,
+            }
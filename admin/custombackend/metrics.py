@@ -0,0 +1,144 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# Buckets span cheap Firestore reads up to multi-second video encodes
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+STAGE_SECONDS = Histogram(
+    'overlay_stage_seconds',
+    'Time spent in each stage of the overlay pipeline',
+    ['endpoint', 'media_type', 'stage'],
+    buckets=LATENCY_BUCKETS,
+)
+REQUEST_SECONDS = Histogram(
+    'overlay_request_seconds',
+    'Total request latency',
+    ['endpoint', 'media_type'],
+    buckets=LATENCY_BUCKETS,
+)
+ERRORS = Counter(
+    'overlay_errors_total',
+    'Failed stages and error responses',
+    ['endpoint', 'stage'],
+)
+CACHE_REQUESTS = Counter(
+    'overlay_cache_requests_total',
+    'Cache lookups by cache and result (hit or miss)',
+    ['cache', 'result'],
+)
+COALESCED = Gauge(
+    'overlay_coalesced_requests',
+    'Duplicate in-flight calls that were coalesced since startup',
+    ['flight'],
+)
+LOGGING = Gauge(
+    'overlay_logging',
+    'Logging pipeline counters (emitted, dropped, sampled_out, emit_seconds)',
+    ['counter'],
+)
+BUFFER_POOL = Gauge(
+    'overlay_buffer_pool',
+    'Render buffer pool counters (hits, misses, dropped, pooled_bytes)',
+    ['counter'],
+)
+ADMISSION_REJECTIONS = Counter(
+    'overlay_admission_rejections_total',
+    'Requests turned away by admission control, by route class and reason',
+    ['route_class', 'reason'],
+)
+RATE_LIMITED = Counter(
+    'overlay_rate_limited_total',
+    'Calls refused by per-caller rate limits, by tier and action',
+    ['tier', 'action'],
+)
+WORKER_POOL = Gauge(
+    'overlay_worker_pool',
+    'Worker pool counters (running, completed, failed, rejected) per pool',
+    ['pool', 'counter'],
+)
+
+
+class RequestTimings:
+    """Per-request stage durations, used for metrics and Server-Timing"""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.media_type = 'none'
+        self.started = time.perf_counter()
+        self.stages = {}
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def server_timing(self, total):
+        parts = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in self.stages.items()]
+        parts.append(f"total;dur={total * 1000:.1f}")
+        return ', '.join(parts)
+
+
+_current = ContextVar('overlay_request_timings', default=None)
+
+
+def begin_request(endpoint):
+    timings = RequestTimings(endpoint)
+    return timings, _current.set(timings)
+
+
+def finish_request(timings, token, failed=False):
+    """Record stage and total histograms; returns the total in seconds"""
+    _current.reset(token)
+    total = time.perf_counter() - timings.started
+    for stage, seconds in timings.stages.items():
+        STAGE_SECONDS.labels(timings.endpoint, timings.media_type, stage).observe(seconds)
+    REQUEST_SECONDS.labels(timings.endpoint, timings.media_type).observe(total)
+    if failed:
+        ERRORS.labels(timings.endpoint, 'request').inc()
+    return total
+
+
+@contextmanager
+def track_request(endpoint):
+    """Time work that doesn't go through the HTTP middleware (e.g. pre-rendering)"""
+    timings, token = begin_request(endpoint)
+    failed = False
+    try:
+        yield timings
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        finish_request(timings, token, failed)
+
+
+def set_media_type(media_type):
+    timings = _current.get()
+    if timings is not None:
+        timings.media_type = media_type
+
+
+@contextmanager
+def stage(name):
+    """Time one pipeline stage of the current request"""
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        timings = _current.get()
+        ERRORS.labels(timings.endpoint if timings else 'none', name).inc()
+        raise
+    finally:
+        timings = _current.get()
+        if timings is not None:
+            timings.add(name, time.perf_counter() - started)
+
+
+def record_cache(cache, hit):
+    CACHE_REQUESTS.labels(cache, 'hit' if hit else 'miss').inc()
+
+
+def latest():
+    return generate_latest(), CONTENT_TYPE_LATEST
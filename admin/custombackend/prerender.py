@@ -0,0 +1,175 @@
+import logging
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+
+from result_cache import USER_RENDER_FIELDS, overlay_cache_key
+
+logger = logging.getLogger(__name__)
+
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi', '.mkv')
+
+
+def is_video_post(admin_post):
+    return admin_post.get('mediaType') == 'video' or admin_post.get('mainImage', '').lower().endswith(VIDEO_EXTENSIONS)
+
+
+def overlay_type_for(user_data):
+    """Business users open /overlay_business, everyone else /overlay_personal"""
+    return 'business' if user_data.get('usageType') == 'Business' else 'personal'
+
+
+def overlay_user_data(overlay_type, user_data):
+    """User fields that go on the overlay for the given overlay type"""
+    if overlay_type == 'personal':
+        # For personal overlay, we only include name and profile picture
+        return {
+            'name': user_data.get('name', ''),
+            'profilePhotoUrl': user_data.get('profilePhotoUrl', ''),
+            'usageType': 'Personal'
+        }
+    # For business overlay, we include all available data
+    return dict(user_data, usageType='Business')
+
+
+class PrerenderScheduler:
+    """Pre-renders overlays for newly published admin posts.
+
+    Publishing a post queues a notification to every user, and the clients
+    then all hit /overlay_* at once. The scheduler listens for posts that
+    become published, walks the subscribed and recently active users, and
+    renders their overlays into the result cache ahead of that spike. It only
+    works while the API is idle and never faster than ``max_per_second``.
+    """
+
+    def __init__(self, db, render_fn, cache, is_idle,
+                 max_per_second=2.0, max_users_per_post=1000,
+                 active_days=7, include_videos=False):
+        self.db = db
+        self.render_fn = render_fn
+        self.cache = cache
+        self.is_idle = is_idle
+        self.min_interval = 1.0 / max_per_second if max_per_second > 0 else 0.0
+        self.max_users_per_post = max_users_per_post
+        self.active_days = active_days
+        self.include_videos = include_videos
+
+        self._posts = queue.Queue()
+        self._queued_ids = set()
+        self._stop = threading.Event()
+        self._worker = None
+        self._watch = None
+        self._initial_snapshot = True
+        self._next_slot = 0.0
+
+        self.rendered = 0
+        self.skipped_cached = 0
+        self.failed = 0
+
+    def start(self):
+        if self._worker is not None:
+            return
+        self._worker = threading.Thread(target=self._run, name='prerender', daemon=True)
+        self._worker.start()
+        query = self.db.collection('admin_posts').where('isPublished', '==', True)
+        self._watch = query.on_snapshot(self._on_snapshot)
+
+    def stop(self):
+        self._stop.set()
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+
+    def enqueue_post(self, admin_post_id):
+        """Queue a post for pre-rendering (no-op if it is already queued)"""
+        if admin_post_id in self._queued_ids:
+            return False
+        self._queued_ids.add(admin_post_id)
+        self._posts.put(admin_post_id)
+        return True
+
+    def stats(self):
+        return {
+            'queued_posts': self._posts.qsize(),
+            'rendered': self.rendered,
+            'skipped_cached': self.skipped_cached,
+            'failed': self.failed,
+        }
+
+    def _on_snapshot(self, docs, changes, read_time):
+        # The first snapshot lists every post that is already published;
+        # only posts that start matching afterwards are new.
+        if self._initial_snapshot:
+            self._initial_snapshot = False
+            return
+        for change in changes:
+            if change.type.name == 'ADDED':
+                self.enqueue_post(change.document.id)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                admin_post_id = self._posts.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            try:
+                self._prerender_post(admin_post_id)
+            except Exception as e:
+                logger.exception("Pre-render of admin post failed", extra={"admin_post_id": admin_post_id})
+            finally:
+                self._queued_ids.discard(admin_post_id)
+
+    def _prerender_post(self, admin_post_id):
+        admin_doc = self.db.collection('admin_posts').document(admin_post_id).get()
+        if not admin_doc.exists:
+            return
+        admin_post = admin_doc.to_dict()
+        if is_video_post(admin_post) and not self.include_videos:
+            return
+
+        for user_id, user_data in self._target_users():
+            if self._stop.is_set():
+                return
+            overlay_type = overlay_type_for(user_data)
+            render_data = overlay_user_data(overlay_type, user_data)
+            key = overlay_cache_key(overlay_type, user_id, admin_post_id, admin_post, render_data)
+            if key in self.cache:
+                self.skipped_cached += 1
+                continue
+            self._wait_for_capacity()
+            try:
+                self.render_fn(overlay_type, user_id, admin_post_id, admin_post, user_data)
+                self.rendered += 1
+            except Exception as e:
+                self.failed += 1
+                logger.warning("Pre-render failed", extra={
+                    "user_id": user_id, "admin_post_id": admin_post_id, "error": str(e),
+                })
+
+    def _target_users(self):
+        """Subscribed users first, then recently active ones, de-duplicated"""
+        users = self.db.collection('users')
+        active_since = datetime.now() - timedelta(days=self.active_days)
+        queries = [
+            users.where('subscriptionStatus', '==', 'active'),
+            users.where('updatedAt', '>=', active_since),
+        ]
+        seen = set()
+        for query in queries:
+            for doc in query.select(list(USER_RENDER_FIELDS)).stream():
+                if doc.id in seen:
+                    continue
+                seen.add(doc.id)
+                yield doc.id, doc.to_dict()
+                if len(seen) >= self.max_users_per_post:
+                    return
+
+    def _wait_for_capacity(self):
+        # Only use idle capacity: back off while user traffic is in flight
+        while not self._stop.is_set() and not self.is_idle():
+            time.sleep(0.25)
+        now = time.monotonic()
+        if now < self._next_slot:
+            time.sleep(self._next_slot - now)
+        self._next_slot = max(now, self._next_slot) + self.min_interval
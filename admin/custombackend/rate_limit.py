@@ -0,0 +1,221 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class Limit:
+    """A token bucket: up to ``capacity`` calls at once, refilled at ``refill_per_second``"""
+
+    def __init__(self, capacity, refill_per_second):
+        self.capacity = float(capacity)
+        self.refill_per_second = float(refill_per_second)
+
+    @classmethod
+    def parse(cls, spec):
+        """Parse "30/60": 30 calls per 60 seconds, with bursts of up to 30"""
+        count, _, seconds = spec.partition('/')
+        return cls(int(count), int(count) / float(seconds or 1))
+
+    def __repr__(self):
+        return f"Limit({self.capacity:g}/{self.capacity / self.refill_per_second:g}s)"
+
+
+def take_tokens(tokens, updated, limit, cost, now):
+    """One bucket step: (allowed, tokens left, seconds until ``cost`` tokens are available)
+
+    ``tokens``/``updated`` of None is a bucket seen for the first time (full).
+    """
+    if tokens is None:
+        tokens = limit.capacity
+    else:
+        tokens = min(limit.capacity, tokens + (now - updated) * limit.refill_per_second)
+    if tokens >= cost:
+        return True, tokens - cost, 0.0
+    return False, tokens, (cost - tokens) / limit.refill_per_second
+
+
+def return_tokens(tokens, updated, limit, cost, now):
+    """Give ``cost`` tokens back, as take_tokens() returns them; never past capacity"""
+    if tokens is None:
+        return True, limit.capacity, 0.0
+    tokens = min(limit.capacity, tokens + (now - updated) * limit.refill_per_second + cost)
+    return True, tokens, 0.0
+
+
+class MemoryBackend:
+    """Buckets in this process; O(1) per check.
+
+    At most ``max_keys`` buckets are kept, least recently used dropped
+    first. A bucket that has been idle long enough to be evicted has
+    normally refilled anyway, so dropping it loses nothing.
+    """
+
+    def __init__(self, max_keys=100_000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()    # key -> (tokens, updated)
+        self._lock = threading.Lock()
+
+    def take(self, key, limit, cost, now):
+        return self._step(take_tokens, key, limit, cost, now)
+
+    def refund(self, key, limit, cost, now):
+        return self._step(return_tokens, key, limit, cost, now)
+
+    def _step(self, step, key, limit, cost, now):
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (None, None))
+            allowed, tokens, retry_after = step(tokens, updated, limit, cost, now)
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, tokens, retry_after
+
+    def stats(self):
+        return {'backend': 'memory', 'buckets': len(self._buckets)}
+
+
+class SQLiteBackend:
+    """Buckets in a SQLite file, shared by every worker process on the host.
+
+    Each check is one short write transaction on a single row, so workers
+    see each other's spending immediately. WAL mode keeps readers and the
+    writer out of each other's way; the busy timeout covers the brief
+    moments two workers update at once.
+    """
+
+    # Idle buckets are full again, so they're deleted now and then to keep the table small
+    PRUNE_EVERY = 10_000
+    PRUNE_IDLE_SECONDS = 24 * 60 * 60
+
+    def __init__(self, path, busy_timeout=5.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._takes = 0
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS rate_limit_buckets "
+                "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def take(self, key, limit, cost, now):
+        result = self._step(take_tokens, key, limit, cost, now)
+        self._takes += 1
+        if self._takes % self.PRUNE_EVERY == 0:
+            self.prune(self.PRUNE_IDLE_SECONDS, now)
+        return result
+
+    def refund(self, key, limit, cost, now):
+        return self._step(return_tokens, key, limit, cost, now)
+
+    def _step(self, step, key, limit, cost, now):
+        connection = self._connection()
+        # IMMEDIATE takes the write lock up front, so read-modify-write can't interleave
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(
+                "SELECT tokens, updated FROM rate_limit_buckets WHERE key = ?", (key,)
+            ).fetchone()
+            allowed, tokens, retry_after = step(row[0] if row else None, row[1] if row else None,
+                                                limit, cost, now)
+            connection.execute(
+                "INSERT INTO rate_limit_buckets (key, tokens, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                (key, tokens, now),
+            )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return allowed, tokens, retry_after
+
+    def prune(self, idle_seconds, now=None):
+        """Delete buckets untouched for ``idle_seconds`` (long enough to have refilled)"""
+        now = time.time() if now is None else now
+        return self._connection().execute(
+            "DELETE FROM rate_limit_buckets WHERE updated < ?", (now - idle_seconds,)
+        ).rowcount
+
+    def stats(self):
+        buckets = self._connection().execute("SELECT COUNT(*) FROM rate_limit_buckets").fetchone()[0]
+        return {'backend': 'sqlite', 'path': self.path, 'buckets': buckets}
+
+
+class RateLimited(Exception):
+    def __init__(self, tier, action, retry_after, limit):
+        super().__init__(f"Rate limit exceeded for {action} ({tier})")
+        self.tier = tier
+        self.action = action
+        self.retry_after = retry_after
+        self.limit = limit
+
+
+class RateLimiter:
+    """Per-caller token buckets, with limits per (tier, action).
+
+    Callers are identified by a key such as ``user:<id>`` or ``ip:<addr>``;
+    each (key, action) pair has its own bucket, so overlay spam doesn't use
+    up background-removal allowance. ``cost`` lets expensive calls (video
+    renders) take more than one token. Actions without a configured limit
+    for the tier are not limited. The backend holds the buckets: in
+    process (MemoryBackend) or shared between workers (SQLiteBackend).
+    """
+
+    def __init__(self, backend, limits):
+        self.backend = backend
+        self.limits = dict(limits)     # (tier, action) -> Limit
+        self._lock = threading.Lock()
+        self.allowed = {}
+        self.limited = {}
+        self.refunded = {}
+
+    def check(self, key, tier, action, cost=1):
+        """Spend ``cost`` tokens or raise RateLimited; returns the tokens left (None if unlimited)"""
+        limit = self.limits.get((tier, action))
+        if limit is None:
+            return None
+        allowed, remaining, retry_after = self.backend.take(f"{action}:{key}", limit, min(cost, limit.capacity),
+                                                            time.time())
+        counters = self.allowed if allowed else self.limited
+        with self._lock:
+            counters[(tier, action)] = counters.get((tier, action), 0) + 1
+        if not allowed:
+            raise RateLimited(tier, action, retry_after, limit)
+        return remaining
+
+    def refund(self, key, tier, action, cost=1):
+        """Give back tokens spent on a call that turned out cheap (e.g. a cache hit)"""
+        limit = self.limits.get((tier, action))
+        if limit is None or cost <= 0:
+            return
+        self.backend.refund(f"{action}:{key}", limit, min(cost, limit.capacity), time.time())
+        with self._lock:
+            self.refunded[(tier, action)] = self.refunded.get((tier, action), 0) + 1
+
+    def stats(self):
+        with self._lock:
+            counts = {
+                f"{tier}.{action}": {
+                    'limit': repr(limit),
+                    'allowed': self.allowed.get((tier, action), 0),
+                    'limited': self.limited.get((tier, action), 0),
+                    'refunded': self.refunded.get((tier, action), 0),
+                }
+                for (tier, action), limit in self.limits.items()
+            }
+        return {'storage': self.backend.stats(), 'limits': counts}
@@ -0,0 +1,34 @@
+import hashlib
+import json
+
+# Fields of the admin post that change what a rendered overlay looks like
+ADMIN_POST_RENDER_FIELDS = (
+    'mainImage', 'mediaType', 'frameSize', 'profileSettings',
+    'textSettings', 'phoneSettings', 'addressSettings', 'updatedAt',
+)
+
+# Fields of the user document that end up on the overlay
+USER_RENDER_FIELDS = ('name', 'profilePhotoUrl', 'phoneNumber', 'address', 'usageType')
+
+
+def _fingerprint(data, fields):
+    """Stable hash over the given fields of a Firestore document dict"""
+    subset = {field: data.get(field) for field in fields}
+    raw = json.dumps(subset, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16]
+
+
+def overlay_cache_key(overlay_type, user_id, admin_post_id, admin_post, user_data):
+    """Cache key for a rendered overlay.
+
+    The key embeds a fingerprint of every input that affects the output, so a
+    user changing their name or an admin editing the template is a miss.
+    """
+    return ':'.join([
+        overlay_type,
+        user_id,
+        admin_post_id,
+        _fingerprint(admin_post, ADMIN_POST_RENDER_FIELDS),
+        _fingerprint(user_data, USER_RENDER_FIELDS),
+    ])
+
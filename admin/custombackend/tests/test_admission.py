@@ -0,0 +1,165 @@
+import asyncio
+
+import pytest
+
+from admission import AdmissionController, Rejected, RouteClass
+
+
+def controller(memory_limit_bytes=None, rss=lambda: 0, **overrides):
+    settings = dict(max_concurrent=1, max_queue=1, queue_timeout=0.05, memory_cost_bytes=100)
+    settings.update(overrides)
+    heavy = RouteClass('render', ('/render',), ('POST',), **settings)
+    api = RouteClass('api', (), max_concurrent=10, max_queue=10, shed_on_memory=False)
+    return AdmissionController([heavy], api, memory_limit_bytes=memory_limit_bytes, rss=rss)
+
+
+async def hold(admission, path, started, release, method='POST'):
+    async with admission.admit(method, path):
+        started.set()
+        await release.wait()
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_classify_by_prefix_and_method():
+    admission = controller()
+    assert admission.classify('POST', '/render/1').name == 'render'
+    assert admission.classify('GET', '/render/1').name == 'api'
+    assert admission.classify('POST', '/users/1').name == 'api'
+
+
+def test_rejects_when_queue_is_full():
+    async def scenario():
+        admission = controller(queue_timeout=5)
+        route_class = admission.classify('POST', '/render')
+        started, release = asyncio.Event(), asyncio.Event()
+        holder = asyncio.create_task(hold(admission, '/render', started, release))
+        await started.wait()
+        # Second request takes the only queue place
+        waiter = asyncio.create_task(hold(admission, '/render', asyncio.Event(), release))
+        await asyncio.sleep(0)
+        assert route_class.waiting == 1
+
+        with pytest.raises(Rejected) as rejected:
+            async with admission.admit('POST', '/render'):
+                pass
+        assert rejected.value.reason == 'queue_full'
+        release.set()
+        await asyncio.gather(holder, waiter)
+        return route_class
+
+    route_class = run(scenario())
+    assert route_class.rejected == {'queue_full': 1, 'queue_timeout': 0, 'memory': 0}
+    assert route_class.admitted == 2
+
+
+def test_rejects_after_queue_timeout_and_keeps_no_slot():
+    async def scenario():
+        admission = controller()
+        route_class = admission.classify('POST', '/render')
+        started, release = asyncio.Event(), asyncio.Event()
+        holder = asyncio.create_task(hold(admission, '/render', started, release))
+        await started.wait()
+        for _ in range(3):
+            with pytest.raises(Rejected) as rejected:
+                async with admission.admit('POST', '/render'):
+                    pass
+            assert rejected.value.reason == 'queue_timeout'
+        release.set()
+        await holder
+
+        # Timed-out waiters left the slot free for the next request
+        async with admission.admit('POST', '/render'):
+            assert route_class.active == 1
+        return route_class
+
+    route_class = run(scenario())
+    assert route_class.rejected['queue_timeout'] == 3
+    assert route_class.waiting == 0
+    assert route_class.active == 0
+    assert route_class.semaphore._value == route_class.max_concurrent
+
+
+def test_waiter_gets_the_slot_when_it_frees_up():
+    async def scenario():
+        admission = controller(queue_timeout=5)
+        started, release = asyncio.Event(), asyncio.Event()
+        holder = asyncio.create_task(hold(admission, '/render', started, release))
+        await started.wait()
+        waiter_started = asyncio.Event()
+        waiter = asyncio.create_task(hold(admission, '/render', waiter_started, release))
+        await asyncio.sleep(0)
+        assert not waiter_started.is_set()
+        release.set()
+        await asyncio.gather(holder, waiter)
+        return waiter_started.is_set()
+
+    assert run(scenario())
+
+
+def test_sheds_expensive_requests_on_memory_but_not_cheap_ones():
+    async def scenario():
+        # 950 in use + 100 for the request would pass the 1000 limit
+        admission = controller(memory_limit_bytes=1000, rss=lambda: 950)
+        with pytest.raises(Rejected) as rejected:
+            async with admission.admit('POST', '/render'):
+                pass
+        assert rejected.value.reason == 'memory'
+        async with admission.admit('GET', '/users/1') as route_class:
+            assert route_class.name == 'api'
+        return admission
+
+    admission = run(scenario())
+    assert admission.classify('POST', '/render').rejected['memory'] == 1
+    assert admission.reserved_bytes == 0
+
+
+def test_reserves_memory_of_admitted_requests():
+    async def scenario():
+        admission = controller(memory_limit_bytes=1000, rss=lambda: 850, max_concurrent=2)
+        started, release = asyncio.Event(), asyncio.Event()
+        holder = asyncio.create_task(hold(admission, '/render', started, release))
+        await started.wait()
+        assert admission.reserved_bytes == 100
+        # 850 + 100 reserved + 100 more is over the limit
+        with pytest.raises(Rejected) as rejected:
+            async with admission.admit('POST', '/render'):
+                pass
+        release.set()
+        await holder
+        return rejected.value.reason, admission.reserved_bytes
+
+    assert run(scenario()) == ('memory', 0)
+
+
+def test_retry_after_grows_with_the_queue():
+    route_class = RouteClass('render', ('/render',), max_concurrent=2)
+    route_class.mean_seconds = 4.0
+    assert route_class.retry_after() == 2
+    route_class.waiting = 5
+    assert route_class.retry_after() == 12
+    route_class.waiting = 1000
+    assert route_class.retry_after() == 60
+    route_class.mean_seconds = 0.01
+    assert route_class.retry_after() == 5
+    route_class.waiting = 0
+    assert route_class.retry_after() == 1
+
+
+def test_rejection_carries_retry_after_and_reports_it():
+    reports = []
+
+    async def scenario():
+        admission = controller(memory_limit_bytes=1000, rss=lambda: 1000)
+        admission.on_reject = lambda name, reason: reports.append((name, reason))
+        with pytest.raises(Rejected) as rejected:
+            async with admission.admit('POST', '/render'):
+                pass
+        return rejected.value
+
+    rejected = run(scenario())
+    assert rejected.retry_after == 1
+    assert rejected.route_class.name == 'render'
+    assert reports == [('render', 'memory')]
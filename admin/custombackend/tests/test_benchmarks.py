@@ -0,0 +1,23 @@
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+# The benchmarks import the real app; only Firebase and HTTP are stubbed
+for module in ('fastapi', 'requests', 'dotenv', 'prometheus_client'):
+    pytest.importorskip(module)
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from run import run_case
+
+
+@pytest.mark.parametrize('case', ['overlay_personal', 'overlay_business_numpy'])
+def test_benchmark_case_runs(case):
+    # In its own process, as run.py does: run_case changes directory and imports main
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+        result = pool.submit(run_case, case, 1, 0).result(timeout=300)
+    assert result['iterations'] == 1
+    assert result['p50_ms'] > 0
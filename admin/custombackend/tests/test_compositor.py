@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+from PIL import Image, ImageFont
+
+from compositor import Compositor, NumpyCanvas, PillowCanvas
+
+
+def profile_tile(size, seed):
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 256, (size, size, 4), dtype=np.uint8)
+    # Soft edges and fully transparent corners, like a cut-out photo
+    pixels[:size // 4, :size // 4, 3] = 0
+    pixels[-size // 4:, :, 3] = np.linspace(0, 255, size, dtype=np.uint8)
+    return Image.fromarray(pixels, 'RGBA')
+
+
+def background(mode, seed):
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 256, (200, 320, len(mode)), dtype=np.uint8)
+    if mode == 'RGBA':
+        # Video overlays start transparent; mix in partly and fully transparent pixels
+        pixels[:, :160, 3] = 0
+    return Image.fromarray(pixels, mode)
+
+
+def draw_layout(canvas, font):
+    """Overlapping elements: profile under a name box, text over text, some off the edge"""
+    canvas.paste_profile(profile_tile(90, 1), (20, 30), circle=True)
+    canvas.rectangle([60.7, 50.2, 200.9, 95.5], '#000000')
+    canvas.text((66, 52), 'Jane Doe', '#ffffff', font)
+    canvas.text((70, 60), 'Overlap', (255, 128, 0, 140), font)
+    canvas.paste_profile(profile_tile(64, 2), (150, 80), circle=False)
+    canvas.rectangle([280, 150, 340, 210], '#11223380')
+    canvas.text((250, 160), '+91 98765', '#00ff00', font)
+    canvas.text((-15, -10), 'Edge', '#ff00ff', font)
+    canvas.paste_profile(profile_tile(50, 3), (-20, 170), circle=True)
+    return canvas.finish()
+
+
+@pytest.mark.parametrize('mode', ['RGB', 'RGBA'])
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_numpy_canvas_matches_pillow_pixel_for_pixel(mode, seed):
+    font = ImageFont.load_default(size=28)
+    expected = draw_layout(PillowCanvas(background(mode, seed)), font)
+    actual = draw_layout(NumpyCanvas(background(mode, seed), Compositor()), font)
+    assert np.array_equal(np.asarray(actual), np.asarray(expected))
+
+
+def test_work_buffers_are_reused_between_renders():
+    font = ImageFont.load_default(size=28)
+    compositor = Compositor()
+    draw_layout(NumpyCanvas(background('RGB', 0), compositor), font)
+    work = compositor._local.buffers['work']
+    draw_layout(NumpyCanvas(background('RGB', 1), compositor), font)
+    assert compositor._local.buffers['work'] is work
+
+
+def test_rectangle_with_inverted_corners_is_rejected_like_pillow():
+    canvas = NumpyCanvas(Image.new('RGB', (10, 10)), Compositor())
+    with pytest.raises(ValueError):
+        canvas.rectangle([5, 5, 2, 8], '#ffffff')
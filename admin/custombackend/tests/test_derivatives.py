@@ -0,0 +1,49 @@
+from PIL import Image
+
+from derivatives import DerivativeGenerator, build_derivatives, pick_display_url, pick_template_url
+
+
+def derivative(url, width, height, format):
+    return {'url': url, 'width': width, 'height': height, 'source': 'main.jpg', 'format': format}
+
+
+POST = {
+    'mainImage': 'main.jpg',
+    'derivatives': {
+        'thumbnail': derivative('thumb.jpg', 320, 569, 'jpeg'),
+        'feed': derivative('feed.jpg', 1080, 1920, 'jpeg'),
+        'frame': derivative('frame.png', 1080, 1920, 'png'),
+    },
+}
+
+
+def test_feed_version_is_made_even_when_it_matches_the_frame_size():
+    image = Image.new('RGB', (2160, 3840))
+    sizes = {name: version.size for name, version in build_derivatives(image, 1080, 1920)}
+    assert sizes == {'thumbnail': (320, 569), 'feed': (1080, 1920), 'frame': (1080, 1920)}
+
+
+def test_small_source_gets_no_upscaled_versions():
+    image = Image.new('RGB', (300, 400))
+    assert [name for name, _ in build_derivatives(image, 1080, 1920)] == ['frame']
+
+
+def test_display_never_picks_the_lossless_frame_version():
+    assert pick_display_url(POST, 200) == 'thumb.jpg'
+    assert pick_display_url(POST, 321) == 'feed.jpg'
+    assert pick_display_url(POST, 4000) == 'feed.jpg'
+    frame_only = {'mainImage': 'main.jpg', 'derivatives': {'frame': POST['derivatives']['frame']}}
+    assert pick_display_url(frame_only, 500) == 'main.jpg'
+
+
+def test_renders_only_start_from_lossless_versions():
+    assert pick_template_url(POST, 1080, 1920) == 'frame.png'
+    legacy = {'mainImage': 'main.jpg', 'derivatives': {'frame': dict(POST['derivatives']['frame'], format=None)}}
+    assert pick_template_url(legacy, 1080, 1920) == 'main.jpg'
+
+
+def test_posts_missing_their_feed_version_are_redone():
+    generator = DerivativeGenerator(db=None, bucket=None, fetch_bytes=None)
+    assert not generator._needs_derivatives(POST)
+    skipped_feed = dict(POST, derivatives={k: v for k, v in POST['derivatives'].items() if k != 'feed'})
+    assert generator._needs_derivatives(skipped_feed)
@@ -0,0 +1,169 @@
+import threading
+
+import pytest
+
+from rate_limit import Limit, MemoryBackend, RateLimited, RateLimiter, SQLiteBackend, return_tokens, take_tokens
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def backend(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryBackend()
+    return SQLiteBackend(str(tmp_path / 'rate_limits.sqlite3'))
+
+
+def test_parse_spec():
+    limit = Limit.parse('30/60')
+    assert limit.capacity == 30
+    assert limit.refill_per_second == 0.5
+    assert repr(limit) == 'Limit(30/60s)'
+    assert Limit.parse('5').refill_per_second == 5
+
+
+def test_new_bucket_starts_full():
+    assert take_tokens(None, None, Limit(10, 1), 1, now=100.0) == (True, 9, 0.0)
+
+
+def test_refill_is_capped_at_capacity():
+    limit = Limit(10, 1)
+    allowed, tokens, _ = take_tokens(0, 100.0, limit, 1, now=104.0)
+    assert allowed and tokens == 3
+    allowed, tokens, _ = take_tokens(0, 100.0, limit, 1, now=1000.0)
+    assert allowed and tokens == 9
+
+
+def test_empty_bucket_reports_wait_for_cost():
+    allowed, tokens, retry_after = take_tokens(0.5, 100.0, Limit(10, 0.5), 3, now=100.0)
+    assert not allowed
+    assert tokens == 0.5
+    assert retry_after == 5.0
+
+
+def test_backend_spends_and_refills(backend):
+    limit = Limit(2, 1)
+    assert backend.take('ip:1', limit, 1, 100.0)[0]
+    assert backend.take('ip:1', limit, 1, 100.0)[0]
+    allowed, _, retry_after = backend.take('ip:1', limit, 1, 100.0)
+    assert not allowed and retry_after == 1.0
+    # Other keys have their own bucket
+    assert backend.take('ip:2', limit, 1, 100.0)[0]
+    # One second later one token is back
+    assert backend.take('ip:1', limit, 1, 101.0)[0]
+    assert not backend.take('ip:1', limit, 1, 101.0)[0]
+
+
+def test_rejected_take_does_not_spend(backend):
+    limit = Limit(3, 1)
+    backend.take('k', limit, 2, 100.0)
+    assert not backend.take('k', limit, 2, 100.0)[0]
+    assert backend.take('k', limit, 1, 100.0) == (True, 0, 0.0)
+
+
+def test_returned_tokens_are_capped_at_capacity():
+    limit = Limit(10, 1)
+    assert return_tokens(5, 100.0, limit, 2, now=101.0) == (True, 8, 0.0)
+    assert return_tokens(9, 100.0, limit, 5, now=100.0) == (True, 10, 0.0)
+    assert return_tokens(None, None, limit, 1, now=100.0) == (True, 10, 0.0)
+
+
+def test_backend_refund_gives_tokens_back(backend):
+    limit = Limit(2, 0.001)
+    backend.take('k', limit, 2, 100.0)
+    assert not backend.take('k', limit, 1, 100.0)[0]
+    backend.refund('k', limit, 1, 100.0)
+    assert backend.take('k', limit, 1, 100.0)[0]
+    # Refunds never fill a bucket past capacity
+    backend.refund('k', limit, 5, 100.0)
+    assert backend.take('k', limit, 2, 100.0) == (True, 0, 0.0)
+
+
+def test_memory_backend_drops_least_recently_used_buckets():
+    backend = MemoryBackend(max_keys=2)
+    limit = Limit(1, 0.001)
+    backend.take('a', limit, 1, 100.0)
+    backend.take('b', limit, 1, 100.0)
+    backend.take('a', limit, 1, 100.0)
+    backend.take('c', limit, 1, 100.0)
+    assert backend.stats()['buckets'] == 2
+    # 'a' was used more recently, so it's still empty; 'b' was dropped and starts full again
+    assert not backend.take('a', limit, 1, 100.0)[0]
+    assert backend.take('b', limit, 1, 100.0)[0]
+
+
+def test_sqlite_buckets_are_shared_between_instances(tmp_path):
+    path = str(tmp_path / 'shared.sqlite3')
+    first, second = SQLiteBackend(path), SQLiteBackend(path)
+    limit = Limit(2, 0.001)
+    assert first.take('ip:1', limit, 1, 100.0)[0]
+    assert second.take('ip:1', limit, 1, 100.0)[0]
+    assert not first.take('ip:1', limit, 1, 100.0)[0]
+    assert second.stats()['buckets'] == 1
+
+
+def test_sqlite_concurrent_takes_never_overspend(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / 'rate_limits.sqlite3'))
+    limit = Limit(50, 0.001)
+    results = []
+
+    def spend():
+        for _ in range(20):
+            results.append(backend.take('k', limit, 1, 100.0)[0])
+
+    threads = [threading.Thread(target=spend) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results.count(True) == 50
+
+
+def test_sqlite_prune_deletes_idle_buckets(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / 'rate_limits.sqlite3'))
+    limit = Limit(1, 1)
+    backend.take('old', limit, 1, 100.0)
+    backend.take('new', limit, 1, 200.0)
+    assert backend.prune(50, now=200.0) == 1
+    assert backend.stats()['buckets'] == 1
+
+
+def test_limiter_raises_and_counts():
+    limiter = RateLimiter(MemoryBackend(), {('personal', 'overlay'): Limit(1, 0.01)})
+    assert limiter.check('user:1', 'personal', 'overlay') == 0
+    with pytest.raises(RateLimited) as limited:
+        limiter.check('user:1', 'personal', 'overlay')
+    assert limited.value.retry_after == pytest.approx(100, rel=0.01)
+    counts = limiter.stats()['limits']['personal.overlay']
+    assert (counts['allowed'], counts['limited']) == (1, 1)
+
+
+def test_limiter_ignores_actions_without_a_limit():
+    limiter = RateLimiter(MemoryBackend(), {('personal', 'overlay'): Limit(1, 1)})
+    assert limiter.check('user:1', 'business', 'overlay') is None
+    assert limiter.check('ip:1', 'anonymous', 'bg') is None
+
+
+def test_cost_above_capacity_is_clamped():
+    limiter = RateLimiter(MemoryBackend(), {('personal', 'overlay'): Limit(3, 0.01)})
+    # A video render costing more than the whole bucket can still run when it's full
+    assert limiter.check('user:1', 'personal', 'overlay', cost=5) == 0
+    with pytest.raises(RateLimited):
+        limiter.check('user:1', 'personal', 'overlay', cost=5)
+
+
+def test_buckets_are_per_action():
+    limiter = RateLimiter(MemoryBackend(), {
+        ('anonymous', 'bg'): Limit(1, 0.01),
+        ('anonymous', 'overlay'): Limit(1, 0.01),
+    })
+    limiter.check('ip:1', 'anonymous', 'bg')
+    assert limiter.check('ip:1', 'anonymous', 'overlay') == 0
+
+
+def test_limiter_refund_undoes_a_charge():
+    limiter = RateLimiter(MemoryBackend(), {('personal', 'overlay'): Limit(1, 0.01)})
+    limiter.check('user:1', 'personal', 'overlay')
+    limiter.refund('user:1', 'personal', 'overlay')
+    assert limiter.check('user:1', 'personal', 'overlay') == 0
+    assert limiter.stats()['limits']['personal.overlay']['refunded'] == 1
+    # Nothing to give back without a limit
+    limiter.refund('user:1', 'business', 'overlay')
@@ -0,0 +1,377 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from io import BytesIO
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class BytesSerializer:
+    def dumps(self, value):
+        return bytes(value)
+
+    def loads(self, data):
+        return data
+
+    def size(self, value):
+        return len(value)
+
+
+class JsonSerializer:
+    def dumps(self, value):
+        return json.dumps(value, separators=(',', ':')).encode('utf-8')
+
+    def loads(self, data):
+        return json.loads(data)
+
+    def size(self, value):
+        return len(self.dumps(value))
+
+
+class ImageSerializer:
+    """PIL images; stored losslessly so the mode and pixels come back unchanged"""
+
+    def __init__(self, format='PNG'):
+        self.format = format
+
+    def dumps(self, image):
+        buffer = BytesIO()
+        image.save(buffer, format=self.format)
+        return buffer.getvalue()
+
+    def loads(self, data):
+        from PIL import Image
+
+        image = Image.open(BytesIO(data))
+        image.load()
+        return image
+
+    def size(self, image):
+        return image.width * image.height * len(image.getbands())
+
+
+BYTES = BytesSerializer()
+JSON = JsonSerializer()
+IMAGE = ImageSerializer()
+
+
+class TieredCache:
+    """Memory LRU with a byte budget, backed by an optional disk tier.
+
+    Values are grouped into namespaces (see namespace()), each with its own
+    TTL, serializer, loader and counters; all namespaces share the memory
+    and disk budgets. Lookups go memory -> disk -> loader, and whatever a
+    slower tier returns is copied into the faster ones. Disk entries are
+    files under ``disk_dir/<namespace>/``, aged by their mtime, so they
+    survive restarts; the oldest are deleted once ``max_disk_bytes`` is
+    exceeded.
+    """
+
+    def __init__(self, max_memory_bytes=64 * 1024 * 1024, disk_dir=None, max_disk_bytes=512 * 1024 * 1024):
+        self.max_memory_bytes = max_memory_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()     # (namespace, key) -> (value, size, expires_at)
+        self._disk = OrderedDict()       # path -> (namespace, size), oldest first
+        self._namespaces = {}
+        self.memory_bytes = 0
+        self.disk_bytes = 0
+        if disk_dir:
+            self._scan_disk()
+
+    def namespace(self, name, ttl_seconds=None, serializer=BYTES, loader=None, disk=False, sizeof=None):
+        """Create (or return the existing) namespace ``name``
+
+        ``ttl_seconds=None`` keeps entries until they are evicted (0 turns
+        caching off), ``loader(key)`` fills misses, ``disk`` enables the
+        disk tier and ``sizeof(value)`` overrides the serializer's memory
+        estimate.
+        """
+        with self._lock:
+            if name not in self._namespaces:
+                self._namespaces[name] = CacheNamespace(
+                    self, name, ttl_seconds, serializer, loader, disk and bool(self.disk_dir), sizeof,
+                )
+            return self._namespaces[name]
+
+    # Memory tier
+
+    def _memory_get(self, namespace, key):
+        with self._lock:
+            entry = self._memory.get((namespace.name, key))
+            if entry is None:
+                return _MISSING
+            value, size, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._memory[(namespace.name, key)]
+                self.memory_bytes -= size
+                return _MISSING
+            self._memory.move_to_end((namespace.name, key))
+            return value
+
+    def _memory_set(self, namespace, key, value, size, ttl_seconds=None):
+        if size > self.max_memory_bytes:
+            return
+        ttl_seconds = namespace.ttl_seconds if ttl_seconds is None else ttl_seconds
+        expires_at = time.monotonic() + ttl_seconds if ttl_seconds is not None else float('inf')
+        with self._lock:
+            previous = self._memory.pop((namespace.name, key), None)
+            if previous is not None:
+                self.memory_bytes -= previous[1]
+            self._memory[(namespace.name, key)] = (value, size, expires_at)
+            self.memory_bytes += size
+            while self.memory_bytes > self.max_memory_bytes:
+                (evicted_namespace, _), (_, evicted_size, _) = self._memory.popitem(last=False)
+                self.memory_bytes -= evicted_size
+                self._namespaces[evicted_namespace].memory_evictions += 1
+
+    def _memory_delete(self, namespace, key):
+        with self._lock:
+            entry = self._memory.pop((namespace.name, key), None)
+            if entry is not None:
+                self.memory_bytes -= entry[1]
+
+    def _memory_entries(self, namespace):
+        with self._lock:
+            return sum(1 for name, _ in self._memory if name == namespace.name)
+
+    # Disk tier
+
+    def _scan_disk(self):
+        found = []
+        os.makedirs(self.disk_dir, exist_ok=True)
+        for name in os.listdir(self.disk_dir):
+            directory = os.path.join(self.disk_dir, name)
+            if not os.path.isdir(directory):
+                continue
+            for filename in os.listdir(directory):
+                path = os.path.join(directory, filename)
+                if filename.startswith('.tmp-'):
+                    # Left behind by a write that was interrupted
+                    os.unlink(path)
+                    continue
+                st = os.stat(path)
+                found.append((st.st_mtime, path, name, st.st_size))
+        found.sort()
+        for _, path, name, size in found:
+            self._disk[path] = (name, size)
+            self.disk_bytes += size
+        logger.info("Cache disk tier loaded", extra={"entries": len(found), "bytes": self.disk_bytes})
+
+    def _disk_path(self, namespace, key):
+        digest = hashlib.sha256(str(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.disk_dir, namespace.name, digest)
+
+    def _disk_get(self, namespace, key):
+        """(data, seconds of TTL left or None) for a live disk entry, else (None, None)"""
+        path = self._disk_path(namespace, key)
+        try:
+            ttl_left = None
+            if namespace.ttl_seconds is not None:
+                ttl_left = namespace.ttl_seconds - (time.time() - os.path.getmtime(path))
+                if ttl_left <= 0:
+                    self._disk_delete(path)
+                    return None, None
+            with open(path, 'rb') as f:
+                return f.read(), ttl_left
+        except FileNotFoundError:
+            return None, None
+
+    def _disk_set(self, namespace, key, data):
+        path = self._disk_path(namespace, key)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        evicted = []
+        with self._lock:
+            previous = self._disk.pop(path, None)
+            if previous is not None:
+                self.disk_bytes -= previous[1]
+            self._disk[path] = (namespace.name, len(data))
+            self.disk_bytes += len(data)
+            while self.disk_bytes > self.max_disk_bytes and len(self._disk) > 1:
+                old_path, (old_namespace, old_size) = self._disk.popitem(last=False)
+                self.disk_bytes -= old_size
+                self._namespaces.get(old_namespace, namespace).disk_evictions += 1
+                evicted.append(old_path)
+        for old_path in evicted:
+            try:
+                os.unlink(old_path)
+            except FileNotFoundError:
+                pass
+
+    def _disk_delete(self, path):
+        with self._lock:
+            entry = self._disk.pop(path, None)
+            if entry is not None:
+                self.disk_bytes -= entry[1]
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    def stats(self):
+        with self._lock:
+            namespaces = list(self._namespaces.values())
+            totals = {
+                'memory_bytes': self.memory_bytes,
+                'max_memory_bytes': self.max_memory_bytes,
+                'disk_bytes': self.disk_bytes,
+                'max_disk_bytes': self.max_disk_bytes,
+            }
+        totals['namespaces'] = {namespace.name: namespace.stats() for namespace in namespaces}
+        return totals
+
+
+class CacheNamespace:
+    """One kind of cached value inside a TieredCache; created by TieredCache.namespace()
+
+    Concurrent misses for the same key share one loader call. ``None``
+    from a loader is cached in memory (so a missing record isn't re-read
+    on every lookup) but never written to disk.
+    """
+
+    def __init__(self, cache, name, ttl_seconds, serializer, loader, disk, sizeof):
+        self.cache = cache
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.serializer = serializer
+        self.loader = loader
+        self.disk = disk
+        self.sizeof = sizeof or serializer.size
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.load_errors = 0
+        self.memory_evictions = 0
+        self.disk_evictions = 0
+
+    @property
+    def enabled(self):
+        return self.ttl_seconds != 0
+
+    def _cached(self, key):
+        if not self.enabled:
+            # Switched off: every lookup goes to the loader, neither tier is touched
+            self.misses += 1
+            return _MISSING
+        value = self.cache._memory_get(self, key)
+        if value is not _MISSING:
+            self.memory_hits += 1
+            return value
+        if self.disk:
+            data, ttl_left = self.cache._disk_get(self, key)
+            if data is not None:
+                value = self.serializer.loads(data)
+                # Expires from memory when it would have on disk
+                self.cache._memory_set(self, key, value, self._size(value), ttl_left)
+                self.disk_hits += 1
+                return value
+        self.misses += 1
+        return _MISSING
+
+    def _size(self, value):
+        return 64 if value is None else self.sizeof(value)
+
+    def get(self, key, loader=None):
+        """Cached value, else ``loader(key)`` (or the namespace loader); None without either"""
+        value = self._cached(key)
+        if value is not _MISSING:
+            return value
+        loader = loader or self.loader
+        if loader is None:
+            return None
+
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+        if not leader:
+            return future.result()
+        try:
+            self.loads += 1
+            value = loader(key)
+            self.set(key, value)
+            future.set_result(value)
+        except BaseException as e:
+            self.load_errors += 1
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._inflight[key]
+        return future.result()
+
+    def get_many(self, keys, load_many):
+        """Like get() for several keys; ``load_many(missing_keys)`` returns a dict for all misses at once"""
+        values, missing = {}, []
+        for key in keys:
+            if key in values or key in missing:
+                continue
+            value = self._cached(key)
+            if value is _MISSING:
+                missing.append(key)
+            else:
+                values[key] = value
+        if missing:
+            self.loads += 1
+            try:
+                loaded = load_many(missing)
+            except BaseException:
+                self.load_errors += 1
+                raise
+            for key in missing:
+                values[key] = loaded.get(key)
+                self.set(key, values[key])
+        return values
+
+    def set(self, key, value):
+        if not self.enabled:
+            return
+        self.cache._memory_set(self, key, value, self._size(value))
+        if self.disk and value is not None:
+            self.cache._disk_set(self, key, self.serializer.dumps(value))
+
+    def delete(self, key):
+        self.cache._memory_delete(self, key)
+        if self.disk:
+            self.cache._disk_delete(self.cache._disk_path(self, key))
+
+    def __contains__(self, key):
+        # Membership checks don't count as hits or misses
+        if not self.enabled:
+            return False
+        if self.cache._memory_get(self, key) is not _MISSING:
+            return True
+        return self.disk and self.cache._disk_get(self, key)[0] is not None
+
+    def stats(self):
+        return {
+            'entries': self.cache._memory_entries(self),
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'loads': self.loads,
+            'load_errors': self.load_errors,
+            'memory_evictions': self.memory_evictions,
+            'disk_evictions': self.disk_evictions,
+        }
@@ -0,0 +1,28 @@
+from datetime import datetime
+
+from sqlalchemy import create_engine, Column, Integer, String, DateTime
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+
+# SQLite DB Setup for background removal
+DATABASE_URL = "sqlite:///./db.sqlite3"
+engine = create_engine(DATABASE_URL)
+Base = declarative_base()
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+class UploadLog(Base):
+    __tablename__ = "uploads"
+    id = Column(Integer, primary_key=True, index=True)
+    filename = Column(String, index=True)
+    result_filename = Column(String)
+    timestamp = Column(DateTime, default=datetime.utcnow)
+
+Base.metadata.create_all(bind=engine)
+
+def log_upload(filename, result_filename):
+    db = SessionLocal()
+    db_entry = UploadLog(filename=filename, result_filename=result_filename)
+    db.add(db_entry)
+    db.commit()
+    db.refresh(db_entry)
+    db.close()
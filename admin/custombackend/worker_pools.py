@@ -0,0 +1,96 @@
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PoolBusy(Exception):
+    """A worker pool's threads and wait queue are all taken"""
+
+    def __init__(self, pool):
+        super().__init__(f"{pool.name} pool is busy")
+        self.pool = pool
+
+
+class WorkerPool:
+    """Runs one kind of heavy work (image renders, video renders, background
+    removal) on its own threads, with its own limits.
+
+    At most ``max_workers`` calls run at once and ``max_queue`` more wait;
+    past that run() raises PoolBusy instead of queueing without bound. A
+    slow video encode therefore only ever holds video threads, never the
+    ones cheap API calls use. When the work is served by another deployment
+    (``remote_url``), the pool's threads carry the forwarded requests and
+    the same limits apply to them.
+    """
+
+    def __init__(self, name, max_workers, max_queue, remote_url=None):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.remote_url = remote_url.rstrip('/') if remote_url else None
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-pool")
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def _reserve(self):
+        with self._lock:
+            if self.pending >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise PoolBusy(self)
+            self.pending += 1
+
+    def _call(self, fn, args, kwargs):
+        with self._lock:
+            self.running += 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self.running -= 1
+
+    def _done(self, future):
+        with self._lock:
+            self.pending -= 1
+            if future.cancelled() or future.exception() is not None:
+                self.failed += 1
+            else:
+                self.completed += 1
+
+    def submit(self, fn, *args, **kwargs):
+        """Start ``fn`` on the pool; returns a concurrent Future (raises PoolBusy when full)"""
+        self._reserve()
+        # Carry the request ID and metrics timings over to the worker thread
+        context = contextvars.copy_context()
+        try:
+            future = self._executor.submit(context.run, self._call, fn, args, kwargs)
+        except BaseException:
+            with self._lock:
+                self.pending -= 1
+            raise
+        future.add_done_callback(self._done)
+        return future
+
+    async def run(self, fn, *args, **kwargs):
+        """Await ``fn(*args, **kwargs)`` on the pool without holding an event loop or API thread"""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'remote_url': self.remote_url,
+                'max_workers': self.max_workers,
+                'max_queue': self.max_queue,
+                'running': self.running,
+                'queued': self.pending - self.running,
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+            }
@@ -0,0 +1,120 @@
+"""Local mock of the Razorpay orders and payment links API.
+
+Answers with Razorpay-shaped JSON after a configurable delay, and can fail
+a fraction of requests with 503 to exercise client retries. Speaks
+HTTP/1.1 keep-alive, so connection reuse shows up in the numbers.
+
+    python benchmarks/mock_razorpay.py --port 8790 --latency-ms 150
+    RAZORPAY_BASE_URL=http://127.0.0.1:8790 uvicorn main:app --port 8006
+"""
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockRazorpay(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0):
+        super().__init__(address, Handler)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.links = {}
+        self.requests = 0
+        self.connections = 0
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _simulate(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+        delay = server.latency_ms + random.uniform(-server.jitter_ms, server.jitter_ms)
+        time.sleep(max(0.0, delay) / 1000.0)
+        if server.error_rate and random.random() < server.error_rate:
+            self._reply(503, {'error': {'code': 'SERVER_ERROR', 'description': 'mock outage'}})
+            return False
+        return True
+
+    def _new_id(self, prefix):
+        with self.server.lock:
+            return f"{prefix}_mock{next(self.server.ids):010d}"
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        data = json.loads(self.rfile.read(length) or b'{}')
+        if not self._simulate():
+            return
+        now = int(time.time())
+        if self.path == '/v1/orders':
+            self._reply(200, {
+                'id': self._new_id('order'), 'entity': 'order', 'amount': data.get('amount'),
+                'currency': data.get('currency', 'INR'), 'receipt': data.get('receipt'),
+                'notes': data.get('notes', {}), 'status': 'created', 'created_at': now,
+            })
+        elif self.path == '/v1/payment_links':
+            link_id = self._new_id('plink')
+            link = dict(data, id=link_id, status='created', created_at=now,
+                        short_url=f"https://rzp.io/i/{link_id[-6:]}")
+            with self.server.lock:
+                self.server.links[link_id] = link
+            self._reply(200, link)
+        else:
+            self._reply(404, {'error': {'code': 'BAD_REQUEST_ERROR', 'description': 'not found'}})
+
+    def do_GET(self):
+        if not self._simulate():
+            return
+        if self.path == '/stats':
+            self._reply(200, {'requests': self.server.requests, 'connections': self.server.connections})
+            return
+        link = self.server.links.get(self.path.rsplit('/', 1)[-1]) if self.path.startswith('/v1/payment_links/') else None
+        if link is None:
+            self._reply(404, {'error': {'code': 'BAD_REQUEST_ERROR', 'description': 'not found'}})
+        else:
+            self._reply(200, link)
+
+
+def serve(port, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, background=False):
+    server = MockRazorpay(('127.0.0.1', port), latency_ms, jitter_ms, error_rate)
+    if background:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    else:
+        server.serve_forever()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Mock Razorpay API')
+    parser.add_argument('--port', type=int, default=8790)
+    parser.add_argument('--latency-ms', type=float, default=150)
+    parser.add_argument('--jitter-ms', type=float, default=30)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+    print(f"Mock Razorpay on http://127.0.0.1:{args.port}")
+    serve(args.port, args.latency_ms, args.jitter_ms, args.error_rate)
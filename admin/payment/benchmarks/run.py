@@ -0,0 +1,124 @@
+"""Checkout latency/throughput against the mock Razorpay server.
+
+A checkout is what create_payment_order() does: create an order and a
+payment link. Modes:
+
+  sdk_sequential     razorpay SDK, order then link, on a thread pool (the old path)
+  async_sequential   pooled AsyncRazorpayClient, order then link
+  async_overlapped   pooled AsyncRazorpayClient, both calls at once
+
+    python benchmarks/run.py --checkouts 400 --concurrency 20 --latency-ms 150
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [BENCH_DIR, os.path.dirname(BENCH_DIR)]
+
+import mock_razorpay
+from razorpay_async import AsyncRazorpayClient
+
+ORDER = {'amount': 9900, 'currency': 'INR', 'receipt': 'bench', 'notes': {'plan_id': 'bench'}}
+LINK = {'amount': 9900, 'currency': 'INR', 'description': 'bench', 'notes': {'plan_id': 'bench'}}
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(mode, latencies, elapsed, server, connections_before):
+    latencies.sort()
+    return {
+        'mode': mode,
+        'checkouts': len(latencies),
+        'throughput_per_s': round(len(latencies) / elapsed, 2),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+        'connections_opened': server.connections - connections_before,
+    }
+
+
+def run_sdk(base_url, checkouts, concurrency):
+    import razorpay
+
+    client = razorpay.Client(auth=('rzp_test_bench', 'secret'), base_url=base_url)
+
+    def checkout(_):
+        started = time.perf_counter()
+        client.order.create(data=ORDER)
+        client.payment_link.create(data=LINK)
+        return time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(checkout, range(checkouts)))
+
+
+async def run_async(base_url, checkouts, concurrency, overlapped):
+    client = AsyncRazorpayClient('rzp_test_bench', 'secret', base_url=base_url, max_connections=2 * concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def checkout():
+        async with semaphore:
+            started = time.perf_counter()
+            if overlapped:
+                await asyncio.gather(client.create_order(ORDER), client.create_payment_link(LINK))
+            else:
+                await client.create_order(ORDER)
+                await client.create_payment_link(LINK)
+            return time.perf_counter() - started
+
+    try:
+        return await asyncio.gather(*(checkout() for _ in range(checkouts)))
+    finally:
+        await client.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', default='sdk_sequential,async_sequential,async_overlapped')
+    parser.add_argument('--checkouts', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--latency-ms', type=float, default=150)
+    parser.add_argument('--jitter-ms', type=float, default=30)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--port', type=int, default=8790)
+    parser.add_argument('--output', help='write results as JSON')
+    args = parser.parse_args()
+
+    server = mock_razorpay.serve(args.port, args.latency_ms, args.jitter_ms, args.error_rate, background=True)
+    base_url = f"http://127.0.0.1:{args.port}"
+
+    results = []
+    for mode in args.modes.split(','):
+        connections_before = server.connections
+        started = time.perf_counter()
+        if mode == 'sdk_sequential':
+            latencies = run_sdk(base_url, args.checkouts, args.concurrency)
+        elif mode in ('async_sequential', 'async_overlapped'):
+            latencies = asyncio.run(run_async(base_url, args.checkouts, args.concurrency,
+                                              overlapped=mode == 'async_overlapped'))
+        else:
+            sys.exit(f"unknown mode {mode!r}")
+        result = summarize(mode, list(latencies), time.perf_counter() - started, server, connections_before)
+        print(f"{mode:<18} {result['throughput_per_s']:8.2f}/s  p50 {result['p50_ms']:7.1f} ms  "
+              f"p95 {result['p95_ms']:7.1f} ms  p99 {result['p99_ms']:7.1f} ms  "
+              f"connections {result['connections_opened']}")
+        results.append(result)
+    server.shutdown()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
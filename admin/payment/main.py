@@ -1,48 +1,95 @@
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
+from typing import Optional
 from dotenv import load_dotenv
 import os
-import razorpay
 import uvicorn
+import firebase_admin
+from firebase_admin import credentials, firestore
+from razorpay_async import AsyncRazorpayClient
+from plan_catalogue import PaymentLinkCache, PlanCatalogue, PlanError, payment_notes
 
 load_dotenv()
 
 app = FastAPI()
 
-# Initialize Razorpay client
-razorpay_client = razorpay.Client(
-    auth=(os.getenv("RAZORPAY_KEY_ID"), os.getenv("RAZORPAY_KEY_SECRET"))
+# Initialize Firebase (plan catalogue)
+if not firebase_admin._apps:
+    cred = credentials.Certificate(os.getenv("GOOGLE_APPLICATION_CREDENTIALS", "serviceAccountKey.json"))
+    firebase_admin.initialize_app(cred)
+
+db = firestore.client()
+
+# subscriptionPlans, read once and kept current by a snapshot listener
+plan_catalogue = PlanCatalogue(db)
+
+# Unpaid links are handed out again for repeat taps on the same plan
+payment_links = PaymentLinkCache(ttl_seconds=int(os.getenv("PAYMENT_LINK_TTL_SECONDS", 1800)))
+
+# Pooled async Razorpay client; connections stay open between requests
+razorpay_client = AsyncRazorpayClient(
+    os.getenv("RAZORPAY_KEY_ID"),
+    os.getenv("RAZORPAY_KEY_SECRET"),
+    base_url=os.getenv("RAZORPAY_BASE_URL"),
+    timeout=float(os.getenv("RAZORPAY_TIMEOUT", 10)),
+    max_retries=int(os.getenv("RAZORPAY_MAX_RETRIES", 3)),
 )
 
+@app.on_event("startup")
+def load_plan_catalogue():
+    plan_catalogue.reload()
+    plan_catalogue.watch()
+
+@app.on_event("shutdown")
+async def close_razorpay_client():
+    plan_catalogue.stop()
+    await razorpay_client.aclose()
+
 class PaymentRequest(BaseModel):
-    amount: float  # in INR
+    amount: Optional[float] = None  # in INR; taken from the plan when plan_id is set
     name: str
     email: str
     contact: str  # in 10-digit mobile format
+    plan_id: Optional[str] = None
+    user_id: Optional[str] = None
+    usage_type: Optional[str] = None
+
+def customer_link_data(data: PaymentRequest, amount_paise: int, description: str):
+    return {
+        "amount": amount_paise,
+        "currency": "INR",
+        "description": description,
+        "customer": {
+            "name": data.name,
+            "email": data.email,
+            "contact": data.contact,
+        },
+        "notify": {
+            "sms": True,
+            "email": True
+        },
+        "reminder_enable": True,
+        "callback_url": "https://your-site.com/payment-callback",
+        "callback_method": "get"
+    }
+
+@app.get("/plans/")
+def list_plans(usage_type: Optional[str] = None):
+    return {"plans": [plan._asdict() for plan in plan_catalogue.plans(usage_type)]}
 
 @app.post("/create-payment-link/")
-def create_payment_link(data: PaymentRequest):
+async def create_payment_link(data: PaymentRequest):
+    if data.plan_id:
+        return await create_plan_payment_link(data)
+    if data.amount is None or data.amount <= 0:
+        raise HTTPException(status_code=400, detail="amount or plan_id is required")
     try:
         # Convert to paise
         amount_paise = int(data.amount * 100)
 
-        payment_link = razorpay_client.payment_link.create({
-            "amount": amount_paise,
-            "currency": "INR",
-            "description": f"Payment for {data.name}",
-            "customer": {
-                "name": data.name,
-                "email": data.email,
-                "contact": data.contact,
-            },
-            "notify": {
-                "sms": True,
-                "email": True
-            },
-            "reminder_enable": True,
-            "callback_url": "https://your-site.com/payment-callback",
-            "callback_method": "get"
-        })
+        payment_link = await razorpay_client.create_payment_link(
+            customer_link_data(data, amount_paise, f"Payment for {data.name}")
+        )
 
         return {
             "payment_link": payment_link["short_url"],
@@ -52,5 +99,40 @@ def create_payment_link(data: PaymentRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def create_plan_payment_link(data: PaymentRequest):
+    """Checkout for a catalogue plan: price, duration and usage type come from the plan"""
+    if not data.user_id:
+        raise HTTPException(status_code=400, detail="user_id is required with plan_id")
+    try:
+        plan = plan_catalogue.validate(
+            data.plan_id,
+            amount_paise=None if data.amount is None else int(round(data.amount * 100)),
+            usage_type=data.usage_type,
+        )
+    except PlanError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def create(expire_by):
+        link_data = customer_link_data(data, plan.amount_paise, f"{plan.title} - {plan.subtitle}")
+        link_data["notes"] = payment_notes(plan, data.user_id)
+        link_data["expire_by"] = expire_by
+        return await razorpay_client.create_payment_link(link_data)
+
+    try:
+        payment_link, reused = await payment_links.get_or_create(
+            (data.user_id, plan.id), create, razorpay_client.fetch_payment_link
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return {
+        "payment_link": payment_link["short_url"],
+        "status": payment_link["status"],
+        "payment_link_id": payment_link["id"],
+        "plan_id": plan.id,
+        "amount": plan.amount_paise / 100.0,
+        "reused": reused,
+    }
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8006)
\ No newline at end of file
@@ -0,0 +1,116 @@
+"""
+Async Razorpay API client.
+
+One httpx.AsyncClient per process keeps TLS connections to Razorpay alive
+between requests, so a checkout costs a round trip instead of a handshake
+plus a round trip. Every call has connect/read timeouts and is retried
+with full-jitter exponential backoff when it is safe to do so: creates
+(POST) are only retried when Razorpay cannot have processed them
+(connection failures, 429, 503), reads are also retried on timeouts and
+other 5xx responses.
+
+Independent calls can be overlapped with asyncio.gather(). Sync apps
+(Flask) run the client on a BackgroundLoop so the pool outlives requests.
+
+RAZORPAY_BASE_URL overrides the API host, e.g. to point at the local mock
+in admin/payment/benchmarks/mock_razorpay.py.
+"""
+
+import asyncio
+import random
+import threading
+
+import httpx
+
+BASE_URL = 'https://api.razorpay.com'
+
+# Statuses Razorpay returns before doing any work, safe to retry for creates
+RETRY_ANY_METHOD = {429, 503}
+RETRY_IDEMPOTENT = {500, 502, 504}
+
+
+class RazorpayError(Exception):
+    def __init__(self, status_code, error):
+        self.status_code = status_code
+        self.error = error or {}
+        super().__init__(self.error.get('description') or f"Razorpay returned HTTP {status_code}")
+
+
+class AsyncRazorpayClient:
+    def __init__(self, key_id, key_secret, base_url=None, timeout=10.0, connect_timeout=3.0,
+                 max_connections=20, max_retries=3, backoff=0.25, max_backoff=4.0):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retries = 0
+        self._http = httpx.AsyncClient(
+            base_url=(base_url or BASE_URL).rstrip('/'),
+            auth=(key_id or '', key_secret or ''),
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            headers={'Content-Type': 'application/json'},
+        )
+
+    async def request(self, method, path, json=None, params=None):
+        idempotent = method in ('GET', 'HEAD', 'DELETE')
+        attempt = 0
+        while True:
+            retry_after = None
+            try:
+                response = await self._http.request(method, path, json=json, params=params)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout):
+                # The request never reached Razorpay
+                if attempt >= self.max_retries:
+                    raise
+            except (httpx.ReadTimeout, httpx.RemoteProtocolError):
+                # Razorpay may have acted on it; only repeat reads
+                if not idempotent or attempt >= self.max_retries:
+                    raise
+            else:
+                retryable = response.status_code in RETRY_ANY_METHOD or (
+                    idempotent and response.status_code in RETRY_IDEMPOTENT
+                )
+                if response.is_success:
+                    return response.json()
+                if not retryable or attempt >= self.max_retries:
+                    try:
+                        error = response.json().get('error')
+                    except ValueError:
+                        error = None
+                    raise RazorpayError(response.status_code, error)
+                retry_after = response.headers.get('Retry-After')
+            attempt += 1
+            self.retries += 1
+            await asyncio.sleep(self._delay(attempt, retry_after))
+
+    def _delay(self, attempt, retry_after=None):
+        if retry_after:
+            try:
+                return min(float(retry_after), self.max_backoff)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    async def create_order(self, data):
+        return await self.request('POST', '/v1/orders', json=data)
+
+    async def create_payment_link(self, data):
+        return await self.request('POST', '/v1/payment_links', json=data)
+
+    async def fetch_payment_link(self, payment_link_id):
+        return await self.request('GET', f"/v1/payment_links/{payment_link_id}")
+
+    async def aclose(self):
+        await self._http.aclose()
+
+
+class BackgroundLoop:
+    """An event loop on a daemon thread, for calling async code from sync handlers"""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name='razorpay-loop', daemon=True)
+        self._thread.start()
+
+    def run(self, coro, timeout=None):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
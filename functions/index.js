@@ -391,6 +391,103 @@ exports.testScheduledPosts = functions.https.onRequest((req, res) => {
   });
 });
 
+// Subscription expiry sweeper
+// Pages through active users whose subscriptionEndDate has passed, using the
+// (subscriptionStatus, subscriptionEndDate) index, and marks them expired with
+// a BulkWriter. The cursor is checkpointed after every page so a run that hits
+// its time budget resumes where it stopped instead of rescanning.
+const EXPIRY_PAGE_SIZE = 500;
+const EXPIRY_TIME_BUDGET_MS = 240 * 1000;
+const FAILED_PRECONDITION = 9;
+
+async function sweepExpiredSubscriptions(now = new Date()) {
+  const checkpointRef = db.collection('sweeper_checkpoints').doc('subscriptionExpiry');
+  const checkpointDoc = await checkpointRef.get();
+  const checkpoint = checkpointDoc.exists ? checkpointDoc.data() : {};
+  let cursor = checkpoint.cursorUserId ? [checkpoint.cursorEndDate, checkpoint.cursorUserId] : null;
+
+  const deadline = Date.now() + EXPIRY_TIME_BUDGET_MS;
+  const writer = db.bulkWriter();
+  let expired = 0;
+  let skipped = 0;
+  let scanned = 0;
+  let done = false;
+
+  writer.onWriteError((error) => {
+    // The user renewed (or changed) after we read them; leave them alone
+    if (error.code === FAILED_PRECONDITION) {
+      return false;
+    }
+    return error.failedAttempts < 5;
+  });
+
+  while (Date.now() < deadline) {
+    let query = db.collection('users')
+      .where('subscriptionStatus', '==', 'active')
+      .where('subscriptionEndDate', '<=', now)
+      .orderBy('subscriptionEndDate')
+      .orderBy(admin.firestore.FieldPath.documentId())
+      .select('subscriptionEndDate')
+      .limit(EXPIRY_PAGE_SIZE);
+    if (cursor) {
+      query = query.startAfter(...cursor);
+    }
+
+    const page = await query.get();
+    scanned += page.size;
+    page.docs.forEach(doc => {
+      writer.update(doc.ref, {
+        subscription: 'Free',
+        subscriptionStatus: 'expired',
+        updatedAt: admin.firestore.FieldValue.serverTimestamp()
+      }, { lastUpdateTime: doc.updateTime })
+        .then(() => { expired++; })
+        .catch(() => { skipped++; });
+    });
+    await writer.flush();
+
+    if (page.size < EXPIRY_PAGE_SIZE) {
+      done = true;
+      break;
+    }
+    const last = page.docs[page.docs.length - 1];
+    cursor = [last.get('subscriptionEndDate'), last.id];
+    await checkpointRef.set({
+      cursorEndDate: cursor[0],
+      cursorUserId: cursor[1],
+      updatedAt: admin.firestore.FieldValue.serverTimestamp()
+    }, { merge: true });
+  }
+  await writer.close();
+
+  if (done) {
+    await checkpointRef.set({
+      cursorEndDate: null,
+      cursorUserId: null,
+      lastCompletedAt: now,
+      lastExpiredCount: expired,
+      updatedAt: admin.firestore.FieldValue.serverTimestamp()
+    }, { merge: true });
+  }
+
+  return { scanned, expired, skipped, done };
+}
+
+exports.expireSubscriptions = functions
+  .runWith({ timeoutSeconds: 300, memory: '256MB' })
+  .pubsub.schedule('every 15 minutes')
+  .onRun(async (context) => {
+    try {
+      const result = await sweepExpiredSubscriptions();
+      console.log(`✅ [EXPIRY_SWEEP] Scanned ${result.scanned}, expired ${result.expired}, skipped ${result.skipped}` +
+        (result.done ? '' : ' (time budget reached, will resume from checkpoint)'));
+      return { success: true, ...result };
+    } catch (error) {
+      console.error('❌ [EXPIRY_SWEEP] Error expiring subscriptions:', error);
+      return { success: false, error: error.message };
+    }
+  });
+
 // Health check endpoint
 exports.healthCheck = functions.https.onRequest((req, res) => {
   cors(req, res, () => {